@@ -50,17 +50,14 @@ class ArtFormEditor(QWidget):
 
     def load_art_forms(self):
         """Load art forms from the JSON file."""
-        art_styles = json_handler.load_art_styles()
-        return [art_style["name"] for art_style in art_styles]
+        return json_handler.get_art_style_names()
 
     def select_art_form(self):
         """Load the description of the selected art form."""
         self.selected_art_form = self.art_form_dropdown.currentText()
-        art_styles = json_handler.load_art_styles()
-        for art_style in art_styles:
-            if art_style["name"] == self.selected_art_form:
-                self.description_edit.setText(art_style["description"])
-                break
+        art_style = json_handler.get_art_style(self.selected_art_form)
+        if art_style is not None:
+            self.description_edit.setText(art_style["description"])
 
     def save_changes(self):
         """Save changes to the selected art form."""
@@ -0,0 +1,339 @@
+"""
+asyncio variant of the batch restyle engine.
+
+Every stage is a set of coroutines on one event loop connected by bounded
+asyncio queues, so hundreds of requests can be in flight without a thread
+each: image N's waifu2x call overlaps image N+1's image-editor call, and
+the queues stop a fast stage from running away from a slow one. The
+restyled image travels to waifu2x as bytes and is never written to disk.
+
+Requires httpx (pip install httpx).
+"""
+import os
+import time
+import shutil
+import asyncio
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import deepai_client
+import metrics
+import restyle_engine
+import restyle_pipelines
+
+
+class AsyncDeepAIClient:
+    """
+    httpx-based counterpart of deepai_client.DeepAIClient: one pooled
+    AsyncClient, the same retry/backoff rules and an optional token-bucket
+    rate limit. Use it as an async context manager.
+    """
+
+    def __init__(self, api_key, base_url=deepai_client.DEEPAI_BASE_URL, timeout=(10, 120), max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, rate_limit=None, burst=None, max_connections=32):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = deepai_client.TokenBucket(rate_limit, burst) if rate_limit else None
+        self.retries = 0
+
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    def endpoint_url(self, endpoint):
+        return f"{self.base_url}/{endpoint}"
+
+    async def _send(self, method, url, rate_limited=True, **kwargs):
+        """Send a request, retrying transient failures; returns the final (streamed) response."""
+        for attempt in range(self.max_retries + 1):
+            if rate_limited and self.rate_limiter:
+                await self.rate_limiter.acquire_async()
+
+            retry_after = None
+            try:
+                request = self.client.build_request(method, url, **kwargs)
+                response = await self.client.send(request, stream=True)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                error = f"{e.__class__.__name__}: {e}"
+            else:
+                if response.status_code not in deepai_client.RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After')
+                await response.aclose()
+
+            if attempt == self.max_retries:
+                break
+            self.retries += 1
+            metrics.increment('deepai_retries_total', reason=error.split(':')[0])
+            await asyncio.sleep(deepai_client.backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after))
+        raise deepai_client.DeepAIError(f"{method} {url} failed after {self.max_retries + 1} attempts: {error}")
+
+    async def post_image(self, endpoint, files, stage=None):
+        """POST {name: (filename, bytes)} to a DeepAI image endpoint and return the output URL."""
+        # httpx sends the body inside send(), so upload and server wait are one span here
+        with metrics.span('api_call', endpoint=endpoint) as span:
+            response = await self._send('POST', self.endpoint_url(endpoint), files=files,
+                                        headers={'api-key': self.api_key})
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            span.add_bytes(sum(len(content) for _, content in files.values()))
+        metrics.increment('deepai_requests_total', endpoint=endpoint, status=response.status_code)
+        stage = stage or endpoint
+        if response.status_code != 200:
+            raise deepai_client.DeepAIError(f"{stage} failed with status {response.status_code}")
+        data = response.json()
+        if 'output_url' not in data:
+            raise deepai_client.DeepAIError(f"No output URL found in the {stage} response: {data}")
+        return data['output_url']
+
+    async def restyle(self, image_data, prompt):
+        return await self.post_image('image-editor', {
+            'image': ('image', bytes(image_data)),
+            'text': ('prompt.txt', prompt.encode('utf-8')),
+        }, stage="restyling")
+
+    async def upscale(self, image_data):
+        return await self.post_image('waifu2x', {'image': ('image', bytes(image_data))}, stage="clarity enhancement")
+
+    async def fetch(self, url):
+        """Download a result image and return its bytes."""
+        with metrics.span('download') as span:
+            response = await self._send('GET', url, rate_limited=False)
+            try:
+                if response.status_code != 200:
+                    raise deepai_client.DeepAIError(f"Download of {url} failed with status {response.status_code}")
+                data = await response.aread()
+            finally:
+                await response.aclose()
+            span.add_bytes(len(data))
+        return data
+
+    async def download(self, url, *files, chunk_size=1 << 16, executor=None):
+        """
+        Stream a result image into every given file object; returns the bytes
+        written. With an executor the writes run there instead of on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        with metrics.span('download') as span:
+            response = await self._send('GET', url, rate_limited=False)
+            try:
+                if response.status_code != 200:
+                    raise deepai_client.DeepAIError(f"Download of {url} failed with status {response.status_code}")
+                async for chunk in response.aiter_bytes(chunk_size):
+                    if executor is None:
+                        _write_chunk(files, chunk)
+                    else:
+                        await loop.run_in_executor(executor, _write_chunk, files, chunk)
+                    span.add_bytes(len(chunk))
+            finally:
+                await response.aclose()
+        return span.bytes
+
+
+class AsyncRestyleEngine(restyle_engine.RestyleEngine):
+    """
+    RestyleEngine whose stages are coroutines on one event loop.
+
+    Takes the same arguments, runs the same stages for the same pipelines and
+    returns the same report. Network stages await the AsyncDeepAIClient; file
+    and CPU work is handed to threads or the shared process pool so it never
+    blocks the loop. Worker counts are coroutines per stage, so they can be
+    far higher than with threads.
+    """
+
+    # Waiting coroutines are cheap, so the network stages get more of them by default
+    NETWORK_WORKERS = {'restyle': 8, 'fetch': 8, 'upscale': 8, 'download': 8}
+
+    def __init__(self, api_key, prompt, workers=None, client_options=None, **kwargs):
+        super().__init__(api_key, prompt, workers={**self.NETWORK_WORKERS, **(workers or {})}, **kwargs)
+        # Keyword arguments for AsyncDeepAIClient (timeout, max_retries, rate_limit, ...)
+        self.client_options = client_options or {}
+        self.client = None
+        self._writer = None
+
+    async def _stage_describe(self, job):
+        job.description = await asyncio.to_thread(self.describer, job.image_path)
+
+    async def _stage_preprocess(self, job):
+        job.upload_data, original_size = await asyncio.to_thread(self.preprocessor.prepare, job.image_path)
+        job.bytes_saved = original_size - len(job.upload_data)
+
+    async def _stage_restyle(self, job):
+        data = job.upload_data
+        if data is None:
+            data = await asyncio.to_thread(_read_file, job.image_path)
+        # Hashing the image and statting the cache entry both block, so they run on threads
+        job.restyle_key = await asyncio.to_thread(restyle_engine.restyle_key, data, self.prompt)
+        job.restyled_path = await asyncio.to_thread(self._lookup, job.restyle_key)
+        if job.restyled_path is None:
+            job.restyled_url = await self.client.restyle(data, self.prompt)
+        job.upload_data = None
+
+    async def _stage_fetch(self, job):
+        if job.restyled_path is not None:
+            job.restyled_data = await asyncio.to_thread(_read_file, job.restyled_path)
+        else:
+            job.restyled_data = await self.client.fetch(job.restyled_url)
+            if self.cache is not None:
+                await self._write(self.cache.put, job.restyle_key, job.restyled_data)
+
+    async def _stage_upscale(self, job):
+        job.upscale_key = await asyncio.to_thread(restyle_engine.upscale_key, job.restyled_data)
+        job.result_path = await asyncio.to_thread(self._lookup, job.upscale_key)
+        if job.result_path is None:
+            job.result_url = await self.client.upscale(job.restyled_data)
+        job.restyled_data = None
+
+    async def _stage_download(self, job):
+        if self.upscale:
+            key, path, url = job.upscale_key, job.result_path, job.result_url
+        else:
+            key, path, url = job.restyle_key, job.restyled_path, job.restyled_url
+        if path is not None:
+            await asyncio.to_thread(shutil.copyfile, path, job.output_path)
+            return
+
+        def open_files():
+            files = contextlib.ExitStack()
+            outputs = [files.enter_context(open(job.output_path, 'wb'))]
+            if self.cache is not None:
+                outputs.append(files.enter_context(self.cache.writer(key)))
+            return files, outputs
+
+        # Opening, writing and closing (which commits the cache entry) all happen on the writer thread
+        files, outputs = await self._write(open_files)
+        try:
+            await self.client.download(url, *outputs, executor=self._writer)
+        except BaseException as e:
+            await self._write(files.__exit__, type(e), e, e.__traceback__)
+            await self._write(_remove_quietly, job.output_path)
+            raise
+        await self._write(files.__exit__, None, None, None)
+
+    async def _run_steps(self, input_path, output_path):
+        # run_steps() may fan one image out over the pool and wait on it, so it gets a thread
+        return await asyncio.to_thread(restyle_pipelines.run_steps, input_path, output_path, self.local_steps)
+
+    async def _stage_postprocess(self, job):
+        await self._run_steps(job.output_path, job.output_path)
+
+    async def _stage_local(self, job):
+        await self._run_steps(job.image_path, job.output_path)
+
+    async def _stage_pipeline(self, job):
+        await asyncio.to_thread(self.pipeline.run, job.image_path, self.prompt, self.api_key,
+                                job.output_path, self.cache)
+
+    async def _write(self, function, *args):
+        """Run blocking file or database writes on the engine's writer thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._writer, functools.partial(function, *args))
+
+    async def _worker(self, stage, inbox, outbox):
+        handler = getattr(self, f"_stage_{stage}")
+        while True:
+            job = await inbox.get()
+            if job is restyle_engine._STOP:
+                break
+            if not self._resumed_past(stage, job):
+                start = time.perf_counter()
+                try:
+                    await handler(job)
+                    # Job store writes wait on SQLite, so they stay off the loop
+                    await self._write(self._checkpoint, stage, job)
+                except Exception as e:
+                    job.error = f"{stage}: {e}"
+                self._record(stage, job, time.perf_counter() - start)
+
+            if job.error or outbox is None:
+                # Records the result in the job store and dedup index, and copies it to near duplicates
+                await self._write(self._finish, job)
+            else:
+                await outbox.put(job)
+
+    def run(self, image_paths):
+        """Restyle every image path and return the statistics report."""
+        return asyncio.run(self.run_async(image_paths))
+
+    async def run_async(self, image_paths):
+        await asyncio.to_thread(os.makedirs, self.output_dir, exist_ok=True)
+        await asyncio.to_thread(self._plan_outputs, image_paths)
+        self.reset_stats()
+        self.started_at = time.perf_counter()
+
+        stages = self._active_stages()
+        max_connections = max(self.workers.get(stage, 1) for stage in stages)
+        self.client = AsyncDeepAIClient(self.api_key, max_connections=max(16, max_connections),
+                                        **self.client_options)
+        # One thread for output, cache and job store writes, so a slow disk or a locked
+        # database holds up only the writes, never the requests in flight
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="restyle-writer")
+        try:
+            queues = [asyncio.Queue(maxsize=self.queue_size) for _ in stages]
+            pools = []
+            for index, stage in enumerate(stages):
+                outbox = queues[index + 1] if index + 1 < len(stages) else None
+                pools.append([
+                    asyncio.create_task(self._worker(stage, queues[index], outbox))
+                    for _ in range(max(1, self.workers.get(stage, 1)))
+                ])
+
+            if self.dedup is not None:
+                image_paths = await asyncio.to_thread(self._plan_duplicates, image_paths)
+
+            # Feeding waits once the first queue is full, bounding memory use. The job
+            # store is read (and skipped images' duplicates copied) off the loop
+            jobs = self._jobs(image_paths)
+            while True:
+                job = await asyncio.to_thread(next, jobs, None)
+                if job is None:
+                    break
+                await queues[0].put(job)
+
+            # Shut the stages down in order so every job drains through
+            for index, tasks in enumerate(pools):
+                for _ in tasks:
+                    await queues[index].put(restyle_engine._STOP)
+                await asyncio.gather(*tasks)
+        finally:
+            await self.client.close()
+            self.client = None
+            self._writer.shutdown()
+            self._writer = None
+
+        self.finished_at = time.perf_counter()
+        return self.report()
+
+
+def _write_chunk(files, chunk):
+    for file in files:
+        file.write(chunk)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
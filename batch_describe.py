@@ -0,0 +1,71 @@
+import sys
+import json
+import argparse
+import metrics
+import restyle_engine
+import description_cache
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Describe a directory or manifest of photos over one warm browser session.")
+    parser.add_argument('source', help="Directory of images or a manifest file (.json list or one path per line)")
+    parser.add_argument('--pages', type=int, default=1, help="Browser pages describing images at the same time")
+    parser.add_argument('--output', default=None, help="Also write {image path: description} to this JSON file")
+    parser.add_argument('--refresh', action='store_true', help="Describe images again even if already cached")
+    parser.add_argument('--headed', action='store_true', help="Show the browser window")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    metrics.configure_logging()
+    import description_pool  # Imported late so --help works without Playwright
+
+    image_paths = restyle_engine.collect_images(args.source)
+    if not image_paths:
+        print("No images found.")
+        return 1
+
+    cache = description_cache.get_shared_description_cache()
+    descriptions = {}
+    if not args.refresh:
+        for image_path in image_paths:
+            description = cache.get(image_path)
+            if description is not None:
+                descriptions[image_path] = description
+    pending = [image_path for image_path in image_paths if image_path not in descriptions]
+    print(f"{len(descriptions)} image(s) already described, {len(pending)} to go")
+
+    total = len(pending)
+    done = 0
+    failed = 0
+
+    def on_result(image_path, result):
+        nonlocal done, failed
+        done += 1
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"[{done}/{total}] {image_path} failed ({result})")
+            return
+        cache.put(image_path, result)
+        descriptions[image_path] = result
+        print(f"[{done}/{total}] {image_path}")
+
+    pool = description_pool.DescriptionBrowserPool(size=args.pages, headless=not args.headed)
+    try:
+        if pending:
+            pool.describe_all(pending, on_result)
+    finally:
+        pool.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({image_path: descriptions[image_path] for image_path in image_paths
+                       if image_path in descriptions}, file, indent=4)
+    print(f"Described: {len(descriptions)}  Failed: {failed}")
+    return 0 if failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import sys
+import argparse
+import restyle_engine
+import deepai_client
+import result_cache
+import preprocess
+import job_store
+import metrics
+import phash_index
+import restyle_pipelines
+from restyle_pipelines import registry
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Restyle a directory or manifest of photos without the GUI.")
+    parser.add_argument('source', help="Directory of images or a manifest file (.json list or one path per line)")
+    parser.add_argument('--style', required=True, help="Art style name from art_styles.json")
+    parser.add_argument('--styles-file', default='art_styles.json', help="Path to the art styles JSON file")
+    parser.add_argument('--output-dir', default='Restyled', help="Where restyled images are written")
+    parser.add_argument('--key-file', default='storage.txt', help="File containing the 'deepai-key:' line")
+    parser.add_argument('--restyle-workers', type=int, default=None, help="Default: 4 (8 with --async)")
+    parser.add_argument('--fetch-workers', type=int, default=None, help="Default: 2 (8 with --async)")
+    parser.add_argument('--upscale-workers', type=int, default=None, help="Default: 4 (8 with --async)")
+    parser.add_argument('--download-workers', type=int, default=None, help="Default: 2 (8 with --async)")
+    parser.add_argument('--postprocess-workers', type=int, default=None,
+                        help="Threads feeding the local process pool for styles with a local step (default: CPU count)")
+    parser.add_argument('--local-workers', type=int, default=None,
+                        help="Threads feeding the local process pool for offline styles (default: CPU count)")
+    parser.add_argument('--fallback-style', default=None,
+                        help="Art style used for an image when the --style pipeline fails or is too slow")
+    parser.add_argument('--fallback-after', type=float, default=None,
+                        help="Seconds to wait for the --style pipeline before using --fallback-style")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Run the stages as coroutines on one event loop (needs httpx)")
+    parser.add_argument('--job-db', default=None,
+                        help="SQLite job database; progress is saved there and a rerun resumes where it stopped")
+    parser.add_argument('--max-attempts', type=int, default=3, help="Runs an image may fail in before it is given up")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Give images that used up their attempts in --job-db another set of attempts")
+    parser.add_argument('--describe', action='store_true',
+                        help="Generate a description for each image first, written next to its result "
+                             "as a .txt file (and kept in --job-db)")
+    parser.add_argument('--dedup-db', default=None,
+                        help="Perceptual-hash index used to spot near-duplicate inputs before calling DeepAI")
+    parser.add_argument('--dedup-threshold', type=int, default=phash_index.DEFAULT_THRESHOLD,
+                        help="Differing hash bits (out of 64) that still count as a near duplicate")
+    parser.add_argument('--dedup-mode', choices=('reuse', 'flag'), default='reuse',
+                        help="Reuse one result for a group of near duplicates, or only report them")
+    parser.add_argument('--queue-size', type=int, default=16, help="Maximum jobs waiting between two stages")
+    parser.add_argument('--no-upscale', action='store_true', help="Skip the waifu2x clarity enhancement")
+    parser.add_argument('--local-upscale', action='store_true',
+                        help="Upscale the restyled image locally instead of with waifu2x")
+    parser.add_argument('--max-side', type=int, default=preprocess.DEFAULT_MAX_SIDE,
+                        help="Longest side, in pixels, of images uploaded to DeepAI")
+    parser.add_argument('--upload-format', default=preprocess.DEFAULT_FORMAT, choices=preprocess.UPLOAD_FORMATS,
+                        type=str.upper, help="Format uploads are re-encoded to")
+    parser.add_argument('--upload-quality', type=int, default=preprocess.DEFAULT_QUALITY,
+                        help="Encoder quality of re-encoded uploads")
+    parser.add_argument('--no-preprocess', action='store_true',
+                        help="Upload the original files without resizing or re-encoding them")
+    parser.add_argument('--rate-limit', type=float, default=None, help="Maximum DeepAI API calls per second")
+    parser.add_argument('--burst', type=int, default=None, help="Calls allowed in a burst above the rate limit")
+    parser.add_argument('--max-retries', type=int, default=5, help="Retries for 429/5xx and connection errors")
+    parser.add_argument('--timeout', type=float, default=120, help="Read timeout in seconds for each request")
+    parser.add_argument('--cache-dir', default=result_cache.DEFAULT_CACHE_DIR, help="Directory of the API result cache")
+    parser.add_argument('--cache-max-mb', type=int, default=result_cache.DEFAULT_MAX_BYTES // 1024 ** 2)
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, even for repeated inputs")
+    parser.add_argument('--log-level', default='WARNING', type=str.upper,
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), help="Level of diagnostic log messages")
+    parser.add_argument('--metrics-jsonl', default=None, help="Append a JSON line per timed stage to this file")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while the run lasts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    metrics.configure_logging(args.log_level)
+    # Before the process pool starts, so its workers write to the same file
+    if args.metrics_jsonl:
+        metrics.write_jsonl(args.metrics_jsonl)
+    if args.metrics_port is not None:
+        metrics.serve_prometheus(args.metrics_port)
+
+    preprocessor = None
+    if not args.no_preprocess:
+        preprocessor = preprocess.UploadPreprocessor(args.max_side, args.upload_format, args.upload_quality)
+
+    pipeline = registry.get_style_pipeline(args.style, args.styles_file, preprocessor)
+    if args.no_upscale or args.local_upscale:
+        # Only a plain DeepAI restyle has an upscale step to skip or replace
+        if not isinstance(pipeline, registry.RemotePipeline):
+            flag = '--no-upscale' if args.no_upscale else '--local-upscale'
+            print(f"{flag} only applies to styles restyled by DeepAI alone; "
+                  f"{args.style} runs a {type(pipeline).__name__}, which decides its own steps.")
+            return 1
+        pipeline = registry.RemotePipeline(upscale=False if args.no_upscale else 'local', preprocessor=preprocessor)
+    if args.fallback_style:
+        fallback_prompt = restyle_engine.get_art_style_prompt(args.fallback_style, args.styles_file)
+        if fallback_prompt is None:
+            print(f"Art style not found: {args.fallback_style}")
+            return 1
+        fallback = registry.get_style_pipeline(args.fallback_style, args.styles_file, preprocessor)
+        pipeline = registry.FallbackPipeline(pipeline, fallback, args.fallback_after, fallback_prompt)
+
+    # Offline styles never talk to DeepAI, so they do not need a key
+    api_key = restyle_engine.load_deepai_key(args.key_file)
+    if not api_key and not registry.is_offline(pipeline):
+        print("No DeepAI API key available.")
+        return 1
+
+    # Configure the shared client before the engine first uses it
+    workers = {
+        'restyle': args.restyle_workers,
+        'fetch': args.fetch_workers,
+        'upscale': args.upscale_workers,
+        'download': args.download_workers,
+        'postprocess': args.postprocess_workers,
+        'local': args.local_workers,
+    }
+    workers = {stage: count for stage, count in workers.items() if count}
+    pool_size = max([4] + [workers.get(stage, 0) for stage in ('restyle', 'fetch', 'upscale', 'download')])
+    deepai_client.get_client(
+        api_key,
+        timeout=(10, args.timeout),
+        max_retries=args.max_retries,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        pool_size=max(16, 2 * pool_size),
+    )
+
+    prompt = restyle_engine.get_art_style_prompt(args.style, args.styles_file)
+    if prompt is None:
+        print(f"Art style not found: {args.style}")
+        return 1
+
+    image_paths = restyle_engine.collect_images(args.source)
+    if not image_paths:
+        print("No images found.")
+        return 1
+
+    total = len(image_paths)
+    cache = None
+    if not args.no_cache:
+        cache = result_cache.ResultCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 ** 2)
+
+    def on_progress(job, done):
+        status = f"failed ({job.error})" if job.error else f"-> {job.output_path}"
+        if job.reused_from:
+            status += f" (reused result of near duplicate {job.reused_from})"
+        if job.bytes_saved >= 1024:
+            status += f" ({job.bytes_saved / 1024:.0f} KB smaller upload)"
+        print(f"[{done}/{total}] {job.image_path} {status}")
+
+    store = None
+    if args.job_db:
+        store = job_store.JobStore(args.job_db, max_attempts=args.max_attempts)
+        if args.retry_failed:
+            print(f"Retrying {store.retry_failed(args.style)} failed image(s)")
+
+    describer = None
+    if args.describe:
+        import description_pool  # Playwright is only needed for --describe
+        import description_cache
+        descriptions = description_cache.get_shared_description_cache()
+        pool = description_pool.get_shared_pool()
+
+        def describer(image_path):
+            return descriptions.get_or_describe(image_path, pool.describe)
+
+    dedup = phash_index.PHashIndex(args.dedup_db, args.dedup_threshold) if args.dedup_db else None
+
+    options = dict(
+        dedup=dedup,
+        dedup_mode=args.dedup_mode,
+        job_store=store,
+        style=args.style,
+        describer=describer,
+        output_dir=args.output_dir,
+        workers=workers,
+        queue_size=args.queue_size,
+        upscale=not args.no_upscale,
+        on_progress=on_progress,
+        cache=cache,
+        pipeline=pipeline,
+    )
+    if args.use_async:
+        import async_engine  # httpx is only needed for --async
+        client = deepai_client.get_client(api_key)
+        engine = async_engine.AsyncRestyleEngine(api_key, prompt, client_options={
+            'base_url': client.base_url,
+            'timeout': client.timeout,
+            'max_retries': client.max_retries,
+            'rate_limit': args.rate_limit,
+            'burst': args.burst,
+        }, **options)
+    else:
+        engine = restyle_engine.RestyleEngine(api_key, prompt, **options)
+    try:
+        report = engine.run(image_paths)
+    except restyle_engine.OutputCollision as e:
+        print(f"Output path collision: {e}")
+        return 1
+    finally:
+        restyle_pipelines.shutdown()
+    print(restyle_engine.format_report(report))
+    if store is not None:
+        counts = store.counts(args.style)
+        print("  jobs       " + "  ".join(f"{state}={counts[state]}" for state in (*job_store.STATES, job_store.FAILED)
+                                         if state in counts))
+    return 0 if report['failed'] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Compare cold per-call description generation with the warm browser pool.
+
+Runs offline against benchmarks/stand_ins/description_generator.html, e.g.
+
+    python benchmarks/description_pool_bench.py Photos/example.jpg --runs 10 --pool-size 2
+"""
+import os
+import sys
+import time
+import argparse
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_description
+import description_pool
+from restyle_engine import percentile
+
+STAND_IN_PAGE = pathlib.Path(__file__).parent / 'stand_ins' / 'description_generator.html'
+
+
+def stand_in_url(upload_ms, work_ms):
+    return f"{STAND_IN_PAGE.resolve().as_uri()}?upload_ms={upload_ms}&work_ms={work_ms}"
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def summarize(name, durations, wall):
+    print(f"{name:<6} n={len(durations)}  p50={percentile(durations, 50):.3f}s  "
+          f"p95={percentile(durations, 95):.3f}s  wall={wall:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image', help="Image to upload to the stand-in page")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--upload-ms', type=int, default=300)
+    parser.add_argument('--work-ms', type=int, default=1000)
+    args = parser.parse_args()
+
+    url = stand_in_url(args.upload_ms, args.work_ms)
+    print(f"Site work per image: {(args.upload_ms + args.work_ms) / 1000:.3f}s")
+
+    start = time.perf_counter()
+    cold = [timed(image_description.describe_image, args.image, url=url) for _ in range(args.runs)]
+    summarize("cold", cold, time.perf_counter() - start)
+
+    pool = description_pool.DescriptionBrowserPool(size=args.pool_size, url=url)
+    pool.start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.pool_size) as executor:
+            warm = list(executor.map(lambda _: timed(pool.describe, args.image), range(args.runs)))
+        summarize("pool", warm, time.perf_counter() - start)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the DeepAI image-editor and waifu2x endpoints.
+
+Each POST stores the uploaded image and answers with an output_url that
+serves it back, so the real client code paths run end to end offline.
+Latency, error rate and 429 rate are configurable (and tests can script
+the statuses of the first calls), e.g.
+
+    python benchmarks/fake_deepai.py --port 8765 --latency 0.5 --rate-429 0.1
+
+and point the client at it with DeepAIClient(api_key, base_url="http://127.0.0.1:8765/api").
+"""
+import re
+import time
+import random
+import argparse
+import threading
+import itertools
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = ('image-editor', 'waifu2x')
+
+
+class FakeDeepAIServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the fake service's settings and outputs."""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_429=0.0, retry_after=None, download_latency=0.0, statuses=()):
+        super().__init__(address, FakeDeepAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.download_latency = download_latency
+        # Statuses the first POSTs get, in order, before the random ones apply (200 = answer normally)
+        self.statuses = collections.deque(statuses)
+        self.outputs = {}
+        self.calls = {endpoint: 0 for endpoint in ENDPOINTS}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        """Serve in a background thread; returns self for chaining."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def store(self, data):
+        with self._lock:
+            output_id = next(self._ids)
+            self.outputs[output_id] = data
+        return output_id
+
+
+def _extract_image(body, content_type):
+    """Pull the 'image' part out of a multipart/form-data body."""
+    match = re.search(r'boundary=("?)([^";]+)\1', content_type or '')
+    if not match:
+        return b''
+    boundary = b'--' + match.group(2).encode('latin-1')
+    for part in body.split(boundary):
+        headers, _, content = part.partition(b'\r\n\r\n')
+        if b'name="image"' in headers:
+            return content[:-2] if content.endswith(b'\r\n') else content
+    return b''
+
+
+class FakeDeepAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real service
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint not in ENDPOINTS:
+            self._send(404, b'{"err": "unknown endpoint"}')
+            return
+        with server._lock:
+            server.calls[endpoint] += 1
+            status = server.statuses.popleft() if server.statuses else None
+
+        if status == 429 or status is None and random.random() < server.rate_429:
+            headers = {'Retry-After': str(server.retry_after)} if server.retry_after is not None else None
+            self._send(429, b'{"err": "rate limited"}', headers=headers)
+            return
+        if status not in (None, 200):
+            self._send(status, b'{"err": "scripted failure"}')
+            return
+        if status is None and random.random() < server.error_rate:
+            self._send(503, b'{"err": "temporarily unavailable"}')
+            return
+        if not self.headers.get('api-key'):
+            self._send(401, b'{"err": "missing api key"}')
+            return
+
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        output_id = server.store(_extract_image(body, self.headers.get('Content-Type')))
+        host, port = server.server_address[:2]
+        output_url = f"http://{host}:{port}/outputs/{output_id}.jpg"
+        self._send(200, f'{{"id": "{output_id}", "output_url": "{output_url}"}}'.encode('utf-8'))
+
+    def do_GET(self):
+        server = self.server
+        match = re.fullmatch(r'/outputs/(\d+)\.jpg', self.path)
+        data = server.outputs.get(int(match.group(1))) if match else None
+        if data is None:
+            self._send(404, b'not found', content_type='text/plain')
+            return
+        time.sleep(server.download_latency)
+        self._send(200, data, content_type='image/jpeg')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds each API call takes")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with 503")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After header sent with 429s")
+    parser.add_argument('--download-latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeDeepAIServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, rate_429=args.rate_429,
+                              retry_after=args.retry_after, download_latency=args.download_latency)
+    print(f"Fake DeepAI listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark the Pillow and NumPy hand-drawn engines on large synthetic photos.
+
+Both engines get the same noise plane so their outputs can be compared
+pixel for pixel, e.g.
+
+    python benchmarks/hand_drawn_bench.py --megapixels 12 24 48
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'restyle_pipelines'))
+
+import hand_drawn
+
+
+def synthetic_photo(megapixels, seed=0):
+    """A 3:2 image with gradients and texture so the filters have edges to work on."""
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[..., 0] = x
+    rgb[..., 1] = y
+    rgb[..., 2] = (x + y) % 256
+    rgb += rng.integers(0, 16, size=(height, width, 1), dtype=np.uint8)
+    return rgb
+
+
+def best_of(repeat, function):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[12, 24, 48])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--band-rows', type=int, default=hand_drawn.DEFAULT_BAND_ROWS)
+    args = parser.parse_args()
+
+    print(f"{'MP':>5} {'size':>12} {'pillow':>9} {'numpy':>9} {'speedup':>8} {'max diff':>9} {'mean diff':>10}")
+    for megapixels in args.megapixels:
+        rgb = synthetic_photo(megapixels)
+        height, width = rgb.shape[:2]
+        noise = np.clip(128 + hand_drawn.NOISE_SIGMA * np.random.default_rng(1).standard_normal(
+            (height, width), dtype=np.float32), 0, 255).astype(np.uint8)
+
+        image, noise_image = Image.fromarray(rgb), Image.fromarray(noise)
+        pillow_time, reference = best_of(args.repeat, lambda: hand_drawn.hand_drawn_pillow(image, noise_image))
+        numpy_time, result = best_of(args.repeat, lambda: hand_drawn.hand_drawn_numpy(
+            rgb, noise=noise, band_rows=args.band_rows))
+
+        diff = np.abs(np.asarray(reference, dtype=np.int16) - result)
+        print(f"{megapixels:>5g} {f'{width}x{height}':>12} {pillow_time:>8.2f}s {numpy_time:>8.2f}s "
+              f"{pillow_time / numpy_time:>7.2f}x {diff.max():>9} {diff.mean():>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
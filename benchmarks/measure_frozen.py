@@ -0,0 +1,148 @@
+"""
+Build the frozen app from main.spec and measure its start-up time and size.
+
+    python benchmarks/measure_frozen.py --output before.json
+    git checkout my-branch
+    python benchmarks/measure_frozen.py --output after.json --compare before.json
+
+    python benchmarks/measure_frozen.py --spec-args --onefile     # measure the one-file layout
+    python benchmarks/measure_frozen.py --no-build                 # measure an existing dist/
+
+Start-up is the time from launching the executable until its main window is
+shown (main.py --exit-after-show, see startup_profile). The first launch
+after a build is reported separately, as it runs with cold caches; the rest
+give the median. Size is the whole bundle on disk, with its largest parts.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import startup_profile
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build(spec_args, dist_dir, work_dir):
+    command = [sys.executable, '-m', 'PyInstaller', '--noconfirm', '--clean',
+               '--distpath', dist_dir, '--workpath', work_dir, os.path.join(ROOT, 'main.spec')]
+    if spec_args:
+        command += ['--'] + spec_args
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def find_executable(dist_dir):
+    """(executable, bundle path) of a one-dir or one-file build of main.spec."""
+    name = 'main.exe' if sys.platform == 'win32' else 'main'
+    for executable, bundle in ((os.path.join(dist_dir, 'main', name), os.path.join(dist_dir, 'main')),
+                               (os.path.join(dist_dir, name), os.path.join(dist_dir, name))):
+        if os.path.isfile(executable):
+            return executable, bundle
+    raise FileNotFoundError(f"No frozen app in {dist_dir}; build it first or drop --no-build")
+
+
+def bundle_size(bundle, top=15):
+    """Total bytes and file count of a bundle, and its largest top-level parts."""
+    if os.path.isfile(bundle):
+        return {'bytes': os.path.getsize(bundle), 'files': 1, 'largest': []}
+    parts, files = {}, 0
+    for directory, _, names in os.walk(bundle):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, bundle).split(os.sep)
+            # Group by package: _internal/PySide6/... counts as _internal/PySide6
+            part = os.path.join(*relative[:2]) if relative[0] == '_internal' and len(relative) > 2 else relative[0]
+            parts[part] = parts.get(part, 0) + os.path.getsize(path)
+            files += 1
+    largest = sorted(parts.items(), key=lambda item: -item[1])[:top]
+    return {'bytes': sum(parts.values()), 'files': files,
+            'largest': [{'path': path, 'bytes': size} for path, size in largest]}
+
+
+def measure_startup(executable, runs):
+    timings = [startup_profile.time_to_window([executable, '--exit-after-show'])[0] for _ in range(runs + 1)]
+    first, warm = timings[0], sorted(timings[1:])
+    return {'first_s': round(first, 4), 'median_s': round(warm[len(warm) // 2], 4),
+            'min_s': round(warm[0], 4), 'max_s': round(warm[-1], 4), 'runs': runs}
+
+
+def compare(report, baseline_file):
+    with open(baseline_file, encoding='utf-8') as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for key in ('first_s', 'median_s'):
+        before, after = baseline['startup'][key], report['startup'][key]
+        print(f"  startup {key:<9} {before * 1000:8.0f} ms -> {after * 1000:8.0f} ms  ({after - before:+.3f}s)")
+    before, after = baseline['size']['bytes'], report['size']['bytes']
+    print(f"  bundle size       {before / 1024 ** 2:8.1f} MB -> {after / 1024 ** 2:8.1f} MB  "
+          f"({(after - before) / 1024 ** 2:+.1f} MB)")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-build', action='store_true', help="Measure the existing build in --dist")
+    parser.add_argument('--dist', default=os.path.join(ROOT, 'dist'), help="PyInstaller output directory")
+    parser.add_argument('--runs', type=int, default=5, help="Launches after the first, for the median")
+    parser.add_argument('--output', default='frozen_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier results file to compare against")
+    parser.add_argument('--spec-args', nargs=argparse.REMAINDER, default=[],
+                        help="Options for main.spec, e.g. --onefile --no-playwright (must come last)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    build_seconds = None
+    if not args.no_build:
+        work_dir = os.path.join(ROOT, 'build', 'measure')
+        if os.path.isdir(args.dist):
+            shutil.rmtree(args.dist)  # A stale one-dir build would shadow a one-file one
+        build_seconds = build(args.spec_args, args.dist, work_dir)
+    executable, bundle = find_executable(args.dist)
+
+    size = bundle_size(bundle)
+    print(f"bundle {bundle}: {size['bytes'] / 1024 ** 2:.1f} MB in {size['files']} files")
+    for part in size['largest']:
+        print(f"  {part['bytes'] / 1024 ** 2:8.1f} MB  {part['path']}")
+    startup = measure_startup(executable, args.runs)
+    print(f"start-up: first {startup['first_s'] * 1000:.0f} ms, median {startup['median_s'] * 1000:.0f} ms "
+          f"(min {startup['min_s'] * 1000:.0f}, max {startup['max_s'] * 1000:.0f}) over {args.runs} runs")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'layout': 'onedir' if os.path.isdir(bundle) else 'onefile',
+            'spec_args': args.spec_args,
+            'build_s': round(build_seconds, 1) if build_seconds is not None else None,
+        },
+        'size': size,
+        'startup': startup,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
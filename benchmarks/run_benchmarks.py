@@ -0,0 +1,303 @@
+"""
+Benchmark suite: the real restyle, hand-drawn and style-store code paths,
+run offline against the fake DeepAI server (and, if Playwright is
+installed, the stand-in description page).
+
+Every case runs across the requested image sizes and concurrency levels and
+reports throughput, latency percentiles, errors and peak memory. Results are
+written as JSON tagged with the git commit, so two runs can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Cases:
+    restyle            registry.get_style_pipeline(...).run(...), i.e. what restyle_img queues
+    hand_drawn_main    hand_drawn.main: DeepAI call, download, effect
+    hand_drawn_effect  hand_drawn.apply_hand_drawn_effect, NumPy and Pillow engines
+    json_handler       style lookups, name listings and updates
+    describe           description_pool against the stand-in page (needs Playwright)
+
+Peak memory is the Python-tracked peak (tracemalloc, which includes NumPy
+buffers) of each case, plus the process RSS high-water mark after it.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json_handler
+import deepai_client
+import preprocess
+import restyle_pipelines
+from restyle_engine import percentile
+from restyle_pipelines import registry, hand_drawn
+from fake_deepai import FakeDeepAIServer
+from hand_drawn_bench import synthetic_photo
+
+CASES = ('restyle', 'hand_drawn_main', 'hand_drawn_effect', 'json_handler', 'describe')
+API_KEY = 'benchmark-key'
+BENCH_STYLE = {
+    "name": "Benchmark Remote",
+    "description": "Repaint the photo as a watercolour with soft, bleeding edges.",
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def rss_peak_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(name, params, calls, concurrency=1):
+    """
+    Run every zero-argument callable in calls on `concurrency` threads and
+    return the result row. A call that raises or returns None counts as an error.
+    """
+    def timed(call):
+        start = time.perf_counter()
+        try:
+            ok = call() is not None
+        except Exception as e:
+            print(f"  {name}: {e}")
+            ok = False
+        return time.perf_counter() - start, ok
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, calls))
+    wall = time.perf_counter() - start
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = [elapsed for elapsed, _ in outcomes]
+    row = {
+        'case': name,
+        'params': dict(params, concurrency=concurrency),
+        'count': len(outcomes),
+        'errors': sum(1 for _, ok in outcomes if not ok),
+        'wall_s': round(wall, 4),
+        'throughput_per_s': round(len(outcomes) / wall, 3) if wall else None,
+        'latency_s': {
+            'mean': round(sum(latencies) / len(latencies), 4),
+            'p50': round(percentile(latencies, 50), 4),
+            'p95': round(percentile(latencies, 95), 4),
+            'p99': round(percentile(latencies, 99), 4),
+        },
+        'python_peak_mb': round(python_peak / 1024 ** 2, 2),
+        'rss_peak_mb': round(rss_peak_mb(), 1),
+    }
+    print(f"{name:<18} {json.dumps(row['params'], sort_keys=True):<48} "
+          f"{row['throughput_per_s']:>8.2f}/s  p50={row['latency_s']['p50']:.3f}s  "
+          f"p95={row['latency_s']['p95']:.3f}s  err={row['errors']}  peak={row['python_peak_mb']:.0f}MB")
+    return row
+
+
+def write_photo(directory, megapixels):
+    path = os.path.join(directory, f"photo_{megapixels:g}mp.jpg")
+    if not os.path.exists(path):
+        Image.fromarray(synthetic_photo(megapixels)).save(path, quality=90)
+    return path
+
+
+def bench_restyle(args, photos, work_dir, styles_file):
+    rows = []
+    preprocessor = None if args.no_preprocess else preprocess.get_shared_preprocessor()
+    for style_name in args.styles:
+        pipeline = registry.get_style_pipeline(style_name, filename=styles_file, preprocessor=preprocessor)
+        prompt = json_handler.get_art_style(style_name, styles_file)['description']
+        for megapixels, photo in photos.items():
+            for concurrency in args.concurrency:
+                def call(index):
+                    output_path = os.path.join(work_dir, f"restyle_{index}.jpg")
+                    return lambda: pipeline.run(photo, prompt, API_KEY, output_path)
+                rows.append(measure('restyle', {'style': style_name, 'megapixels': megapixels},
+                                    [call(index) for index in range(args.requests)], concurrency))
+    return rows
+
+
+def bench_hand_drawn_main(args, photos, work_dir):
+    rows = []
+    text_path = os.path.join(work_dir, 'description.txt')
+    with open(text_path, 'w', encoding='utf-8') as file:
+        file.write(BENCH_STYLE['description'])
+    for megapixels, photo in photos.items():
+        for concurrency in args.concurrency:
+            def call(index):
+                # main() writes next to its input, so each call gets its own copy
+                image_path = os.path.join(work_dir, f"hand_drawn_{megapixels:g}_{index}.jpg")
+                shutil.copyfile(photo, image_path)
+                return lambda: hand_drawn.main(image_path, text_path, API_KEY)
+            rows.append(measure('hand_drawn_main', {'megapixels': megapixels},
+                                [call(index) for index in range(args.requests)], concurrency))
+    return rows
+
+
+def bench_hand_drawn_effect(args, photos, work_dir):
+    rows = []
+    for engine in ('numpy', 'pillow'):
+        for megapixels, photo in photos.items():
+            output_path = os.path.join(work_dir, f"effect_{engine}_{megapixels:g}.jpg")
+            rows.append(measure('hand_drawn_effect', {'engine': engine, 'megapixels': megapixels},
+                                [lambda: hand_drawn.apply_hand_drawn_effect(photo, engine, output_path)] * args.repeat))
+    return rows
+
+
+def bench_json_handler(args, work_dir):
+    rows = []
+    for style_count in args.style_counts:
+        filename = os.path.join(work_dir, f"styles_{style_count}.json")
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump([{'name': f"Style {i}", 'description': f"Prompt {i}"} for i in range(style_count)], file)
+        names = [f"Style {i}" for i in range(0, style_count, max(1, style_count // 100))]
+        params = {'styles': style_count}
+        rows.append(measure('json_handler', dict(params, op='get_art_style'),
+                            [lambda name=name: json_handler.get_art_style(name, filename) for name in names * 10]))
+        rows.append(measure('json_handler', dict(params, op='get_art_style_names'),
+                            [lambda: json_handler.get_art_style_names(filename)] * 100))
+        rows.append(measure('json_handler', dict(params, op='update_art_style'),
+                            [lambda name=name: json_handler.update_art_style(name, "Updated", filename) or True
+                             for name in names[:20]]))
+    return rows
+
+
+def bench_describe(args, photos):
+    try:
+        import description_pool
+        from description_pool_bench import stand_in_url
+    except ImportError as e:
+        print(f"Skipping describe: {e}")
+        return []
+    rows = []
+    photo = next(iter(photos.values()))
+    for concurrency in args.concurrency:
+        pool = description_pool.DescriptionBrowserPool(size=concurrency, url=stand_in_url(args.upload_ms, args.work_ms))
+        try:
+            pool.start()
+            rows.append(measure('describe', {'pool_size': concurrency},
+                                [lambda: pool.describe(photo)] * args.requests, concurrency))
+        except Exception as e:
+            print(f"Skipping describe: {e}")
+            break
+        finally:
+            pool.close()
+    return rows
+
+
+def row_key(row):
+    return row['case'], json.dumps(row['params'], sort_keys=True)
+
+
+def compare(results, baseline_file):
+    """Print throughput and p95 changes against an earlier results file."""
+    with open(baseline_file, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    before = {row_key(row): row for row in baseline['results']}
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for row in results:
+        old = before.get(row_key(row))
+        if old is None or not old['throughput_per_s']:
+            continue
+        speedup = row['throughput_per_s'] / old['throughput_per_s']
+        p95 = row['latency_s']['p95'] - old['latency_s']['p95']
+        print(f"{row['case']:<18} {row_key(row)[1]:<48} throughput x{speedup:.2f}  p95 {p95:+.3f}s")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[1, 4, 12])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=16, help="Calls per network case")
+    parser.add_argument('--repeat', type=int, default=3, help="Calls per CPU-only case")
+    parser.add_argument('--styles', nargs='+', default=[BENCH_STYLE['name'], hand_drawn.STYLE_NAME],
+                        help="Styles for the restyle case")
+    parser.add_argument('--style-counts', type=int, nargs='+', default=[10, 1000, 10000],
+                        help="Style file sizes for the json_handler case")
+    parser.add_argument('--no-preprocess', action='store_true', help="Upload originals in the restyle case")
+    parser.add_argument('--latency', type=float, default=0.2, help="Fake DeepAI seconds per API call")
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake DeepAI calls answered 503")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of fake DeepAI calls answered 429")
+    parser.add_argument('--upload-ms', type=int, default=300, help="Stand-in description page upload time")
+    parser.add_argument('--work-ms', type=int, default=1000, help="Stand-in description page generation time")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = FakeDeepAIServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              rate_429=args.rate_429, retry_after=0.05).start()
+    # The first get_client call for a key fixes its options, so every real code path below uses the fake
+    deepai_client.get_client(API_KEY, base_url=server.base_url, backoff_base=0.05, backoff_max=0.5,
+                             pool_size=max(args.concurrency))
+    work_dir = tempfile.mkdtemp(prefix='restyle-bench-')
+    styles_file = os.path.join(work_dir, 'art_styles.json')
+    with open(styles_file, 'w', encoding='utf-8') as file:
+        json.dump(json_handler.load_art_styles(os.path.join(ROOT, 'art_styles.json')) + [BENCH_STYLE], file)
+
+    results = []
+    try:
+        photos = {megapixels: write_photo(work_dir, megapixels) for megapixels in args.megapixels}
+        if 'restyle' in args.cases:
+            results += bench_restyle(args, photos, work_dir, styles_file)
+        if 'hand_drawn_main' in args.cases:
+            results += bench_hand_drawn_main(args, photos, work_dir)
+        if 'hand_drawn_effect' in args.cases:
+            results += bench_hand_drawn_effect(args, photos, work_dir)
+        if 'json_handler' in args.cases:
+            results += bench_json_handler(args, work_dir)
+        if 'describe' in args.cases:
+            results += bench_describe(args, photos)
+    finally:
+        server.stop()
+        restyle_pipelines.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'fake_deepai': {'latency': args.latency, 'jitter': args.jitter,
+                            'error_rate': args.error_rate, 'rate_429': args.rate_429},
+            'api_calls': dict(server.calls),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import time
+import uuid
+import random
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEEPAI_BASE_URL = "https://api.deepai.org/api"
+
+# Responses worth retrying: rate limited or a temporary server-side problem
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DeepAIError(Exception):
+    """Raised when a DeepAI request fails for good (after any retries)."""
+
+
+def backoff_delay(attempt, base, maximum, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than a server Retry-After."""
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date form; the jittered delay is good enough
+    return delay
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter: rate tokens per second, bursts up to capacity.
+
+    acquire() blocks until a token is available, so batch runs can push as
+    hard as the quota allows without tripping the server's limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens):
+        """Take tokens and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """acquire() for event loop code: waits without blocking the loop."""
+        import asyncio  # Already loaded by the caller's event loop; not imported at startup
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class MultipartBody:
+    """
+    multipart/form-data request body streamed straight from in-memory buffers.
+
+    Parts are bytes, memoryviews or mmaps and are never copied into one big
+    body; requests sends the object in chunks with a Content-Length, and it
+    can be rewound for a retry. started_at and sent_at (perf_counter) mark
+    when the last attempt began and finished sending, which splits a call's
+    time into upload and server wait.
+    """
+
+    def __init__(self, fields):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+        for name, filename, buffer in fields:
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+            )
+            self._parts.append(memoryview(buffer).cast('B'))
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode('utf-8'))
+        self._length = sum(len(part) for part in self._parts)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def close(self):
+        """Release the views on the caller's buffers (an mmap cannot close while they exist)."""
+        for part in self._parts:
+            if isinstance(part, memoryview):
+                part.release()
+        self._parts = []
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(1 << 16)
+            if not chunk:
+                return
+            yield chunk
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise OSError("MultipartBody can only be rewound to the start")
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+        self.started_at = time.perf_counter()
+        self.sent_at = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            chunk = part[self._offset:self._offset + size]
+            chunks.append(bytes(chunk))
+            self._offset += len(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+            if self._offset >= len(part):
+                self._index += 1
+                self._offset = 0
+        if self._position == self._length and self.sent_at is None:
+            self.sent_at = time.perf_counter()
+        return b''.join(chunks)
+
+
+class DeepAIClient:
+    """
+    Shared DeepAI client: keep-alive connection pool, timeouts, retries with
+    jittered exponential backoff for 429/5xx and connection errors, and an
+    optional token-bucket rate limit.
+    """
+
+    def __init__(self, api_key, base_url=DEEPAI_BASE_URL, timeout=(10, 120), max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, rate_limit=None, burst=None, pool_size=16):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.retries = 0
+
+        # requests is imported with the first client, not at startup
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def endpoint_url(self, endpoint):
+        return f"{self.base_url}/{endpoint}"
+
+    def _backoff(self, attempt, retry_after=None):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+
+    def request(self, method, url, rate_limited=True, **kwargs):
+        """Send a request, retrying transient failures; returns the final response."""
+        import requests
+        kwargs.setdefault('timeout', self.timeout)
+        body = kwargs.get('data')
+        for attempt in range(self.max_retries + 1):
+            if rate_limited and self.rate_limiter:
+                self.rate_limiter.acquire()
+            if hasattr(body, 'seek'):
+                body.seek(0)  # Resend the whole body on a retry
+
+            retry_after = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{e.__class__.__name__}: {e}"
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+
+            if attempt == self.max_retries:
+                break
+            self.retries += 1
+            metrics.increment('deepai_retries_total', reason=error.split(':')[0])
+            delay = self._backoff(attempt, retry_after)
+            logger.debug("%s %s: %s, retrying in %.2fs", method, url, error, delay)
+            time.sleep(delay)
+        raise DeepAIError(f"{method} {url} failed after {self.max_retries + 1} attempts: {error}")
+
+    def post_image(self, endpoint, fields, stage=None):
+        """
+        POST (name, filename, buffer) fields to a DeepAI image endpoint and
+        return the output URL.
+        """
+        body = MultipartBody(fields)
+        try:
+            response = self.request('POST', self.endpoint_url(endpoint), data=body,
+                                    headers={'api-key': self.api_key, 'Content-Type': body.content_type})
+            answered_at = time.perf_counter()
+        finally:
+            body.close()
+        metrics.increment('deepai_requests_total', endpoint=endpoint, status=response.status_code)
+        if body.sent_at is not None:
+            metrics.observe('upload', body.sent_at - body.started_at, endpoint=endpoint)
+            metrics.observe('api_wait', answered_at - body.sent_at, endpoint=endpoint)
+            metrics.increment('restyle_stage_bytes_total', len(body), stage='upload', endpoint=endpoint)
+        stage = stage or endpoint
+        if response.status_code != 200:
+            raise DeepAIError(f"{stage} failed with status {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:  # requests' JSONDecodeError is a ValueError
+            raise DeepAIError(f"No output URL found in the {stage} response "
+                              f"(status {response.status_code}, not JSON): {response.text[:200]!r}") from None
+        if not isinstance(data, dict) or 'output_url' not in data:
+            raise DeepAIError(f"No output URL found in the {stage} response: {data}")
+        return data['output_url']
+
+    def restyle(self, image_data, prompt):
+        """Send an image buffer and a prompt to the image-editor API and return the output URL."""
+        return self.post_image('image-editor', [
+            ('image', 'image', image_data),
+            ('text', 'prompt.txt', prompt.encode('utf-8')),
+        ], stage="restyling")
+
+    def upscale(self, image_data):
+        """Send an image buffer to the waifu2x API and return the output URL."""
+        return self.post_image('waifu2x', [('image', 'image', image_data)], stage="clarity enhancement")
+
+    def fetch(self, url):
+        """Download a result image and return its bytes (not counted against the rate limit)."""
+        with metrics.span('download') as span:
+            response = self.request('GET', url, rate_limited=False)
+            if response.status_code != 200:
+                raise DeepAIError(f"Download of {url} failed with status {response.status_code}")
+            span.add_bytes(len(response.content))
+        return response.content
+
+    def download(self, url, *files, chunk_size=1 << 16):
+        """
+        Stream a result image in chunks into every given file object and
+        return the number of bytes written, without holding it in memory.
+        """
+        with metrics.span('download') as span:
+            response = self.request('GET', url, rate_limited=False, stream=True)
+            with response:
+                if response.status_code != 200:
+                    raise DeepAIError(f"Download of {url} failed with status {response.status_code}")
+                for chunk in response.iter_content(chunk_size):
+                    for file in files:
+                        file.write(chunk)
+                    span.add_bytes(len(chunk))
+        return span.bytes
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, **options):
+    """
+    Return the shared client for api_key.
+
+    Options only take effect when the client is first created, so entry
+    points (e.g. batch_restyle) should call this with their settings early.
+    """
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = DeepAIClient(api_key, **options)
+        return client
@@ -0,0 +1,69 @@
+import os
+import threading
+import result_cache
+
+DEFAULT_CACHE_DIR = '.description_cache'
+DEFAULT_MAX_BYTES = 64 * 1024 ** 2  # Descriptions are tiny; this is tens of thousands of them
+
+# Pseudo endpoint for result_cache.make_key
+DESCRIPTION_ENDPOINT = 'image-description'
+
+
+class DescriptionCache:
+    """
+    Image descriptions kept in a ResultCache of their own, keyed by image
+    content. Entries do not expire with age, only by LRU once the cache is full.
+
+    A renamed or copied photo hits the same entry. File hashes are memoized
+    by path, mtime and size, so asking again about an unchanged file (e.g.
+    re-selecting it in the GUI) costs one stat and one small file read.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or result_cache.ResultCache(DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, max_age=None)
+        self._keys = {}  # path -> ((mtime_ns, size), key)
+        self._lock = threading.Lock()
+
+    def key_for(self, image_path):
+        stat = os.stat(image_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            memo = self._keys.get(image_path)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+        with open(image_path, 'rb') as file:
+            key = result_cache.make_key(file.read(), '', DESCRIPTION_ENDPOINT)
+        with self._lock:
+            self._keys[image_path] = (stamp, key)
+        return key
+
+    def get(self, image_path):
+        """The stored description of this image's content, or None."""
+        data = self.cache.get(self.key_for(image_path))
+        return data.decode('utf-8') if data is not None else None
+
+    def put(self, image_path, description):
+        self.cache.put(self.key_for(image_path), description.encode('utf-8'))
+
+    def get_or_describe(self, image_path, describe, on_step=None):
+        """Return the stored description, or call describe(image_path, on_step=...) and store its result."""
+        description = self.get(image_path)
+        if description is None:
+            description = describe(image_path, on_step=on_step)
+            self.put(image_path, description)
+        elif on_step:
+            on_step(90, "Step: Description loaded from cache")
+        return description
+
+
+_shared_description_cache = None
+_shared_description_cache_lock = threading.Lock()
+
+
+def get_shared_description_cache():
+    """Return the process-wide description cache in DEFAULT_CACHE_DIR, created on first use."""
+    global _shared_description_cache
+    with _shared_description_cache_lock:
+        if _shared_description_cache is None:
+            _shared_description_cache = DescriptionCache()
+        return _shared_description_cache
@@ -0,0 +1,216 @@
+import atexit
+import asyncio
+import threading
+from playwright.async_api import async_playwright
+import image_description
+import metrics
+
+
+class _PooledPage:
+    """A warm page plus the number of descriptions it has produced."""
+
+    def __init__(self, page):
+        self.page = page
+        self.uses = 0
+
+
+class DescriptionBrowserPool:
+    """
+    Long-lived Chromium instance with a pool of warm description pages.
+
+    Playwright's async API runs on a private event loop thread, so one
+    browser and context can serve callers from any thread. Each page is
+    navigated back to the site in the background after use, which keeps
+    page loads off the caller's critical path. Pages are replaced after
+    max_uses descriptions or when anything goes wrong with them, and the
+    browser is relaunched if it has crashed.
+    """
+
+    def __init__(self, size=2, max_uses=50, url=image_description.DESCRIPTION_SITE_URL,
+                 headless=True, timeout=60000):
+        self.size = size
+        self.max_uses = max_uses
+        self.url = url
+        self.headless = headless
+        self.timeout = timeout
+
+        self._loop = None
+        self._thread = None
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._pages = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Launch the browser and warm up the pages (idempotent). If that fails
+        the loop thread is stopped again, so the next call retries.
+        """
+        # Held through the warm-up, so concurrent callers wait for the pages
+        with self._lock:
+            if self._started:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="description-pool", daemon=True)
+            self._thread.start()
+            try:
+                self._call(self._start())
+            except BaseException:
+                try:
+                    self._shutdown()
+                except Exception:
+                    pass  # Report the launch error, not the clean-up one
+                raise
+            self._started = True
+
+    def close(self):
+        """Close every page and the browser, then stop the loop thread."""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+            self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self._call(self._close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = self._thread = self._pages = None
+
+    def describe(self, image_path, on_step=None):
+        """Generate a description for image_path on a warm page (blocking)."""
+        self.start()
+        with metrics.span('describe'):
+            return self._call(self._describe(image_path, on_step))
+
+    def describe_all(self, image_paths, on_result=None):
+        """
+        Describe many images over the warm pages, as many at a time as the
+        pool has pages. Returns {image path: description or the exception
+        it failed with}; on_result(image_path, result) is called as each one
+        finishes (on the pool's loop thread, so keep it short).
+        """
+        self.start()
+        return self._call(self._describe_all(list(image_paths), on_result))
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        self._playwright = await async_playwright().start()
+        await self._launch()
+        self._pages = asyncio.Queue()
+        for _ in range(self.size):
+            await self._pages.put(await self._new_slot())
+
+    async def _close(self):
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._browser = self._context = self._playwright = None
+
+    async def _launch(self):
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._context = await self._browser.new_context()
+        self._context.set_default_timeout(self.timeout)
+
+    async def _new_slot(self):
+        if not self._browser.is_connected():
+            await self._launch()
+        page = await self._context.new_page()
+        await page.goto(self.url)
+        return _PooledPage(page)
+
+    async def _replace(self, slot):
+        """Swap a worn-out or broken page for a fresh one."""
+        if slot is not None:
+            try:
+                await slot.page.close()
+            except Exception:
+                pass  # The page or the whole browser may already be gone
+        return await self._new_slot()
+
+    async def _reset(self, slot):
+        """Navigate a used page back to the site and return it to the pool."""
+        try:
+            if slot.uses >= self.max_uses:
+                slot = await self._replace(slot)
+            else:
+                await slot.page.goto(self.url)
+        except Exception:
+            slot = None  # Rebuilt lazily by the next caller
+        await self._pages.put(slot)
+
+    async def _describe(self, image_path, on_step):
+        def step(percent, text):
+            if on_step:
+                on_step(percent, text)
+
+        step(20, "Step: Waiting for a browser page")
+        slot = await self._pages.get()
+        try:
+            if slot is None or slot.page.is_closed():
+                slot = await self._replace(slot)
+            description = await self._run(slot.page, image_path, step)
+        except BaseException:
+            # Never hand a page in an unknown state to the next caller
+            try:
+                slot = await self._replace(slot)
+            except Exception:
+                slot = None
+            await self._pages.put(slot)
+            raise
+        slot.uses += 1
+        asyncio.ensure_future(self._reset(slot))
+        return description
+
+    async def _describe_all(self, image_paths, on_result):
+        async def describe_one(image_path):
+            try:
+                result = await self._describe(image_path, None)
+            except Exception as e:
+                result = e
+            if on_result:
+                on_result(image_path, result)
+            return result
+
+        # Every call waits for a free page, so the pool size bounds the concurrency
+        results = await asyncio.gather(*(describe_one(image_path) for image_path in image_paths))
+        return dict(zip(image_paths, results))
+
+    async def _run(self, page, image_path, step):
+        await page.evaluate(image_description.CLEAR_DESCRIPTION_SCRIPT, image_description.DESCRIPTION_SELECTOR)
+
+        step(60, "Step: Uploading image")
+        await page.set_input_files(image_description.UPLOAD_INPUT_SELECTOR, image_path)
+
+        # The generate button only becomes enabled once the upload is done
+        await page.wait_for_selector(image_description.GENERATE_BUTTON_SELECTOR)
+        await page.click(image_description.GENERATE_BUTTON_SELECTOR)
+
+        step(80, "Step: Generating description")
+        await page.wait_for_function(image_description.DESCRIPTION_READY_SCRIPT,
+                                     arg=image_description.DESCRIPTION_SELECTOR)
+        description = await page.inner_text(image_description.DESCRIPTION_SELECTOR)
+        step(90, "Step: Description generated")
+        return description
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool():
+    """Return the process-wide pool, created on first use and closed at exit."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = DescriptionBrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
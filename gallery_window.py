@@ -0,0 +1,265 @@
+import os
+import logging
+from collections import OrderedDict
+from PySide6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QFileDialog, QMessageBox, QComboBox,
+    QListView, QAbstractItemView
+)
+from PySide6.QtGui import QPixmap
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QTimer
+import json_handler
+import restyle_engine
+import restyle_jobs
+import result_cache
+import preprocess
+from restyle_pipelines import registry
+
+ICON_SIZE = 128
+FETCH_BATCH = 1000     # Rows handed to the view at a time
+PIXMAP_CACHE_SIZE = 512  # Decoded icons kept; a few screens' worth
+
+logger = logging.getLogger(__name__)
+
+
+class ScanFolderJob(restyle_jobs.Job):
+    """
+    List the images in a folder (recursively) off the UI thread, with the
+    unique output name of each (see restyle_engine.output_names).
+    """
+
+    def __init__(self, folder):
+        super().__init__(f"Scan {folder}")
+        self.folder = folder
+
+    def execute(self):
+        image_paths = restyle_engine.collect_images(self.folder)
+        return image_paths, restyle_engine.output_names(image_paths)
+
+
+class ImageListModel(QAbstractListModel):
+    """
+    List model over image paths for a virtualized QListView.
+
+    Only the path strings are held for every row. Rows are handed to the view
+    in batches through canFetchMore()/fetchMore(), and thumbnails are
+    requested from the ThumbnailLoader only when the view asks for a row's
+    icon, which it does for visible rows only. Decoded icons are kept in a
+    small LRU, so memory stays bounded however large the folder is.
+    """
+
+    def __init__(self, thumbnail_loader, parent=None):
+        super().__init__(parent)
+        self.thumbnail_loader = thumbnail_loader
+        self.thumbnail_loader.ready.connect(self.on_thumbnail_ready)
+        self.thumbnail_loader.failed.connect(self.on_thumbnail_failed)
+        self.paths = []
+        self.loaded = 0  # Rows the view knows about
+        self.rows = {}   # Path -> row, for routing finished thumbnails
+        self.pixmaps = OrderedDict()
+        self.failed = set()
+        self.placeholder = QPixmap(ICON_SIZE, ICON_SIZE)
+        self.placeholder.fill(Qt.lightGray)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.paths = list(paths)
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.loaded = 0
+        self.pixmaps.clear()
+        self.failed.clear()
+        self.endResetModel()
+        self.thumbnail_loader.cancel_pending()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.paths)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(FETCH_BATCH, len(self.paths) - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded:
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return path
+        if role == Qt.DecorationRole:
+            return self.icon_for(path)
+        return None
+
+    def icon_for(self, path):
+        pixmap = self.pixmaps.get(path)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(path)
+            return pixmap
+        if path in self.failed:
+            return self.placeholder
+        image = self.thumbnail_loader.request(path)
+        if image is None:
+            return self.placeholder  # ready() will repaint the row
+        return self.remember(path, image)
+
+    def remember(self, path, image):
+        pixmap = QPixmap.fromImage(image).scaled(ICON_SIZE, ICON_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.pixmaps[path] = pixmap
+        while len(self.pixmaps) > PIXMAP_CACHE_SIZE:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+    def on_thumbnail_ready(self, path, image):
+        row = self.rows.get(path)
+        if row is None or row >= self.loaded:
+            return
+        self.remember(path, image)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def on_thumbnail_failed(self, path, error):
+        if path in self.rows:
+            self.failed.add(path)
+
+
+class GalleryWindow(QWidget):
+    """Browse a folder of photos as a thumbnail grid and queue restyles for the selected ones."""
+
+    def __init__(self, output_dir='Restyled'):
+        super().__init__()
+        self.output_dir = output_dir
+        self.folder = None
+        self.output_names = {}  # Image path -> output name, unique within the folder
+        self.api_key = restyle_engine.load_deepai_key()
+        self.restyle_jobs = {}  # Job id -> output path
+
+        self.job_queue = restyle_jobs.JobQueue(max_workers=3, parent=self)
+        self.job_queue.job_removed.connect(self.update_status)
+        self.thumbnail_loader = restyle_jobs.ThumbnailLoader(max_workers=4, parent=self)
+        self.model = ImageListModel(self.thumbnail_loader, parent=self)
+
+        # While scrolling, thumbnails requested for rows that already scrolled
+        # past are dropped; the rows in view ask again once scrolling pauses
+        self.scroll_timer = QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(100)
+        self.scroll_timer.timeout.connect(self.on_scroll_settled)
+
+        self.init_ui()
+
+    def init_ui(self):
+        self.setWindowTitle("Gallery")
+        self.resize(900, 700)
+        layout = QVBoxLayout()
+
+        top_row = QHBoxLayout()
+        self.open_folder_button = QPushButton("Open Folder")
+        self.open_folder_button.clicked.connect(self.open_folder)
+        top_row.addWidget(self.open_folder_button)
+
+        self.art_style_dropdown = QComboBox()
+        self.art_style_dropdown.addItem("Select Artform")
+        self.art_style_dropdown.addItems(json_handler.get_art_style_names())
+        top_row.addWidget(self.art_style_dropdown)
+
+        self.restyle_button = QPushButton("Restyle Selected")
+        self.restyle_button.clicked.connect(self.restyle_selected)
+        top_row.addWidget(self.restyle_button)
+        layout.addLayout(top_row)
+
+        self.view = QListView()
+        self.view.setModel(self.model)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setIconSize(QSize(ICON_SIZE, ICON_SIZE))
+        self.view.setGridSize(QSize(ICON_SIZE + 24, ICON_SIZE + 36))
+        # Uniform sizes let the view lay out rows without asking the model about each one
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(FETCH_BATCH)
+        self.view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.view.verticalScrollBar().valueChanged.connect(self.scroll_timer.start)
+        self.view.selectionModel().selectionChanged.connect(self.update_status)
+        layout.addWidget(self.view)
+
+        self.status_label = QLabel("Open a folder to browse its photos")
+        layout.addWidget(self.status_label)
+        self.setLayout(layout)
+
+    def open_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if not folder:
+            return
+        self.folder = folder
+        self.status_label.setText(f"Scanning {folder}...")
+        job = ScanFolderJob(folder)
+        job.signals.finished.connect(self.on_scan_finished)
+        job.signals.failed.connect(self.on_scan_failed)
+        self.job_queue.submit(job)
+
+    def on_scan_finished(self, job_id, result):
+        image_paths, self.output_names = result
+        self.model.set_paths(image_paths)
+        self.update_status()
+
+    def on_scan_failed(self, job_id, error):
+        QMessageBox.warning(self, "Error", f"Failed to read the folder: {error}")
+
+    def on_scroll_settled(self):
+        self.thumbnail_loader.cancel_pending()
+        self.view.viewport().update()
+
+    def selected_paths(self):
+        return [index.data(Qt.UserRole) for index in self.view.selectionModel().selectedIndexes()]
+
+    def restyle_selected(self):
+        """Queue a restyle job for every selected photo; results are written to the output folder."""
+        paths = self.selected_paths()
+        if not paths:
+            QMessageBox.warning(self, "No Image", "Please select one or more photos.")
+            return
+        style_name = self.art_style_dropdown.currentText()
+        prompt = restyle_engine.get_art_style_prompt(style_name)
+        if self.art_style_dropdown.currentIndex() == 0 or prompt is None:
+            QMessageBox.warning(self, "No Art Style", "Please select an art style.")
+            return
+
+        pipeline = registry.get_style_pipeline(style_name, preprocessor=preprocess.get_shared_preprocessor())
+        cache = result_cache.get_shared_cache()
+        for path in paths:
+            job = restyle_jobs.RestyleImageJob(path, prompt, self.api_key, cache=cache, pipeline=pipeline)
+            self.restyle_jobs[job.job_id] = os.path.join(self.output_dir, f"{self.output_names[path]}_{style_name}.jpg")
+            job.signals.finished.connect(self.on_restyle_finished)
+            job.signals.failed.connect(self.on_restyle_failed)
+            self.job_queue.submit(job)
+        self.update_status()
+
+    def on_restyle_finished(self, job_id, result_workspace):
+        output_path = self.restyle_jobs.pop(job_id, None)
+        with result_workspace:
+            if output_path is not None:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                result_workspace.export('output', output_path)
+
+    def on_restyle_failed(self, job_id, error):
+        output_path = self.restyle_jobs.pop(job_id, None)
+        logger.warning("Restyle for %s failed: %s", output_path, error)
+
+    def update_status(self, *args):
+        status = f"{len(self.model.paths)} photos"
+        selected = len(self.view.selectionModel().selectedIndexes())
+        if selected:
+            status += f", {selected} selected"
+        if self.restyle_jobs:
+            status += f", {len(self.restyle_jobs)} restyles queued"
+        self.status_label.setText(status)
+
+    def closeEvent(self, event):
+        self.job_queue.cancel_all()
+        self.thumbnail_loader.cancel_pending()
+        super().closeEvent(event)
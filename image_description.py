@@ -0,0 +1,63 @@
+DESCRIPTION_SITE_URL = "https://imagedescriptiongenerator.net/"
+
+# Selectors on the description site
+UPLOAD_INPUT_SELECTOR = 'input[type="file"]'
+GENERATE_BUTTON_SELECTOR = 'button:has-text("Generate Description"):enabled'
+DESCRIPTION_SELECTOR = '#GenDescription'
+
+# True once the description element exists and has text in it
+DESCRIPTION_READY_SCRIPT = """
+selector => {
+    const element = document.querySelector(selector);
+    return element !== null && element.innerText.trim().length > 0;
+}
+"""
+
+# Empties a description left over from a previous run on the same page
+CLEAR_DESCRIPTION_SCRIPT = """
+selector => {
+    const element = document.querySelector(selector);
+    if (element !== null) {
+        element.innerText = '';
+    }
+}
+"""
+
+
+def describe_image(image_path, on_step=None, url=DESCRIPTION_SITE_URL):
+    """
+    Generate a description for the image using imagedescriptiongenerator.net.
+
+    This launches a fresh browser for the one image; description_pool keeps
+    warm pages around for repeated calls. on_step(percent, text) is called as
+    the browser session progresses.
+    """
+    def step(percent, text):
+        if on_step:
+            on_step(percent, text)
+
+    # Imported here so importing the selectors above does not load Playwright
+    from playwright.sync_api import sync_playwright
+
+    step(20, "Step: Launching browser")
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(headless=True)
+        try:
+            step(40, "Step: Navigating to website")
+            page = browser.new_page()
+            page.goto(url)
+
+            step(60, "Step: Uploading image")
+            page.set_input_files(UPLOAD_INPUT_SELECTOR, image_path)
+
+            # The generate button only becomes enabled once the upload is done
+            page.wait_for_selector(GENERATE_BUTTON_SELECTOR)
+            page.click(GENERATE_BUTTON_SELECTOR)
+
+            step(80, "Step: Generating description")
+            page.wait_for_function(DESCRIPTION_READY_SCRIPT, arg=DESCRIPTION_SELECTOR)
+            description = page.inner_text(DESCRIPTION_SELECTOR)
+            step(90, "Step: Description generated")
+            return description
+        finally:
+            browser.close()
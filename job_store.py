@@ -0,0 +1,168 @@
+"""
+Durable record of batch restyle work, one row per image x style.
+
+A row moves through the states
+
+    pending -> described -> restyled -> upscaled -> done
+
+as the engine's stages finish (stages a run does not use are skipped), and
+each step saves what later steps need: the result cache keys and the
+DeepAI output URLs. A run that dies halfway can therefore be started again
+and every image resumes after its last finished step, without paying for
+an API call that already succeeded. A row that fails keeps its progress,
+is marked failed and is retried on the next run until it has failed
+max_attempts times; a run that dies mid-image costs no attempt.
+
+A row also records the hash of the prompt it was restyled with and where
+its result went. It starts over when the style's prompt has changed, and
+a done row is restyled again when its result is asked for elsewhere (say,
+another --output-dir) or has been deleted.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+STATES = ('pending', 'described', 'restyled', 'upscaled', 'done')
+FAILED = 'failed'
+
+_COLUMNS = ('id', 'image_path', 'style', 'state', 'progress', 'attempts', 'error', 'description',
+            'restyle_key', 'restyled_url', 'upscale_key', 'result_url', 'output_path', 'updated_at', 'prompt_hash')
+
+
+def state_rank(state):
+    return STATES.index(state)
+
+
+class JobRecord:
+    """One row of the job table."""
+
+    def __init__(self, row):
+        for column, value in zip(_COLUMNS, row):
+            setattr(self, column, value)
+
+
+class JobStore:
+    """SQLite-backed job table, safe to use from the engine's worker threads."""
+
+    def __init__(self, filename='restyle_jobs.db', max_attempts=3):
+        self.filename = filename
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                image_path TEXT NOT NULL,
+                style TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                progress TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                description TEXT,
+                restyle_key TEXT,
+                restyled_url TEXT,
+                upscale_key TEXT,
+                result_url TEXT,
+                output_path TEXT,
+                updated_at REAL,
+                prompt_hash TEXT,
+                UNIQUE (image_path, style)
+            )
+        """)
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")]
+        if 'prompt_hash' not in columns:
+            # Databases from before prompts were recorded; their rows count as the current prompt
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN prompt_hash TEXT")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (style, state)")
+
+    def close(self):
+        self._connection.close()
+
+    def _write(self, sql, parameters=()):
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters)
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def enqueue(self, image_paths, style):
+        """Add a pending row for every image not yet recorded for this style."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO jobs (image_path, style, updated_at) VALUES (?, ?, ?)",
+                [(image_path, style, now) for image_path in image_paths],
+            )
+
+    def get(self, image_path, style):
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE image_path = ? AND style = ?",
+                           (image_path, style))
+        return JobRecord(rows[0]) if rows else None
+
+    def start(self, image_path, style, output_path=None, prompt_hash=None):
+        """
+        Return the row for a new attempt at an image, or None if it is
+        already done (with its result still at output_path) or has failed
+        max_attempts times. A row whose prompt_hash differs from the given
+        one, or whose result is missing, is reset to start over.
+        """
+        select = f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE image_path = ? AND style = ?"
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO jobs (image_path, style, prompt_hash, updated_at) VALUES (?, ?, ?, ?)",
+                (image_path, style, prompt_hash, time.time()),
+            )
+            record = JobRecord(self._connection.execute(select, (image_path, style)).fetchone())
+            stale_prompt = None not in (prompt_hash, record.prompt_hash) and prompt_hash != record.prompt_hash
+            result_gone = record.state == 'done' and (
+                not record.output_path or not os.path.exists(record.output_path)
+                or (output_path is not None and record.output_path != output_path))
+            if stale_prompt or result_gone:
+                self._connection.execute(
+                    "UPDATE jobs SET state = 'pending', progress = 'pending', attempts = 0, error = NULL, "
+                    "restyle_key = NULL, restyled_url = NULL, upscale_key = NULL, result_url = NULL, "
+                    "output_path = NULL WHERE id = ?", (record.id,),
+                )
+            elif record.state == 'done' or record.attempts >= self.max_attempts:
+                return None
+            # Attempts are counted by fail(), so a crash mid-image does not use one up
+            self._connection.execute(
+                "UPDATE jobs SET state = progress, prompt_hash = COALESCE(?, prompt_hash), updated_at = ? "
+                "WHERE id = ?", (prompt_hash, time.time(), record.id),
+            )
+            row = self._connection.execute(select, (image_path, style)).fetchone()
+        return JobRecord(row)
+
+    def advance(self, record_id, state, **fields):
+        """Save a finished step: the new state plus the fields later steps need."""
+        assignments = ''.join(f", {column} = ?" for column in fields)
+        self._write(
+            f"UPDATE jobs SET state = ?, progress = ?, error = NULL, updated_at = ?{assignments} WHERE id = ?",
+            (state, state, time.time(), *fields.values(), record_id),
+        )
+
+    def fail(self, record_id, error):
+        """Mark a row failed and count the attempt; its progress is kept for the next one."""
+        self._write("UPDATE jobs SET state = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (FAILED, error, time.time(), record_id))
+
+    def retry_failed(self, style=None):
+        """Give failed rows a fresh set of attempts; returns how many were reset."""
+        sql = "UPDATE jobs SET attempts = 0, state = progress WHERE state = ?"
+        parameters = [FAILED]
+        if style is not None:
+            sql += " AND style = ?"
+            parameters.append(style)
+        return self._write(sql, parameters).rowcount
+
+    def counts(self, style=None):
+        """{state: number of rows}, for one style or all of them."""
+        if style is None:
+            rows = self._query("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        else:
+            rows = self._query("SELECT state, COUNT(*) FROM jobs WHERE style = ? GROUP BY state", (style,))
+        return dict(rows)
@@ -1,57 +1,43 @@
-import json
+import logging
 import tempfile
+import style_store
 
-def load_art_styles(filename='art_styles.json', create_temp_file=False):
-    try:
-        with open(filename, 'r') as file:
-            data = json.load(file)
-            if isinstance(data, list):
-                # Optionally create a temporary file with the art style descriptions
-                if create_temp_file:
-                    art_style_description = next(
-                        (style['description'] for style in data if isinstance(style, dict) and style.get('name') == self.selected_art_style),
-                        None
-                    )
-                    if art_style_description:
-                        # Create a temporary file
-                        temp_file_path = tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8').name
-                        with open(temp_file_path, 'w', encoding='utf-8') as temp_file:
-                            temp_file.write(art_style_description)
-                        return temp_file_path
-                    else:
-                        print("Selected art style description not found.")
-                        return None
-                else:
-                    return data  # Return as a list of dictionaries
-            else:
-                print("Unexpected data format in art_styles.json:", data)
-                return []
-    except FileNotFoundError:
-        print("The JSON file was not found.")
-        return []
-    except json.JSONDecodeError:
-        print("Error decoding the JSON file.")
-        return []
+logger = logging.getLogger(__name__)
+
+# Styles are read and written through a shared style_store per file. The styles of
+# art_styles.json live in art_styles.db, which picks up later edits to the JSON file,
+# so an edit writes one row instead of the whole file.
+
+def load_art_styles(filename='art_styles.json', create_temp_file=False, style_name=None):
+    styles = style_store.get_store(filename).all()
+    # Optionally create a temporary file with the art style's description
+    if create_temp_file:
+        art_style = get_art_style(style_name, filename)
+        art_style_description = art_style.get('description') if art_style else None
+        if art_style_description:
+            # Create a temporary file
+            temp_file_path = tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8').name
+            with open(temp_file_path, 'w', encoding='utf-8') as temp_file:
+                temp_file.write(art_style_description)
+            return temp_file_path
+        else:
+            logger.warning("Art style %r has no description.", style_name)
+            return None
+    return styles  # Return as a list of dictionaries
+
+def get_art_style(name, filename='art_styles.json'):
+    """Return the art style dict with this name, or None (a dictionary lookup, not a scan)."""
+    return style_store.get_store(filename).get(name)
+
+def get_art_style_names(filename='art_styles.json'):
+    return style_store.get_store(filename).names()
 
 def update_art_style(name, description, filename='art_styles.json'):
-    art_styles = load_art_styles(filename)
-    for art_style in art_styles:
-        if art_style["name"] == name:
-            art_style["description"] = description
-            break
-    with open(filename, 'w') as file:
-        json.dump(art_styles, file, indent=4)
+    """Change a style's description; returns False if there is no style with that name."""
+    return style_store.get_store(filename).update(name, description=description)
 
 def remove_art_style(name, filename='art_styles.json'):
-    art_styles = load_art_styles(filename)
-    art_styles = [art_style for art_style in art_styles if art_style["name"] != name]
-    with open(filename, 'w') as file:
-        json.dump(art_styles, file, indent=4)
+    style_store.get_store(filename).remove(name)
 
 def add_art_style(name, description, filename='art_styles.json'):
-    art_styles = load_art_styles(filename)
-    art_styles.append({"name": name, "description": description})
-    with open(filename, 'w') as file:
-        json.dump(art_styles, file, indent=4)
-
-
+    style_store.get_store(filename).put({"name": name, "description": description})
@@ -1,15 +1,19 @@
 import sys
 import os
 from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget
-from photo_restyler import PhotoRestylerWindow
-from art_form_editor import ArtFormEditor
+from PySide6.QtCore import QTimer
+import metrics
+
+# The windows' modules (and through them requests, NumPy, Pillow and the
+# restyle pipelines) are imported when their buttons are first clicked, so
+# the menu appears after loading little more than Qt.
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
-        # Ensure all necessary directories and files exist
-        self.ensure_directories_and_files()
+        # Ensure all necessary directories and files exist, once the menu is on screen
+        QTimer.singleShot(0, self.ensure_directories_and_files)
 
         # Set up the main window
         self.setWindowTitle("Main Menu")
@@ -24,6 +28,10 @@ class MainWindow(QMainWindow):
         self.photo_restyler_button.clicked.connect(self.open_photo_restyler)
         layout.addWidget(self.photo_restyler_button)
 
+        self.gallery_button = QPushButton("Open Gallery")
+        self.gallery_button.clicked.connect(self.open_gallery)
+        layout.addWidget(self.gallery_button)
+
         self.art_form_editor_button = QPushButton("Open Art Form Editor")
         self.art_form_editor_button.clicked.connect(self.open_art_form_editor)
         layout.addWidget(self.art_form_editor_button)
@@ -38,7 +46,6 @@ class MainWindow(QMainWindow):
 
         # Define necessary paths
         paths = {
-            'image_restyle_description': 'image_restyle_description.txt',
             'json_handler': 'json_handler.py',
             'photo_restyler': 'photo_restyler.py',
             'art_form_editor': 'art_form_editor.py',
@@ -51,22 +58,48 @@ class MainWindow(QMainWindow):
             os.makedirs(os.path.join(base_dir, paths['photos']))
 
         # Ensure all files exist
-        for file_name in [paths['image_restyle_description'], paths['json_handler'], paths['photo_restyler'], paths['art_form_editor'], paths['art_styles']]:
+        for file_name in [paths['json_handler'], paths['photo_restyler'], paths['art_form_editor'], paths['art_styles']]:
             file_path = os.path.join(base_dir, file_name)
             if not os.path.isfile(file_path):
                 with open(file_path, 'w') as f:
                     pass  # Create an empty file if it does not exist
 
     def open_photo_restyler(self):
+        from photo_restyler import PhotoRestylerWindow
         self.photo_restyler_window = PhotoRestylerWindow(self.show)  # Pass the method to show the main window
         self.photo_restyler_window.show()
 
+    def open_gallery(self):
+        from gallery_window import GalleryWindow
+        self.gallery_window = GalleryWindow()
+        self.gallery_window.show()
+
     def open_art_form_editor(self):
+        from art_form_editor import ArtFormEditor
         self.art_form_editor_window = ArtFormEditor()  # Use the correct class name
         self.art_form_editor_window.show()
 
+def exit_after_show():
+    # Startup measurement: report the first window, load what the buttons would, and quit
+    import startup_profile
+    startup_profile.report_ready()
+    startup_profile.import_deferred()
+    QApplication.quit()
+
+
 if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        # Frozen builds start the shared process pool's workers from this executable
+        import multiprocessing
+        multiprocessing.freeze_support()
+    if '--measure-startup' in sys.argv:
+        import startup_profile
+        sys.exit(startup_profile.main(sys.argv[sys.argv.index('--measure-startup') + 1:]))
+    metrics.configure_logging()
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
+    if '--exit-after-show' in sys.argv:
+        # Runs on the first event loop pass, once the window has been shown
+        QTimer.singleShot(0, exit_after_show)
     sys.exit(app.exec())
@@ -0,0 +1,104 @@
+# -*- mode: python ; coding: utf-8 -*-
+"""
+PyInstaller spec for the desktop app.
+
+    pyinstaller main.spec                       # one-dir build in dist/main/ (fastest start)
+    pyinstaller main.spec -- --onefile          # single dist/main(.exe), unpacked on every start
+    pyinstaller main.spec -- --no-playwright    # leave out Playwright and its Node driver
+    pyinstaller main.spec -- --optimize 2       # also strip docstrings from the bytecode
+
+The one-dir build keeps every module as a precompiled .pyc file next to the
+executable (noarchive), so a cold start neither unpacks an archive nor
+compiles anything, and modules that main.py imports lazily cost nothing
+until used. Qt modules, plugins and translations the app does not use are
+left out. benchmarks/measure_frozen.py builds this spec and records its
+start-up time and size.
+"""
+import argparse
+from PyInstaller.utils.hooks import collect_submodules
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--onefile', action='store_true', help="Single executable instead of a directory")
+parser.add_argument('--no-playwright', action='store_true',
+                    help="Leave out Playwright (descriptions then fail; restyling still works)")
+parser.add_argument('--optimize', type=int, choices=(0, 1, 2), default=1,
+                    help="Bytecode optimization level, as python -O / -OO")
+options = parser.parse_args()
+
+# The app only uses QtCore, QtGui and QtWidgets
+QT_EXCLUDES = [
+    f'PySide6.{module}' for module in (
+        'Qt3DAnimation', 'Qt3DCore', 'Qt3DExtras', 'Qt3DInput', 'Qt3DLogic', 'Qt3DRender',
+        'QtBluetooth', 'QtCharts', 'QtConcurrent', 'QtDataVisualization', 'QtDesigner', 'QtGraphs',
+        'QtHelp', 'QtHttpServer', 'QtLocation', 'QtMultimedia', 'QtMultimediaWidgets', 'QtNetwork',
+        'QtNetworkAuth', 'QtNfc', 'QtOpenGL', 'QtOpenGLWidgets', 'QtPdf', 'QtPdfWidgets',
+        'QtPositioning', 'QtPrintSupport', 'QtQml', 'QtQuick', 'QtQuick3D', 'QtQuickControls2',
+        'QtQuickWidgets', 'QtRemoteObjects', 'QtScxml', 'QtSensors', 'QtSerialBus', 'QtSerialPort',
+        'QtSpatialAudio', 'QtSql', 'QtStateMachine', 'QtSvgWidgets', 'QtTest', 'QtTextToSpeech',
+        'QtUiTools', 'QtWebChannel', 'QtWebEngineCore', 'QtWebEngineQuick', 'QtWebEngineWidgets',
+        'QtWebSockets', 'QtXml',
+    )
+]
+# Shared libraries of those modules can still be pulled in by plugins; drop them by name
+QT_LIBRARY_EXCLUDES = tuple(name.split('.', 1)[1][2:].lower() for name in QT_EXCLUDES)
+PYTHON_EXCLUDES = ['tkinter', 'unittest', 'pydoc', 'doctest', 'lib2to3', 'IPython', 'matplotlib', 'PyQt5', 'PyQt6']
+if options.no_playwright:
+    PYTHON_EXCLUDES.append('playwright')
+
+a = Analysis(
+    ['main.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    # Pipeline plugins are found with pkgutil at run time, so the analysis cannot see them;
+    # the windows main.py imports inside its button handlers are found as usual
+    hiddenimports=collect_submodules('restyle_pipelines'),
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=QT_EXCLUDES + PYTHON_EXCLUDES,
+    noarchive=not options.onefile,
+    optimize=options.optimize,
+)
+
+
+def _unused_qt_file(name):
+    name = name.replace('\\', '/').lower()
+    if 'pyside6/' in name and '/translations/' in name:
+        return True  # The UI is English only
+    base = name.rsplit('/', 1)[-1]
+    return any(f'qt6{library}' in base or f'qt{library}' in base for library in QT_LIBRARY_EXCLUDES)
+
+
+a.binaries = [entry for entry in a.binaries if not _unused_qt_file(entry[0])]
+a.datas = [entry for entry in a.datas if not _unused_qt_file(entry[0])]
+
+pyz = PYZ(a.pure)
+
+if options.onefile:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='main',
+        debug=False,
+        strip=False,
+        upx=False,  # UPX-compressed libraries have to be unpacked on every start
+        runtime_tmpdir=None,
+        console=False,
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='main',
+        debug=False,
+        strip=False,
+        upx=False,
+        console=False,
+    )
+    coll = COLLECT(exe, a.binaries, a.datas, strip=False, upx=False, name='main')
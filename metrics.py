@@ -0,0 +1,244 @@
+"""
+Per-stage timings and counters for the restyle code paths.
+
+Code wraps each unit of work in a span:
+
+    with metrics.span('download', endpoint='waifu2x') as span:
+        ...
+        span.add_bytes(size)
+
+and bumps counters with metrics.increment('deepai_retries_total', reason=...).
+Stages used across the code base:
+
+    read, preprocess      opening and shrinking the input image
+    upload, api_wait      sending a DeepAI request, then waiting for its answer
+                          (api_call for the async client, which cannot split them)
+    download, save        fetching a result, writing an output file
+    local_filter          one task in the shared process pool, queueing included
+    filter                one local filter step inside such a task
+    describe              one description from the browser pool
+    http_request          one request to restyle_server, by route and status
+    engine_<stage>        the batch engine's own pipeline stages
+
+Counters: deepai_requests_total, deepai_retries_total, cache_hits_total,
+cache_misses_total, restyle_stage_bytes_total, restyle_stage_errors_total
+and server_rejected_total.
+
+Everything is aggregated in-process into a Registry that renders the
+Prometheus text format (serve_prometheus() exposes it on /metrics), and
+finished spans can also be appended to a JSON lines file. The JSON lines
+path is passed to child processes through RESTYLE_METRICS_JSONL, so spans
+recorded in the shared process pool end up in the same file. Recording a
+span is a perf_counter() pair and a dict update under a lock.
+
+Diagnostics go through the logging module; configure_logging() is what the
+entry points call, with $RESTYLE_LOG_LEVEL overriding their default level.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+JSONL_ENV = 'RESTYLE_METRICS_JSONL'
+LOG_LEVEL_ENV = 'RESTYLE_LOG_LEVEL'
+
+# Upper bounds (seconds) of the duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Span:
+    """One timed unit of work; returned by span() for adding bytes or labels while it runs."""
+
+    __slots__ = ('stage', 'labels', 'bytes', 'started_at', 'duration', 'error')
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.bytes = 0
+        self.started_at = None
+        self.duration = None
+        self.error = None
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+    def set_label(self, name, value):
+        self.labels[name] = value
+
+    def record(self):
+        return {'stage': self.stage, 'start': self.started_at, 'duration': self.duration,
+                'bytes': self.bytes, 'error': self.error, **self.labels}
+
+
+class Registry:
+    """Thread-safe counters and per-stage duration histograms."""
+
+    def __init__(self):
+        self.counters = {}    # (name, label key) -> value
+        self.histograms = {}  # (stage, label key) -> [bucket counts, count, sum]
+        self.jsonl_path = None
+        self._jsonl_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0, 0.0]
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def finish(self, span):
+        """Aggregate a finished span and append it to the JSON lines file, if one is set."""
+        self.observe(span.stage, span.duration, **span.labels)
+        if span.bytes:
+            self.increment('restyle_stage_bytes_total', span.bytes, stage=span.stage, **span.labels)
+        if span.error:
+            self.increment('restyle_stage_errors_total', stage=span.stage, **span.labels)
+        if self.jsonl_path:
+            line = json.dumps(span.record(), default=str) + '\n'
+            with self._jsonl_lock, open(self.jsonl_path, 'a', encoding='utf-8') as file:
+                file.write(line)
+
+    def snapshot(self):
+        """{'counters': [...], 'stages': [...]} for reports."""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(key), 'value': value}
+                        for (name, key), value in sorted(self.counters.items())]
+            stages = [{'stage': stage, 'labels': dict(key), 'count': count, 'seconds': total}
+                      for (stage, key), (_, count, total) in sorted(self.histograms.items())]
+        return {'counters': counters, 'stages': stages}
+
+    def to_prometheus(self):
+        """Render everything in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(buckets), count, total))
+                                for key, (buckets, count, total) in self.histograms.items())
+
+        declared = set()
+        for (name, key), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        if histograms:
+            lines.append("# HELP restyle_stage_seconds Time spent in each stage")
+            lines.append("# TYPE restyle_stage_seconds histogram")
+        for (stage, key), (buckets, count, total) in histograms:
+            labels = (('stage', stage),) + key
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"restyle_stage_seconds_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"restyle_stage_seconds_sum{_format_labels(labels)} {total}")
+            lines.append(f"restyle_stage_seconds_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.jsonl_path = os.environ.get(JSONL_ENV) or None
+
+
+class _SpanContext:
+    __slots__ = ('span', '_start')
+
+    def __init__(self, stage, labels):
+        self.span = Span(stage, labels)
+
+    def __enter__(self):
+        self.span.started_at = time.time()
+        self._start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        registry.finish(self.span)
+        return False
+
+
+def span(stage, **labels):
+    """Context manager timing one stage; yields the Span so bytes can be added."""
+    return _SpanContext(stage, labels)
+
+
+def increment(name, amount=1, **labels):
+    registry.increment(name, amount, **labels)
+
+
+def observe(stage, seconds, **labels):
+    """Record a duration measured elsewhere (e.g. the engine's own stage timings)."""
+    registry.observe(stage, seconds, **labels)
+
+
+def write_jsonl(path):
+    """Append every finished span to path as JSON lines, in this process and in child processes started later."""
+    registry.jsonl_path = path
+    if path:
+        os.environ[JSONL_ENV] = path
+    else:
+        os.environ.pop(JSONL_ENV, None)
+
+
+def configure_logging(level='WARNING'):
+    """Set up levelled logging for an entry point; $RESTYLE_LOG_LEVEL wins over level."""
+    level = os.environ.get(LOG_LEVEL_ENV) or level
+    logging.basicConfig(level=level.upper() if isinstance(level, str) else level,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+def serve_prometheus(port, host='127.0.0.1'):
+    """Serve /metrics for Prometheus on a daemon thread; returns the server (call shutdown() to stop)."""
+    # http.server is only imported by entry points that serve metrics, to keep startup light
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Serving Prometheus metrics on http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,304 @@
+"""
+Perceptual-hash index for spotting near-duplicate input photos.
+
+Every image gets a 64-bit pHash (low frequencies of a 32x32 DCT) and a
+64-bit dHash (horizontal gradients of a 9x8 thumbnail). Two images are near
+duplicates when both hashes differ in at most `threshold` bits, so bursts,
+re-exports and resized copies match while different photos do not.
+
+Hashes are computed in vectorized batches (one DCT for the whole batch),
+stored in SQLite with each file's mtime and size so refresh() only rehashes
+changed files, and searched with a BK-tree. The index also remembers which
+output was produced from which input, so the engine can reuse a result for
+a near-duplicate instead of paying for another DeepAI call.
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+DEFAULT_THRESHOLD = 6
+BATCH_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix, so a 2-D DCT is M @ X @ M.T."""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+_BIT_WEIGHTS = (1 << np.arange(63, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def _pack_bits(bits):
+    """(N, 64) booleans -> list of N Python ints."""
+    return [int(value) for value in (bits.astype(np.uint64) * _BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)]
+
+
+def load_thumbnail(path):
+    """Grayscale 32x32 float32 thumbnail; JPEGs are decoded in draft mode at a fraction of full size."""
+    with Image.open(path) as image:
+        image.draft('L', (DCT_SIZE * 4, DCT_SIZE * 4))
+        thumbnail = image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR)
+    return np.asarray(thumbnail, dtype=np.float32)
+
+
+def hash_batch(thumbnails):
+    """
+    pHash and dHash for a (N, 32, 32) stack of thumbnails, as two lists of
+    64-bit ints. All N DCTs run as two batched matrix products.
+    """
+    thumbnails = np.asarray(thumbnails, dtype=np.float32)
+    count = len(thumbnails)
+
+    dct = _DCT @ thumbnails @ _DCT.T
+    low = dct[:, :HASH_SIZE, :HASH_SIZE].reshape(count, -1)
+    # The median skips the DC term, which only carries overall brightness
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    phashes = _pack_bits(low > median)
+
+    # dHash on a 9x8 area-averaged version of the same thumbnail
+    columns = np.linspace(0, DCT_SIZE, HASH_SIZE + 2).astype(int)
+    rows = np.linspace(0, DCT_SIZE, HASH_SIZE + 1).astype(int)
+    cells = np.add.reduceat(np.add.reduceat(thumbnails, rows[:-1], axis=1), columns[:-1], axis=2)
+    dhashes = _pack_bits((cells[:, :, 1:] > cells[:, :, :-1]).reshape(count, -1))
+    return phashes, dhashes
+
+
+def distance(a, b):
+    """Distance between two (phash, dhash) pairs: the larger of their Hamming distances."""
+    return max((a[0] ^ b[0]).bit_count(), (a[1] ^ b[1]).bit_count())
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over (phash, dhash) pairs for radius queries.
+
+    Each child edge is labelled with its distance to the parent, so a search
+    within radius r only descends into edges in [d - r, d + r] by the
+    triangle inequality, instead of comparing against every hash.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, item):
+        self.size += 1
+        node = [key, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            d = distance(key, current[0])
+            if d == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, key, radius):
+        """[(distance, item)] for every item within radius of key, closest first."""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_key, items, children = stack.pop()
+            d = distance(key, node_key)
+            if d <= radius:
+                matches.extend((d, item) for item in items)
+            for edge, child in children.items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class PHashIndex:
+    """
+    Persistent perceptual-hash index of image files plus the results made from them.
+
+    Paths are stored absolute. Thread-safe; a BK-tree over the stored hashes
+    is rebuilt lazily after the index changes.
+    """
+
+    def __init__(self, filename='phash_index.db', threshold=DEFAULT_THRESHOLD, workers=None):
+        self.filename = filename
+        self.threshold = threshold
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._lock = threading.RLock()
+        self._tree = None
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, phash INTEGER, dhash INTEGER
+            )
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                path TEXT NOT NULL, variant TEXT NOT NULL, output_path TEXT NOT NULL, created_at REAL,
+                PRIMARY KEY (path, variant)
+            )
+        """)
+
+    def close(self):
+        self._connection.close()
+
+    def refresh(self, image_paths, remove_missing=False):
+        """
+        Hash every new or changed file in image_paths (in batches) and return
+        how many were hashed. With remove_missing, entries for files that no
+        longer exist are dropped as well.
+        """
+        paths = [os.path.abspath(path) for path in image_paths]
+        with self._lock:
+            known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                     self._connection.execute("SELECT path, mtime_ns, size FROM hashes")}
+
+        stale = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                stale.append((path, stat.st_mtime_ns, stat.st_size))
+
+        hashed = 0
+        # Pillow releases the GIL while decoding, so thumbnails load in parallel
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for start in range(0, len(stale), BATCH_SIZE):
+                batch = stale[start:start + BATCH_SIZE]
+                thumbnails = list(pool.map(_safe_thumbnail, [path for path, _, _ in batch]))
+                readable = [(entry, thumbnail) for entry, thumbnail in zip(batch, thumbnails) if thumbnail is not None]
+                if not readable:
+                    continue
+                phashes, dhashes = hash_batch(np.stack([thumbnail for _, thumbnail in readable]))
+                rows = [(path, mtime_ns, size, _to_signed(phash), _to_signed(dhash))
+                        for ((path, mtime_ns, size), _), phash, dhash in zip(readable, phashes, dhashes)]
+                with self._lock, self._connection:
+                    self._connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+                    # A changed file's old results no longer describe it
+                    self._connection.executemany("DELETE FROM results WHERE path = ?",
+                                                 [(row[0],) for row in rows if row[0] in known])
+                    self._tree = None
+                hashed += len(rows)
+
+        if remove_missing:
+            missing = [(path,) for path in known if not os.path.exists(path)]
+            if missing:
+                with self._lock, self._connection:
+                    self._connection.executemany("DELETE FROM hashes WHERE path = ?", missing)
+                    self._connection.executemany("DELETE FROM results WHERE path = ?", missing)
+                    self._tree = None
+        return hashed
+
+    def refresh_directory(self, directory):
+        """refresh() every image under directory and forget files that were deleted from it."""
+        image_paths = []
+        for root, _, files in os.walk(directory):
+            image_paths.extend(os.path.join(root, name) for name in files
+                               if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.webp')))
+        return self.refresh(image_paths, remove_missing=True)
+
+    def hash_of(self, image_path):
+        with self._lock:
+            row = self._connection.execute("SELECT phash, dhash FROM hashes WHERE path = ?",
+                                           (os.path.abspath(image_path),)).fetchone()
+        return (_to_unsigned(row[0]), _to_unsigned(row[1])) if row else None
+
+    def _get_tree(self):
+        with self._lock:
+            if self._tree is None:
+                tree = BKTree()
+                for path, phash, dhash in self._connection.execute("SELECT path, phash, dhash FROM hashes"):
+                    tree.add((_to_unsigned(phash), _to_unsigned(dhash)), path)
+                self._tree = tree
+            return self._tree
+
+    def similar(self, image_path, threshold=None):
+        """[(distance, path)] of other indexed images within threshold of image_path, closest first."""
+        key = self.hash_of(image_path)
+        if key is None:
+            return []
+        path = os.path.abspath(image_path)
+        threshold = self.threshold if threshold is None else threshold
+        return [(d, other) for d, other in self._get_tree().search(key, threshold) if other != path]
+
+    def groups(self, image_paths, threshold=None):
+        """
+        Split image_paths into near-duplicate groups: {representative: [duplicates]}.
+        Every path is either a representative or in exactly one group.
+        """
+        paths = [os.path.abspath(path) for path in image_paths]
+        wanted = set(paths)
+        assigned = {}
+        groups = {}
+        for path in paths:
+            if path in assigned:
+                continue
+            groups[path] = []
+            assigned[path] = path
+            for _, other in self.similar(path, threshold):
+                if other in wanted and other not in assigned:
+                    assigned[other] = path
+                    groups[path].append(other)
+        return groups
+
+    def record_result(self, image_path, variant, output_path):
+        """Remember that output_path is image_path restyled as variant (a style/prompt identifier)."""
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                     (os.path.abspath(image_path), variant, os.path.abspath(output_path), time.time()))
+
+    def find_result(self, image_path, variant, threshold=None, exclude=()):
+        """
+        (source path, output path) of an existing result in the same variant
+        from a near duplicate of image_path, or None. image_path's own result
+        and those of the paths in exclude are not considered, and neither
+        are results whose output file has been deleted.
+        """
+        path = os.path.abspath(image_path)
+        excluded = {path, *(os.path.abspath(other) for other in exclude)}
+        candidates = [other for _, other in self.similar(path, threshold) if other not in excluded]
+        with self._lock:
+            for candidate in candidates:
+                row = self._connection.execute("SELECT output_path FROM results WHERE path = ? AND variant = ?",
+                                               (candidate, variant)).fetchone()
+                if row and os.path.exists(row[0]):
+                    return candidate, row[0]
+        return None
+
+
+def _safe_thumbnail(path):
+    try:
+        return load_thumbnail(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not hash %s: %s", path, e)
+        return None
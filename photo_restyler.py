@@ -1,17 +1,25 @@
 import sys
-import json
-import requests
 import os
 import shutil
-import subprocess
+import logging
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QFileDialog, 
     QMessageBox, QProgressBar, QTextEdit, QDialog, QDialogButtonBox, QComboBox, 
-    QCheckBox
+    QCheckBox, QListWidget, QListWidgetItem
 )
 from PySide6.QtGui import QPixmap
 from PySide6.QtCore import Qt
-from playwright.sync_api import sync_playwright
+import json_handler
+import restyle_engine
+import restyle_jobs
+import description_cache
+import workspace
+import result_cache
+import preprocess
+import metrics
+from restyle_pipelines import registry
+
+logger = logging.getLogger(__name__)
 
 class PhotoRestylerWindow(QWidget):
     def __init__(self, go_to_main):
@@ -24,8 +32,24 @@ class PhotoRestylerWindow(QWidget):
         self.selected_art_style = None
         self.edited_image_path = None
         self.description_generation_enabled = False
-        self.description_file_path = 'image_restyle_description.txt'  # Fixed file path
-        self.restyle_in_progress = False
+        # Private scratch directory, so several windows or runs never share files
+        self.workspace = workspace.JobWorkspace(prefix='photo-restyler-')
+        self.description_file_path = self.workspace.artifact('description', 'image_restyle_description.txt')
+        self.result_workspace = None  # Workspace of the restyle currently shown
+        self.description_cache = description_cache.get_shared_description_cache()
+        self.job_items = {}  # Job id -> queue list item
+        self.preview_labels = {}  # Image path -> label waiting for its thumbnail
+
+        # Background jobs keep the UI thread free while restyles and descriptions run
+        self.job_queue = restyle_jobs.JobQueue(max_workers=3, parent=self)
+        self.job_queue.job_added.connect(self.on_job_added)
+        self.job_queue.job_changed.connect(self.on_job_changed)
+        self.job_queue.job_removed.connect(self.on_job_removed)
+
+        # Previews come from the thumbnail cache, so large photos are never fully decoded for display
+        self.thumbnail_loader = restyle_jobs.ThumbnailLoader(parent=self)
+        self.thumbnail_loader.ready.connect(self.on_thumbnail_ready)
+        self.thumbnail_loader.failed.connect(self.on_thumbnail_failed)
 
         # Load DeepAI API key
         self.api_key = self.load_deepai_key()
@@ -107,6 +131,20 @@ class PhotoRestylerWindow(QWidget):
         self.save_button.clicked.connect(self.save_edited_image)
         layout.addWidget(self.save_button)
 
+        # Visible queue of background jobs
+        self.job_list = QListWidget()
+        self.job_list.setSelectionMode(QListWidget.ExtendedSelection)
+        self.job_list.setMaximumHeight(120)
+        layout.addWidget(self.job_list)
+
+        self.cancel_job_button = QPushButton("Cancel Selected Jobs")
+        self.cancel_job_button.clicked.connect(self.cancel_selected_jobs)
+        layout.addWidget(self.cancel_job_button)
+
+        self.clear_jobs_button = QPushButton("Clear Finished Jobs")
+        self.clear_jobs_button.clicked.connect(self.clear_finished_jobs)
+        layout.addWidget(self.clear_jobs_button)
+
         # Label to display the edited image
         self.edited_image_label = QLabel("Edited image will appear here")
         layout.addWidget(self.edited_image_label)
@@ -116,16 +154,7 @@ class PhotoRestylerWindow(QWidget):
 
     def load_deepai_key(self):
         """Load DeepAI API key from storage.txt."""
-        try:
-            with open('storage.txt', 'r') as file:
-                for line in file:
-                    if line.startswith('deepai-key:'):
-                        return line.split(':')[1].strip()
-        except FileNotFoundError:
-            print("The storage.txt file was not found.")
-        except Exception as e:
-            print(f"An error occurred while reading the API key: {str(e)}")
-        return None
+        return restyle_engine.load_deepai_key()
 
     def toggle_description_generation(self, checked):
         self.description_generation_enabled = checked
@@ -139,17 +168,8 @@ class PhotoRestylerWindow(QWidget):
             self.step_label.setVisible(True)
 
     def load_art_styles(self):
-        """Load art styles from the JSON file."""
-        try:
-            with open('art_styles.json', 'r') as file:
-                data = json.load(file)
-                return data
-        except FileNotFoundError:
-            print("The JSON file was not found.")
-            return []
-        except json.JSONDecodeError:
-            print("Error decoding the JSON file.")
-            return []
+        """Load art styles from the style store."""
+        return json_handler.load_art_styles()
 
     def select_art_style(self):
         """Get the selected art style from the dropdown menu."""
@@ -164,14 +184,9 @@ class PhotoRestylerWindow(QWidget):
 
     def update_prompt_for_art_style(self):
         """Fetch and display the prompt for the selected art style."""
-        art_styles = self.load_art_styles()
-
-        # Find the prompt for the selected art style
-        prompt = None
-        for style in art_styles:
-            if isinstance(style, dict) and style.get('name') == self.selected_art_style:
-                prompt = style.get('description', '')  # Use description as prompt
-                break
+        # Indexed lookup; the store only re-reads art_styles.json if it changed
+        style = json_handler.get_art_style(self.selected_art_style)
+        prompt = style.get('description', '') if style else None  # Use description as prompt
 
         if prompt:
             self.prompt_label.setText(prompt)
@@ -192,16 +207,13 @@ class PhotoRestylerWindow(QWidget):
                 QMessageBox.warning(self, "Error", "The selected image file does not exist.")
                 return
 
-            # Display the selected image in the QLabel
-            pixmap = QPixmap(self.selected_image_path)
-            if pixmap.isNull():
-                QMessageBox.warning(self, "Error", "Failed to load the image.")
-                return
-
-            self.image_label.setPixmap(pixmap.scaled(200, 200, Qt.KeepAspectRatio))  # Scale the image to fit the label
+            # Display a thumbnail of the selected image in the QLabel
+            self.show_preview(self.image_label, self.selected_image_path)
 
             # Only proceed with description generation if enabled
             if self.description_generation_enabled:
+                # The job looks the image up in the description cache first; hashing it here
+                # would read the whole file on the UI thread
                 self.progress_bar.setVisible(True)
                 self.step_label.setVisible(True)
                 self.Img_Description()
@@ -209,52 +221,35 @@ class PhotoRestylerWindow(QWidget):
             QMessageBox.warning(self, "No Image", "Please select an image file.")
 
     def Img_Description(self):
-        """Generate a description for the selected image."""
-        try:
-            if not self.description_generation_enabled:
-                return  # Exit if description generation is disabled
-
-            self.progress_bar.setValue(20)
-            self.step_label.setText("Step: Launching browser")
-            with sync_playwright() as playwright:
-                browser = playwright.chromium.launch(headless=True)
+        """Queue description generation for the selected image."""
+        if not self.description_generation_enabled:
+            return  # Exit if description generation is disabled
 
-                self.progress_bar.setValue(40)
-                self.step_label.setText("Step: Navigating to website")
-                page = browser.new_page()
-                page.goto("https://imagedescriptiongenerator.net/")
+        job = restyle_jobs.DescriptionJob(self.selected_image_path, cache=self.description_cache)
+        job.signals.progress.connect(self.on_job_progress)
+        job.signals.finished.connect(self.on_description_finished)
+        job.signals.failed.connect(self.on_description_failed)
+        self.job_queue.submit(job)
 
-                self.progress_bar.setValue(60)
-                self.step_label.setText("Step: Uploading image")
-                page.set_input_files('input[type="file"]', self.selected_image_path)
+    def on_description_finished(self, job_id, description):
+        """Store and display a description produced by a DescriptionJob."""
+        self.show_description(description)
 
-                page.wait_for_timeout(2000)  # Wait for the upload to complete
-                page.click('button:has-text("Generate Description")')
+    def show_description(self, description):
+        """Store a description in the window's description file and display it."""
+        self.generated_description = description
 
-                self.progress_bar.setValue(80)
-                self.step_label.setText("Step: Generating description")
-                page.wait_for_selector('#GenDescription')
-
-                self.generated_description = page.inner_text('#GenDescription')
-                self.progress_bar.setValue(90)
-                self.step_label.setText("Step: Description generated")
-
-                # Write description to the fixed file
-                with open(self.description_file_path, 'w') as file:
-                    file.write(self.generated_description)
+        # Write description to the window's description file
+        with open(self.description_file_path, 'w') as file:
+            file.write(self.generated_description)
 
-                self.progress_bar.setValue(100)
-                self.step_label.setText("Step: Description saved")
-                browser.close()
+        self.generated_description_label.setText(self.generated_description)
+        self.generated_description_label.setVisible(True)
+        self.hide_progress_if_idle()
 
-                # Display the generated description
-                self.generated_description_label.setText(self.generated_description)
-                self.generated_description_label.setVisible(True)
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"An error occurred during description generation: {str(e)}")
-        finally:
-            self.progress_bar.setVisible(False)
-            self.step_label.setVisible(False)
+    def on_description_failed(self, job_id, error):
+        QMessageBox.warning(self, "Error", f"An error occurred during description generation: {error}")
+        self.hide_progress_if_idle()
 
     def edit_description(self):
         """Edit the description in a dialog box."""
@@ -277,7 +272,7 @@ class PhotoRestylerWindow(QWidget):
     def save_description(self, new_description):
         """
         Save the edited description to the file. If the 'Hand Drawn' style is selected,
-        a brief prompt will be saved into image_restyle_description.txt.
+        a brief prompt will be saved into the window's image_restyle_description.txt.
         """
         try:
             # If 'Hand Drawn' is the selected style, override with a specific prompt
@@ -292,156 +287,132 @@ class PhotoRestylerWindow(QWidget):
             self.generated_description = new_description
             self.generated_description_label.setText(new_description)
             
-            print(f"Description saved successfully: {new_description}")
+            logger.debug("Description saved: %s", new_description)
         except Exception as e:
             QMessageBox.warning(self, "Error", f"An error occurred while saving the description: {str(e)}")
 
 
     def restyle_img(self):
-        """Handle the image restyling and clarity enhancement process."""
-        if self.restyle_in_progress:
-            QMessageBox.warning(self, "Process In Progress", "Restyling is already in progress.")
-            return
-        
-        self.restyle_in_progress = True
-        self.progress_bar.setValue(10)
-        self.progress_bar.setVisible(True)
-        self.step_label.setVisible(True)
-        self.step_label.setText("Step: Starting restyling")
-
+        """Queue the image restyling and clarity enhancement process."""
         # Check if image and art style are selected
         if not self.selected_image_path:
             QMessageBox.warning(self, "No Image", "Please select an image file.")
-            self.restyle_in_progress = False
-            self.progress_bar.setVisible(False)
-            self.step_label.setVisible(False)
             return
 
         if not self.selected_art_style or self.selected_art_style == "Select Artform":
             QMessageBox.warning(self, "No Art Style", "Please select an art style.")
-            self.restyle_in_progress = False
-            self.progress_bar.setVisible(False)
-            self.step_label.setVisible(False)
             return
 
-        # Write the prompt to the fixed file
-        with open(self.description_file_path, 'w') as file:
-            file.write(self.prompt_label.toPlainText())
+        self.progress_bar.setValue(10)
+        self.progress_bar.setVisible(True)
+        self.step_label.setVisible(True)
+        self.step_label.setText("Step: Starting restyling")
 
-        if self.select_art_style == "Hand Drawn":
-            # Call the function to handle hand drawn style
-            self.restyle_with_subprocess(self.selected_image)
-        else:
-        
-            self.progress_bar.setValue(30)
-            self.step_label.setText("Step: Sending request to DeepAI for restyling")
+        job = restyle_jobs.RestyleImageJob(
+            self.selected_image_path, self.prompt_label.toPlainText(), self.api_key,
+            cache=result_cache.get_shared_cache(),
+            pipeline=registry.get_style_pipeline(
+                self.selected_art_style, preprocessor=preprocess.get_shared_preprocessor()
+            )
+        )
+        job.signals.progress.connect(self.on_job_progress)
+        job.signals.finished.connect(self.on_restyle_finished)
+        job.signals.failed.connect(self.on_restyle_failed)
+        self.job_queue.submit(job)
+
+    def on_restyle_finished(self, job_id, result_workspace):
+        """Show the result of a finished RestyleImageJob."""
+        # The previous result is no longer shown or saveable, so its files can go
+        if self.result_workspace is not None:
+            self.result_workspace.close()
+        self.result_workspace = result_workspace
+        self.enhanced_image_path = result_workspace.artifacts['output']
+        self.edited_image_path = self.enhanced_image_path
+
+        self.show_preview(self.edited_image_label, self.enhanced_image_path)
+        self.save_button.setVisible(True)
+        self.hide_progress_if_idle()
+
+    def show_preview(self, label, image_path):
+        """Show a thumbnail of image_path in label: at once if it is cached, otherwise when it has loaded."""
+        # A label shows only its latest request; an older thumbnail arriving late is ignored
+        for path, waiting in list(self.preview_labels.items()):
+            if waiting is label:
+                del self.preview_labels[path]
+        image = self.thumbnail_loader.request(image_path)
+        if image is not None:
+            self.set_preview(label, image)
+            return
+        label.setText("Loading preview...")
+        self.preview_labels[image_path] = label
 
-            # Prepare files for API request
-            image_file = open(self.selected_image_path, 'rb')
-            description_file = open(self.description_file_path, 'rb')
+    def set_preview(self, label, image):
+        label.setPixmap(QPixmap.fromImage(image).scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation))
 
-            # Print file paths and contents for debugging
-            print(f"Image file path: {self.selected_image_path}")
-            print(f"Description file path: {self.description_file_path}")
-            
-            # Read and print contents of files
-            image_file_contents = image_file.read()
-            description_file_contents = description_file.read()
+    def on_thumbnail_ready(self, image_path, image):
+        label = self.preview_labels.pop(image_path, None)
+        if label is not None:
+            self.set_preview(label, image)
 
-            # Ensure files are properly closed after reading
-            image_file.seek(0)  # Reset file pointer to beginning
-            description_file.seek(0)  # Reset file pointer to beginning
-            
-            print("Image file contents (first 100 bytes):", image_file_contents[:100])
-            print("Description file contents:", description_file_contents.decode('utf-8'))
-
-            # Close files
-            image_file.close()
-            description_file.close()
-
-            # Send request to DeepAI for restyling
-            try:
-                response = requests.post(
-                    "https://api.deepai.org/api/image-editor",
-                    files={
-                        'image': open(self.selected_image_path, 'rb'),
-                        'text': open(self.description_file_path, 'rb'),
-                    },
-                    headers={'api-key': self.api_key}
-                )
-                self.progress_bar.setValue(70)
-                self.step_label.setText("Step: Processing response")
-
-                if response.status_code == 200:
-                    response_data = response.json()
-                    if 'output_url' in response_data:
-                        # Save restyled image before clarity enhancement
-                        restyled_image_url = response_data['output_url']
-                        self.restyled_image_path = self.download_image(restyled_image_url, 'restyled_image.jpg')
-
-                        self.progress_bar.setValue(80)
-                        self.step_label.setText("Step: Enhancing image clarity")
-
-                        # Enhance clarity using the Torch SRGAN API
-                        clarity_response = requests.post(
-                            "https://api.deepai.org/api/waifu2x",
-                            files={
-                                'image': open(self.restyled_image_path, 'rb'),
-                            },
-                            headers={'api-key': self.api_key}
-                        )
-                        
-                        if clarity_response.status_code == 200:
-                            clarity_data = clarity_response.json()
-                            if 'output_url' in clarity_data:
-                                clarity_image_url = clarity_data['output_url']
-                                self.enhanced_image_path = self.download_image(clarity_image_url, 'enhanced_image.jpg')
-
-                                self.progress_bar.setValue(90)
-                                self.step_label.setText("Step: Downloading enhanced image")
-
-                                pixmap = QPixmap(self.enhanced_image_path)
-                                self.edited_image_label.setPixmap(pixmap.scaled(200, 200, Qt.KeepAspectRatio))
-                                self.save_button.setVisible(True)
-
-                            else:
-                                QMessageBox.warning(self, "Error", "No output URL found in the clarity response.")
-                        else:
-                            QMessageBox.warning(self, "Error", f"Failed to enhance image clarity: {clarity_response.status_code}")
-
-                    else:
-                        QMessageBox.warning(self, "Error", "No output URL found in the restyling response.")
-                else:
-                    QMessageBox.warning(self, "Error", f"Failed to restyle the image: {response.status_code}")
-
-            except requests.RequestException as e:
-                QMessageBox.warning(self, "Error", f"An error occurred while sending the request: {str(e)}")
-            finally:
-                self.restyle_in_progress = False
-                self.progress_bar.setVisible(False)
-                self.step_label.setVisible(False)
-
-    def restyle_with_subprocess(self, image_path, text_path):
-        """
-        Function to handle the "Hand Drawn" style using subprocess to run the external script.
-        """
-        hand_drawn_script_path = os.path.join(os.getcwd(), 'restyle_pipelines', 'hand_drawn.py')
-        
-        try:
-            # Run the external script via subprocess, passing the image and text paths
-            subprocess.run(['python', hand_drawn_script_path, image_path, text_path], check=True)
-            print("Successfully restyled the image using the Hand Drawn style.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error running the hand drawn script: {e}")
+    def on_thumbnail_failed(self, image_path, error):
+        label = self.preview_labels.pop(image_path, None)
+        if label is not None:
+            label.setText("No preview available")
+            QMessageBox.warning(self, "Error", f"Failed to load the image: {error}")
+
+    def on_restyle_failed(self, job_id, error):
+        QMessageBox.warning(self, "Error", f"Failed to restyle the image: {error}")
+        self.hide_progress_if_idle()
+
+    def on_job_progress(self, job_id, percent, step):
+        """Mirror the most recent job progress in the progress bar and step label."""
+        self.progress_bar.setVisible(True)
+        self.step_label.setVisible(True)
+        self.progress_bar.setValue(percent)
+        self.step_label.setText(step)
+
+    def hide_progress_if_idle(self):
+        if self.job_queue.pending_count() == 0:
+            self.progress_bar.setVisible(False)
+            self.step_label.setVisible(False)
+
+    def on_job_added(self, job):
+        item = QListWidgetItem(job.label)
+        item.setData(Qt.UserRole, job.job_id)
+        self.job_list.addItem(item)
+        self.job_items[job.job_id] = item
+
+    def on_job_changed(self, job, status):
+        item = self.job_items.get(job.job_id)
+        if item is not None:
+            item.setText(f"#{job.job_id} {job.label} - {status}")
+
+    def on_job_removed(self, job):
+        self.job_items.pop(job.job_id, None)
+        self.hide_progress_if_idle()
+
+    def cancel_selected_jobs(self):
+        """Cancel the jobs selected in the queue list."""
+        for item in self.job_list.selectedItems():
+            self.job_queue.cancel(item.data(Qt.UserRole))
+
+    def clear_finished_jobs(self):
+        """Remove finished, failed and cancelled jobs from the queue list."""
+        for row in reversed(range(self.job_list.count())):
+            if self.job_list.item(row).data(Qt.UserRole) not in self.job_items:
+                self.job_list.takeItem(row)
+
+    def closeEvent(self, event):
+        # Queued jobs should not keep running once the window is gone
+        self.job_queue.cancel_all()
+        if self.result_workspace is not None:
+            self.result_workspace.close()
+        self.workspace.close()
+        super().closeEvent(event)
 
     def download_image(self, image_url, filename):
         """Download an image from the provided URL and save it with the given filename."""
-        response = requests.get(image_url)
-        response.raise_for_status()  # Ensure we got a successful response
-        image_path = filename
-        with open(image_path, 'wb') as file:
-            file.write(response.content)
-        return image_path
+        return restyle_engine.download_image(image_url, filename, self.api_key)
 
 
     def save_edited_image(self):
@@ -478,6 +449,7 @@ class PhotoRestylerWindow(QWidget):
             file.write(new_prompt)
 
 if __name__ == "__main__":
+    metrics.configure_logging()
     app = QApplication(sys.argv)
     window = PhotoRestylerWindow(lambda: print("Back to main screen"))  # Dummy function for navigation
     window.show()
@@ -0,0 +1,123 @@
+import io
+import os
+import logging
+import threading
+from PIL import Image, ImageOps, features
+import metrics
+
+# DeepAI returns results of roughly this size whatever is uploaded, so larger inputs only cost upload time
+DEFAULT_MAX_SIDE = 1536
+DEFAULT_FORMAT = 'JPEG'
+DEFAULT_QUALITY = 85
+
+UPLOAD_FORMATS = ('JPEG', 'WEBP')
+
+# Source formats DeepAI accepts as they are, so a small enough file can be sent unchanged
+PASSTHROUGH_FORMATS = ('JPEG', 'PNG', 'WEBP')
+# Image.info keys that only describe the encoding. A file with any other key (EXIF, XMP,
+# ICC, comments, PNG text, ...) carries metadata and is never uploaded unchanged
+ENCODING_INFO_KEYS = frozenset((
+    'jfif', 'jfif_version', 'jfif_unit', 'jfif_density', 'dpi', 'progressive', 'progression',
+    'adobe', 'adobe_transform', 'gamma', 'srgb', 'aspect', 'interlace', 'transparency',
+))
+
+logger = logging.getLogger(__name__)
+
+
+class UploadPreprocessor:
+    """
+    Shrinks images before they are uploaded to DeepAI.
+
+    prepare() fits an image inside max_side x max_side, applies and then
+    drops its EXIF orientation and other metadata, and re-encodes it as a
+    quality-targeted JPEG or WebP. JPEG sources are decoded in draft mode at
+    reduced scale, so huge photos are never fully decoded. If the result is
+    not smaller than a compressed file that already fits and carries no
+    metadata, the original bytes are kept.
+
+    Totals of bytes read and sent are kept for reporting.
+    """
+
+    def __init__(self, max_side=DEFAULT_MAX_SIDE, format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+        format = format.upper()
+        if format not in UPLOAD_FORMATS:
+            raise ValueError(f"Unsupported upload format: {format}")
+        if format == 'WEBP' and not features.check('webp'):
+            logger.warning("Pillow was built without WebP support; uploading JPEG instead.")
+            format = 'JPEG'
+        self.max_side = max_side
+        self.format = format
+        self.quality = quality
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, image_path):
+        """Return (bytes to upload, original file size) for an image file."""
+        with metrics.span('preprocess') as span:
+            data, original_size = self._prepare(image_path)
+            span.add_bytes(original_size)
+        with self._lock:
+            self.images += 1
+            self.bytes_in += original_size
+            self.bytes_out += len(data)
+        return data, original_size
+
+    def _prepare(self, image_path):
+        original_size = os.path.getsize(image_path)
+        with Image.open(image_path) as image:
+            source_format = image.format
+            has_metadata = not ENCODING_INFO_KEYS.issuperset(image.info)
+            fits = max(image.size) <= self.max_side
+            if image.format == 'JPEG':
+                image.draft('RGB', (self.max_side, self.max_side))
+            image = ImageOps.exif_transpose(image)
+            image = self._to_rgb(image)
+        if not fits:
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        # No exif/icc arguments, so none of the source metadata is written
+        image.save(buffer, self.format, quality=self.quality, optimize=True)
+        data = buffer.getvalue()
+
+        if fits and not has_metadata and source_format in PASSTHROUGH_FORMATS and len(data) >= original_size:
+            with open(image_path, 'rb') as file:
+                data = file.read()
+        return data, original_size
+
+    @staticmethod
+    def _to_rgb(image):
+        # Transparent areas become white rather than the black JPEG would give them
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+    def stats(self):
+        return {
+            'images': self.images,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_saved(),
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+        }
+
+
+_shared_preprocessor = None
+_shared_preprocessor_lock = threading.Lock()
+
+
+def get_shared_preprocessor():
+    """Return the process-wide preprocessor with the default settings, created on first use."""
+    global _shared_preprocessor
+    with _shared_preprocessor_lock:
+        if _shared_preprocessor is None:
+            _shared_preprocessor = UploadPreprocessor()
+        return _shared_preprocessor
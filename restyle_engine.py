@@ -0,0 +1,734 @@
+import os
+import json
+import math
+import mmap
+import shutil
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+import json_handler
+import metrics
+import result_cache
+import deepai_client
+import job_store
+import restyle_pipelines
+
+DEEPAI_IMAGE_EDITOR_URL = f"{deepai_client.DEEPAI_BASE_URL}/image-editor"
+DEEPAI_WAIFU2X_URL = f"{deepai_client.DEEPAI_BASE_URL}/waifu2x"
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Sentinel pushed through the stage queues to tell workers to stop
+_STOP = object()
+
+
+# Raised when a restyle stage fails for a single image
+RestyleError = deepai_client.DeepAIError
+
+
+class OutputCollision(ValueError):
+    """Raised before a run starts when two images would be written to the same output path."""
+
+logger = logging.getLogger(__name__)
+
+
+def load_deepai_key(filename='storage.txt'):
+    """Load DeepAI API key from storage.txt."""
+    try:
+        with open(filename, 'r') as file:
+            for line in file:
+                if line.startswith('deepai-key:'):
+                    return line.split(':')[1].strip()
+    except FileNotFoundError:
+        logger.warning("The %s file was not found.", filename)
+    except Exception as e:
+        logger.error("An error occurred while reading the API key: %s", e)
+    return None
+
+
+def get_art_style_prompt(style_name, filename='art_styles.json'):
+    """Return the description of the named art style, or None if it does not exist."""
+    style = json_handler.get_art_style(style_name, filename)
+    return style.get('description', '') if style is not None else None
+
+
+def collect_images(source):
+    """
+    Return the list of image paths to process.
+
+    The source is either a directory (scanned recursively for image files) or a
+    manifest file: a JSON list of paths or a text file with one path per line.
+    Relative manifest entries are resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        image_paths = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    image_paths.append(os.path.join(root, name))
+        return sorted(image_paths)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as file:
+        if source.lower().endswith('.json'):
+            entries = json.load(file)
+        else:
+            entries = [line.strip() for line in file]
+
+    image_paths = []
+    for entry in entries:
+        if entry and not entry.startswith('#'):
+            image_paths.append(entry if os.path.isabs(entry) else os.path.join(base_dir, entry))
+    return image_paths
+
+
+def output_names(image_paths):
+    """
+    Map each image path to a unique output name: its path relative to the
+    images' common directory, without the extension ('trip/beach' for
+    photos/trip/beach.png). Images whose names differ only by extension keep
+    it ('trip/beach_png', 'trip/beach_jpg'). Raises OutputCollision if an image is
+    listed twice or two images still map to the same name, rather than let
+    one result overwrite another.
+    """
+    absolute, seen = {}, set()
+    for path in image_paths:
+        full = os.path.abspath(path)
+        if os.path.normcase(full) in seen:
+            raise OutputCollision(f"{path} is listed more than once")
+        seen.add(os.path.normcase(full))
+        absolute[path] = full
+    if not absolute:
+        return {}
+    root = os.path.commonpath([os.path.dirname(full) for full in absolute.values()])
+    groups = {}
+    for path, full in absolute.items():
+        stem, extension = os.path.splitext(os.path.relpath(full, root))
+        groups.setdefault(os.path.normcase(stem), []).append((path, stem, extension))
+
+    names, claimed = {}, {}
+    for members in groups.values():
+        for path, stem, extension in members:
+            name = stem if len(members) == 1 else f"{stem}_{extension.lstrip('.').lower()}"
+            if os.path.normcase(name) in claimed:
+                raise OutputCollision(f"{claimed[os.path.normcase(name)]} and {path} would both be written as {name}")
+            claimed[os.path.normcase(name)] = path
+            names[path] = name
+    return names
+
+
+@contextmanager
+def open_image_buffer(image_path):
+    """
+    Memory-map an image file so it can be hashed and uploaded without
+    reading a copy of it into memory.
+    """
+    with open(image_path, 'rb') as file, metrics.span('read') as span:
+        size = os.fstat(file.fileno()).st_size
+        span.add_bytes(size)
+        if size == 0:
+            buffer = None
+        else:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer is None:
+        yield b''  # mmap cannot map an empty file
+        return
+    with buffer:
+        yield buffer
+
+
+@contextmanager
+def open_upload(image_path, preprocessor=None):
+    """
+    The bytes to upload for an image: shrunk and re-encoded by a
+    preprocess.UploadPreprocessor, or the memory-mapped file as it is.
+    """
+    if preprocessor is None:
+        with open_image_buffer(image_path) as buffer:
+            yield buffer
+    else:
+        yield preprocessor.prepare(image_path)[0]
+
+
+def restyle_image(image_data, prompt, api_key):
+    """Send an image buffer and the prompt to the DeepAI image-editor API and return the output URL."""
+    return deepai_client.get_client(api_key).restyle(image_data, prompt)
+
+
+def upscale_image(image_data, api_key):
+    """Send an image buffer to the DeepAI waifu2x API and return the output URL."""
+    return deepai_client.get_client(api_key).upscale(image_data)
+
+
+def fetch_image(image_url, api_key=None):
+    """Download an image and return its bytes."""
+    return deepai_client.get_client(api_key).fetch(image_url)
+
+
+def download_image(image_url, save_path, api_key=None, cache=None, key=None):
+    """
+    Stream an image from the provided URL to save_path in chunks.
+
+    With a cache and key the same chunks are also written into the cache entry.
+    """
+    client = deepai_client.get_client(api_key)
+    try:
+        with open(save_path, 'wb') as file:
+            if cache is None or key is None:
+                client.download(image_url, file)
+            else:
+                with cache.writer(key) as cache_file:
+                    client.download(image_url, file, cache_file)
+    except BaseException:
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        raise
+    return save_path
+
+
+def restyle_key(image_data, prompt):
+    return result_cache.make_key(image_data, prompt, DEEPAI_IMAGE_EDITOR_URL)
+
+
+def upscale_key(image_data):
+    return result_cache.make_key(image_data, '', DEEPAI_WAIFU2X_URL)
+
+
+def _cached_or_fetched_bytes(key, request_url, api_key, cache):
+    if cache is None:
+        return fetch_image(request_url(), api_key)
+    return cache.get_or_compute(key, lambda: fetch_image(request_url(), api_key))
+
+
+def _cached_or_downloaded_file(key, request_url, save_path, api_key, cache):
+    cached_path = cache.lookup(key) if cache is not None else None
+    if cached_path:
+        with metrics.span('save', source='cache') as span:
+            shutil.copyfile(cached_path, save_path)
+            span.add_bytes(os.path.getsize(save_path))
+        return save_path
+    return download_image(request_url(), save_path, api_key, cache, key)
+
+
+def restyle_to_bytes(image_data, prompt, api_key, cache=None):
+    """Restyle an image buffer and return the restyled image bytes, served from cache when possible."""
+    return _cached_or_fetched_bytes(
+        restyle_key(image_data, prompt), lambda: restyle_image(image_data, prompt, api_key), api_key, cache
+    )
+
+
+def restyle_to_file(image_data, prompt, save_path, api_key, cache=None):
+    """Restyle an image buffer and stream the result to save_path, served from cache when possible."""
+    return _cached_or_downloaded_file(
+        restyle_key(image_data, prompt), lambda: restyle_image(image_data, prompt, api_key), save_path, api_key, cache
+    )
+
+
+def upscale_to_file(image_data, save_path, api_key, cache=None):
+    """Enhance an image buffer with waifu2x and stream the result to save_path, served from cache when possible."""
+    return _cached_or_downloaded_file(
+        upscale_key(image_data), lambda: upscale_image(image_data, api_key), save_path, api_key, cache
+    )
+
+
+def restyle_file(image_path, prompt, api_key, output_path, upscale=True, cache=None, pipeline=None, on_step=None):
+    """
+    Restyle one image into output_path: through the style's pipeline if given
+    (see restyle_pipelines.registry), else with DeepAI and, optionally,
+    waifu2x. on_step(percent, text) reports progress. This is the one-image
+    path shared by the desktop windows and the HTTP service.
+    """
+    def step(percent, text):
+        if on_step:
+            on_step(percent, text)
+
+    if pipeline is not None:
+        step(30, f"Step: Running the {type(pipeline).__name__}")
+        return pipeline.run(image_path, prompt, api_key, output_path, cache)
+
+    with open_image_buffer(image_path) as image_data:
+        step(30, "Step: Sending request to DeepAI for restyling")
+        if not upscale:
+            restyle_to_file(image_data, prompt, output_path, api_key, cache)
+        else:
+            restyled_data = restyle_to_bytes(image_data, prompt, api_key, cache)
+
+    if upscale:
+        step(80, "Step: Enhancing image clarity")
+        upscale_to_file(restyled_data, output_path, api_key, cache)
+
+    if cache is not None:
+        stats = cache.stats()
+        step(95, f"Step: Cache hit ratio {stats['hit_ratio']:.0%} ({stats['hits']} hits, {stats['misses']} misses)")
+    return output_path
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class RestyleJob:
+    """One image travelling through the engine's stages."""
+
+    def __init__(self, image_path, output_path, record_id=None):
+        self.image_path = image_path
+        self.output_path = output_path
+        self.record_id = record_id  # Row in the engine's JobStore, if it has one
+        self.progress = 'pending'
+        self.description = None
+        self.reused_from = None  # Near-duplicate input whose result this job reused
+        self.upload_data = None
+        self.bytes_saved = 0
+        self.restyle_key = None
+        self.restyled_url = None
+        self.restyled_path = None
+        self.restyled_data = None
+        self.upscale_key = None
+        self.result_url = None
+        self.result_path = None
+        self.error = None
+        self.stage_times = {}
+
+
+class RestyleEngine:
+    """
+    GUI-free restyle → waifu2x → download pipeline.
+
+    Each stage runs in its own pool of worker threads connected by bounded
+    queues, so uploads for one image overlap downloads for another and the
+    queues apply backpressure when a downstream stage falls behind.
+
+    With a pipeline from restyle_pipelines.registry the stages follow it:
+    remote stages (if any) and then its local steps in the shared process
+    pool. Pipelines that cannot be split run whole in a 'pipeline' stage.
+
+    With a job_store every image's progress is saved after each paid step,
+    and a later run resumes each image after its last finished step.
+
+    With a dedup PHashIndex, near-duplicate inputs are restyled once: the
+    others reuse another image's result from an earlier run or the result
+    of the first image of their group ('reuse'), or are only reported
+    ('flag'). Whether an image needs doing at all is still the job store's call.
+    """
+
+    # Job store state reached by each stage that saves progress
+    CHECKPOINTS = {'describe': 'described', 'restyle': 'restyled', 'upscale': 'upscaled'}
+    # A stage is skipped for an image that already reached this state
+    RESUME_AFTER = {'describe': 'described', 'preprocess': 'restyled', 'restyle': 'restyled',
+                    'fetch': 'upscaled', 'upscale': 'upscaled'}
+
+    STAGES = ('describe', 'preprocess', 'restyle', 'fetch', 'upscale', 'download', 'postprocess', 'local', 'pipeline')
+
+    def __init__(self, api_key, prompt, output_dir='Restyled', workers=None, queue_size=16, upscale=True,
+                 on_progress=None, cache=None, pipeline=None, job_store=None, style=None, describer=None,
+                 dedup=None, dedup_mode='reuse'):
+        self.api_key = api_key
+        self.dedup = dedup
+        self.dedup_mode = dedup_mode
+        # Results are only interchangeable between runs of the same style and prompt
+        self.dedup_variant = result_cache.hash_bytes(f"{style}\0{prompt}".encode('utf-8'))
+        # A job store row restyled with another prompt starts over
+        self.prompt_hash = result_cache.hash_bytes(prompt.encode('utf-8'))
+        self._followers = {}  # Representative image path -> near-duplicate RestyleJobs waiting for it
+        self._output_names = {}  # Image path -> output name, see output_names()
+        self.job_store = job_store
+        self.style = style
+        self.describer = describer
+        self.cache = cache
+        self.pipeline = pipeline
+        self.prompt = prompt
+        self.output_dir = output_dir
+        self.upscale = upscale
+        self.queue_size = queue_size
+        self.on_progress = on_progress
+
+        # (has remote part, local steps), or None when the pipeline runs as one unit
+        self.remote, self.local_steps = True, []
+        self.preprocessor = None
+        self.split = True
+        if pipeline is not None:
+            split = pipeline.split()
+            if split is None:
+                self.split = False
+            else:
+                remote, self.local_steps = split
+                self.remote = remote is not None
+                self.upscale = remote.upscale if remote is not None else False
+                self.preprocessor = getattr(remote, 'preprocessor', None)
+
+        # Default worker counts favour the slow network-bound stages
+        cpu_count = os.cpu_count() or 1
+        self.workers = {'describe': 2, 'preprocess': cpu_count, 'restyle': 4, 'fetch': 2, 'upscale': 4, 'download': 2,
+                        'postprocess': cpu_count, 'local': cpu_count, 'pipeline': 4}
+        if workers:
+            self.workers.update(workers)
+
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stage_durations = {stage: [] for stage in self.STAGES}
+        self.completed = []
+        self.failed = []
+        self.skipped = []
+        self.started_at = None
+        self.finished_at = None
+
+    def output_path_for(self, image_path):
+        name = self._output_names.get(image_path) or os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.output_dir, f"{name}_restyled.jpg")
+
+    def _plan_outputs(self, image_paths):
+        """Give every image of a run its own output path, mirroring the input folders."""
+        self._output_names = output_names(image_paths)
+        for directory in {os.path.dirname(self.output_path_for(path)) for path in image_paths}:
+            os.makedirs(directory, exist_ok=True)
+
+    # Stage functions: each takes a job and fills in its results.
+    # A cache hit records the entry's path and later stages skip the network.
+
+    def _lookup(self, key):
+        return self.cache.lookup(key) if self.cache is not None else None
+
+    def _stage_describe(self, job):
+        job.description = self.describer(job.image_path)
+
+    def _stage_preprocess(self, job):
+        # Pillow releases the GIL while decoding, resizing and encoding, so threads suffice
+        job.upload_data, original_size = self.preprocessor.prepare(job.image_path)
+        job.bytes_saved = original_size - len(job.upload_data)
+
+    def _stage_restyle(self, job):
+        buffer = open_image_buffer(job.image_path) if job.upload_data is None else nullcontext(job.upload_data)
+        with buffer as image_data:
+            job.restyle_key = restyle_key(image_data, self.prompt)
+            job.restyled_path = self._lookup(job.restyle_key)
+            if job.restyled_path is None:
+                job.restyled_url = restyle_image(image_data, self.prompt, self.api_key)
+        job.upload_data = None
+
+    def _stage_fetch(self, job):
+        # The restyled image is re-uploaded to waifu2x, so keep it in memory
+        if job.restyled_path is not None:
+            with open(job.restyled_path, 'rb') as file:
+                job.restyled_data = file.read()
+        else:
+            job.restyled_data = fetch_image(job.restyled_url, self.api_key)
+            if self.cache is not None:
+                self.cache.put(job.restyle_key, job.restyled_data)
+
+    def _stage_upscale(self, job):
+        job.upscale_key = upscale_key(job.restyled_data)
+        job.result_path = self._lookup(job.upscale_key)
+        if job.result_path is None:
+            job.result_url = upscale_image(job.restyled_data, self.api_key)
+        job.restyled_data = None  # Drop the intermediate bytes as early as possible
+
+    def _stage_download(self, job):
+        if self.upscale:
+            key, path, url = job.upscale_key, job.result_path, job.result_url
+        else:
+            # Without upscaling the restyled image is downloaded straight to disk
+            key, path, url = job.restyle_key, job.restyled_path, job.restyled_url
+        if path is not None:
+            shutil.copyfile(path, job.output_path)
+        else:
+            download_image(url, job.output_path, self.api_key, self.cache, key)
+
+    def _stage_postprocess(self, job):
+        # The pipeline's local steps on the downloaded result, in the shared process pool
+        restyle_pipelines.run_steps(job.output_path, job.output_path, self.local_steps)
+
+    def _stage_local(self, job):
+        # Offline pipeline: straight from the input to the output with no network
+        restyle_pipelines.run_steps(job.image_path, job.output_path, self.local_steps)
+
+    def _stage_pipeline(self, job):
+        self.pipeline.run(job.image_path, self.prompt, self.api_key, job.output_path, self.cache)
+
+    def _active_stages(self):
+        if not self.split:
+            stages = ['pipeline']
+        elif not self.remote:
+            stages = ['local']
+        else:
+            stages = ['restyle', 'fetch', 'upscale', 'download'] if self.upscale else ['restyle', 'download']
+            if self.preprocessor is not None:
+                stages.insert(0, 'preprocess')
+            if self.local_steps:
+                stages.append('postprocess')
+        if self.describer is not None:
+            stages.insert(0, 'describe')
+        return stages
+
+    # Job store hooks: resume from saved progress and save it as stages finish
+
+    def _new_job(self, image_path):
+        """A RestyleJob for image_path, or None if the job store says it is done or out of attempts."""
+        job = RestyleJob(image_path, self.output_path_for(image_path))
+        if self.job_store is None:
+            return job
+        record = self.job_store.start(os.path.abspath(image_path), self.style,
+                                      os.path.abspath(job.output_path), self.prompt_hash)
+        if record is None:
+            return None
+        job.record_id = record.id
+        job.progress = record.progress
+        job.description = record.description
+        job.restyle_key, job.restyled_url = record.restyle_key, record.restyled_url
+        job.upscale_key, job.result_url = record.upscale_key, record.result_url
+        # Results already in the cache need no download from the saved URLs
+        if job.restyle_key:
+            job.restyled_path = self._lookup(job.restyle_key)
+        if job.upscale_key:
+            job.result_path = self._lookup(job.upscale_key)
+        # A step saved after a cache hit has no URL; once the entry is evicted, redo the step
+        if job.progress == 'upscaled' and (not self.upscale or (job.result_path is None and not job.result_url)):
+            job.progress = 'restyled'
+        if job.progress == 'restyled' and job.restyled_path is None and not job.restyled_url:
+            job.progress = 'described' if job.description is not None else 'pending'
+        return job
+
+    def _jobs(self, image_paths):
+        """
+        Yield a RestyleJob for every image that still needs work. Images the
+        job store skips are recorded as skipped; near duplicates waiting for
+        one of them reuse its stored result or, without one, are restyled
+        themselves.
+        """
+        for image_path in image_paths:
+            job = self._new_job(image_path)
+            if job is not None:
+                yield job
+                continue
+            self.skipped.append(image_path)
+            followers = self._followers.pop(os.path.abspath(image_path), [])
+            if not followers:
+                continue
+            record = self.job_store.get(os.path.abspath(image_path), self.style)
+            if record.state == 'done' and record.output_path and os.path.exists(record.output_path):
+                self._reuse(record.output_path, image_path, followers)
+            else:
+                yield from followers
+
+    def _resumed_past(self, stage, job):
+        state = self.RESUME_AFTER.get(stage)
+        return state is not None and job_store.state_rank(job.progress) >= job_store.state_rank(state)
+
+    def _checkpoint(self, stage, job):
+        state = self.CHECKPOINTS.get(stage)
+        if self.job_store is None or state is None:
+            return
+        job.progress = state
+        if state == 'described':
+            self.job_store.advance(job.record_id, state, description=job.description)
+        elif state == 'restyled':
+            self.job_store.advance(job.record_id, state, restyle_key=job.restyle_key, restyled_url=job.restyled_url)
+        else:
+            self.job_store.advance(job.record_id, state, upscale_key=job.upscale_key, result_url=job.result_url)
+
+    def _record(self, stage, job, elapsed):
+        job.stage_times[stage] = elapsed
+        metrics.observe(f"engine_{stage}", elapsed)
+        with self._lock:
+            self.stage_durations[stage].append(elapsed)
+
+    def _plan_duplicates(self, image_paths):
+        """
+        Return the image paths that still need restyling. Near duplicates of
+        an earlier result from another image are finished straight away by
+        copying it; the others wait for the first image of their group (in
+        'reuse' mode). The job store still decides for each image whether it
+        needs doing at all.
+        """
+        self.dedup.refresh(image_paths)
+        by_path = {os.path.abspath(path): path for path in image_paths}
+        to_process = []
+        for representative, duplicates in self.dedup.groups(image_paths).items():
+            if duplicates:
+                names = ', '.join(os.path.basename(path) for path in duplicates)
+                logger.info("Near duplicates of %s: %s", by_path[representative], names)
+            if self.dedup_mode != 'reuse':
+                to_process.extend(by_path[path] for path in [representative] + duplicates)
+                continue
+
+            # The group's own earlier results are left to the job store, which knows if they are current
+            group = [representative] + duplicates
+            existing = self.dedup.find_result(representative, self.dedup_variant, exclude=group)
+            if existing is not None:
+                self._reuse(existing[1], existing[0], self._waiting_jobs(by_path[path] for path in group))
+            else:
+                self._followers[representative] = self._waiting_jobs(by_path[path] for path in duplicates)
+                to_process.append(by_path[representative])
+        return to_process
+
+    def _waiting_jobs(self, image_paths):
+        """_new_job() for each path, recording the ones the job store skips."""
+        jobs = []
+        for image_path in image_paths:
+            job = self._new_job(image_path)
+            if job is None:
+                self.skipped.append(image_path)
+            else:
+                jobs.append(job)
+        return jobs
+
+    def _reuse(self, output_path, source_path, jobs):
+        """Finish jobs by copying an existing output instead of calling DeepAI."""
+        for job in jobs:
+            job.reused_from = source_path
+            try:
+                if os.path.abspath(job.output_path) != os.path.abspath(output_path):
+                    shutil.copyfile(output_path, job.output_path)
+            except OSError as e:
+                job.error = f"dedup: {e}"
+            self._finish(job)
+
+    def description_path_for(self, job):
+        return os.path.splitext(job.output_path)[0] + '.txt'
+
+    def _finish(self, job):
+        if job.description and not job.error:
+            # --describe's result, kept next to the image it describes
+            try:
+                with open(self.description_path_for(job), 'w', encoding='utf-8') as file:
+                    file.write(job.description)
+            except OSError as e:
+                job.error = f"description: {e}"
+        if self.dedup is not None and job.reused_from is None:
+            followers = self._followers.pop(os.path.abspath(job.image_path), [])
+            if not job.error:
+                self.dedup.record_result(job.image_path, self.dedup_variant, job.output_path)
+            for follower in followers:
+                follower.error = f"near duplicate of {job.image_path}, which failed" if job.error else None
+            if job.error:
+                for follower in followers:
+                    self._finish(follower)
+            else:
+                self._reuse(job.output_path, job.image_path, followers)
+        elif self.dedup is not None and not job.error:
+            self.dedup.record_result(job.image_path, self.dedup_variant, job.output_path)
+
+        if self.job_store is not None and job.record_id is not None:
+            if job.error:
+                self.job_store.fail(job.record_id, job.error)
+            else:
+                self.job_store.advance(job.record_id, 'done', output_path=os.path.abspath(job.output_path))
+        with self._lock:
+            if job.error:
+                self.failed.append(job)
+            else:
+                self.completed.append(job)
+            done = len(self.completed) + len(self.failed)
+        if self.on_progress:
+            self.on_progress(job, done)
+
+    def _worker(self, stage, inbox, outbox):
+        handler = getattr(self, f"_stage_{stage}")
+        while True:
+            job = inbox.get()
+            if job is _STOP:
+                break
+            if not self._resumed_past(stage, job):
+                start = time.perf_counter()
+                try:
+                    handler(job)
+                    self._checkpoint(stage, job)
+                except Exception as e:
+                    job.error = f"{stage}: {e}"
+                self._record(stage, job, time.perf_counter() - start)
+
+            if job.error or outbox is None:
+                self._finish(job)
+            else:
+                outbox.put(job)
+
+    def run(self, image_paths):
+        """
+        Restyle every image path and return the statistics report. Raises
+        OutputCollision before starting if two images would share an output path.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._plan_outputs(image_paths)
+        self.reset_stats()
+        self.started_at = time.perf_counter()
+
+        stages = self._active_stages()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        pools = []
+        for index, stage in enumerate(stages):
+            outbox = queues[index + 1] if index + 1 < len(stages) else None
+            threads = [
+                threading.Thread(target=self._worker, args=(stage, queues[index], outbox), daemon=True)
+                for _ in range(max(1, self.workers.get(stage, 1)))
+            ]
+            for thread in threads:
+                thread.start()
+            pools.append(threads)
+
+        if self.dedup is not None:
+            image_paths = self._plan_duplicates(image_paths)
+
+        # Feeding blocks once the first queue is full, bounding memory use
+        for job in self._jobs(image_paths):
+            queues[0].put(job)
+
+        # Shut the stages down in order so every job drains through
+        for index, threads in enumerate(pools):
+            for _ in threads:
+                queues[index].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        self.finished_at = time.perf_counter()
+        return self.report()
+
+    def report(self):
+        """Throughput and per-stage latency percentiles for the last run."""
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+        stages = {}
+        for stage, durations in self.stage_durations.items():
+            if durations:
+                stages[stage] = {
+                    'count': len(durations),
+                    'p50': percentile(durations, 50),
+                    'p95': percentile(durations, 95),
+                }
+        return {
+            'completed': len(self.completed),
+            'failed': len(self.failed),
+            'skipped': len(self.skipped),
+            'deduplicated': sum(1 for job in self.completed if job.reused_from),
+            'elapsed': elapsed,
+            'images_per_second': len(self.completed) / elapsed if elapsed > 0 else 0.0,
+            'stages': stages,
+            'cache': self.cache.stats() if self.cache is not None else None,
+            'upload': self.preprocessor.stats() if self.preprocessor is not None else None,
+        }
+
+
+def format_report(report):
+    """Render an engine report as human-readable text."""
+    summary = f"Completed: {report['completed']}  Failed: {report['failed']}  "
+    if report.get('skipped'):
+        summary += f"Skipped: {report['skipped']} (already done)  "
+    if report.get('deduplicated'):
+        summary += f"Reused: {report['deduplicated']} (near duplicates)  "
+    lines = [summary + f"Elapsed: {report['elapsed']:.1f}s  Throughput: {report['images_per_second']:.2f} images/s"]
+    for stage, stats in report['stages'].items():
+        lines.append(f"  {stage:<10} n={stats['count']:<6} p50={stats['p50']:.3f}s  p95={stats['p95']:.3f}s")
+    if report.get('cache'):
+        cache = report['cache']
+        lines.append(f"  cache      hits={cache['hits']} misses={cache['misses']} hit ratio={cache['hit_ratio']:.1%}")
+    if report.get('upload'):
+        upload = report['upload']
+        lines.append(f"  upload     {upload['bytes_in'] / 1024 ** 2:.1f} MB -> {upload['bytes_out'] / 1024 ** 2:.1f} MB "
+                     f"({upload['bytes_saved'] / 1024 ** 2:.1f} MB saved, {upload['ratio']:.0%} of original)")
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+import itertools
+import threading
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtGui import QImage
+import restyle_engine
+import thumbnail_cache
+import workspace
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it notices it has been cancelled."""
+
+
+class JobSignals(QObject):
+    """Signals emitted by a job from its worker thread (delivered queued to the UI thread)."""
+    progress = Signal(int, int, str)  # job id, percent, step text
+    finished = Signal(int, object)    # job id, result
+    failed = Signal(int, str)         # job id, error message
+    cancelled = Signal(int)           # job id
+
+
+class Job(QRunnable):
+    """Base class for background work run on the JobQueue's thread pool."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label):
+        super().__init__()
+        self.setAutoDelete(False)  # The JobQueue keeps the reference
+        self.job_id = next(Job._ids)
+        self.label = label
+        self.signals = JobSignals()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def report(self, percent, step):
+        """Emit progress; also the point where a cancelled job stops."""
+        if self.is_cancelled():
+            raise JobCancelled()
+        self.signals.progress.emit(self.job_id, percent, step)
+
+    def run(self):
+        try:
+            result = self.execute()
+            if self.is_cancelled():
+                # Nobody will receive the result, so release what it holds (e.g. a JobWorkspace)
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+                raise JobCancelled()
+        except JobCancelled:
+            self.signals.cancelled.emit(self.job_id)
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, str(e))
+        else:
+            self.signals.finished.emit(self.job_id, result)
+
+    def execute(self):
+        raise NotImplementedError
+
+
+class RestyleImageJob(Job):
+    """
+    Restyle one image with DeepAI and enhance its clarity with waifu2x, or
+    run it through the style's pipeline (see restyle_pipelines.registry).
+
+    Each job works in its own JobWorkspace and returns it; the restyled image
+    is its 'output' artifact and the prompt used its 'prompt' artifact. The
+    caller owns the workspace and closes it when done with the result.
+    """
+
+    def __init__(self, image_path, prompt, api_key, upscale=True, cache=None, pipeline=None):
+        super().__init__(f"Restyle {image_path}")
+        self.image_path = image_path
+        self.prompt = prompt
+        self.api_key = api_key
+        self.upscale = upscale
+        self.cache = cache
+        self.pipeline = pipeline
+
+    def execute(self):
+        job_workspace = workspace.JobWorkspace(prefix=f"restyle-{self.job_id}-")
+        try:
+            job_workspace.write_text('prompt', self.prompt, 'prompt.txt')
+            self.restyle(job_workspace.artifact('output', 'enhanced_image.jpg'))
+        except BaseException:
+            job_workspace.close()
+            raise
+        return job_workspace
+
+    def restyle(self, output_path):
+        return restyle_engine.restyle_file(self.image_path, self.prompt, self.api_key, output_path,
+                                           upscale=self.upscale, cache=self.cache, pipeline=self.pipeline,
+                                           on_step=self.report)
+
+
+class DescriptionJob(Job):
+    """
+    Generate a description for one image on the shared warm browser pool,
+    or load it from the description cache if this content was described before.
+    """
+
+    def __init__(self, image_path, cache=None):
+        super().__init__(f"Describe {image_path}")
+        self.image_path = image_path
+        self.cache = cache
+
+    def execute(self):
+        if self.cache is None:
+            return self.describe(self.image_path, on_step=self.report)
+        return self.cache.get_or_describe(self.image_path, self.describe, on_step=self.report)
+
+    @staticmethod
+    def describe(image_path, on_step=None):
+        import description_pool  # Loads Playwright, so only on a cache miss
+        return description_pool.get_shared_pool().describe(image_path, on_step=on_step)
+
+
+class JobQueue(QObject):
+    """
+    Runs jobs on a QThreadPool and keeps track of their state for display.
+
+    Every job status change is re-emitted as job_changed(job, status) so a
+    view only has to listen to one signal.
+    """
+    job_added = Signal(object)
+    job_changed = Signal(object, str)
+    job_removed = Signal(object)
+
+    def __init__(self, max_workers=3, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.jobs = {}
+
+    def submit(self, job):
+        self.jobs[job.job_id] = job
+        # Bound slots (not lambdas) so Qt queues the calls onto this object's thread
+        job.signals.progress.connect(self._on_progress)
+        job.signals.finished.connect(self._on_finished)
+        job.signals.failed.connect(self._on_failed)
+        job.signals.cancelled.connect(self._on_cancelled)
+        self.job_added.emit(job)
+        self.job_changed.emit(job, "Queued")
+        self.pool.start(job)
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.cancel()
+        # A job still waiting for a thread never runs, so report it here
+        if self.pool.tryTake(job):
+            self._on_done(job_id, "Cancelled")
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def pending_count(self):
+        return len(self.jobs)
+
+    def _on_progress(self, job_id, percent, step):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            self.job_changed.emit(job, f"{percent}% {step}")
+
+    def _on_finished(self, job_id, result):
+        self._on_done(job_id, "Done")
+
+    def _on_failed(self, job_id, error):
+        self._on_done(job_id, f"Failed: {error}")
+
+    def _on_cancelled(self, job_id):
+        self._on_done(job_id, "Cancelled")
+
+    def _on_done(self, job_id, status):
+        job = self.jobs.pop(job_id, None)
+        if job is not None:
+            self.job_changed.emit(job, status)
+            self.job_removed.emit(job)
+
+
+class ThumbnailSignals(QObject):
+    ready = Signal(str, object)  # image path, QImage
+    failed = Signal(str, str)    # image path, error message
+
+
+class ThumbnailJob(QRunnable):
+    """Load (or generate and cache) one thumbnail and decode it to a QImage off the UI thread."""
+
+    def __init__(self, image_path, cache, signals):
+        super().__init__()
+        self.image_path = image_path
+        self.cache = cache
+        self.signals = signals
+
+    def run(self):
+        try:
+            image = QImage.fromData(self.cache.get_or_create(self.image_path))
+            if image.isNull():
+                raise ValueError("thumbnail could not be decoded")
+        except Exception as e:
+            self.signals.failed.emit(self.image_path, str(e))
+        else:
+            self.signals.ready.emit(self.image_path, image)
+
+
+class ThumbnailLoader(QObject):
+    """
+    Loads thumbnails from a ThumbnailCache on a thread pool of its own, so
+    previews never wait behind restyle or description jobs.
+
+    request() returns a QImage straight away when the thumbnail is already
+    in memory; otherwise it returns None and ready(path, image) or
+    failed(path, error) follows. Concurrent requests for the same path share
+    one job.
+    """
+    ready = Signal(str, object)
+    failed = Signal(str, str)
+
+    def __init__(self, cache=None, max_workers=2, parent=None):
+        super().__init__(parent)
+        self.cache = cache or thumbnail_cache.get_shared_cache()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.signals = ThumbnailSignals()
+        self.signals.ready.connect(self._on_ready)
+        self.signals.failed.connect(self._on_failed)
+        self._pending = set()
+
+    def request(self, image_path):
+        data = self.cache.get_memory(image_path)
+        if data is not None:
+            image = QImage.fromData(data)
+            if not image.isNull():
+                return image
+        if image_path not in self._pending:
+            self._pending.add(image_path)
+            self.pool.start(ThumbnailJob(image_path, self.cache, self.signals))
+        return None
+
+    def cancel_pending(self):
+        """Drop requests that have not started yet, e.g. rows scrolled out of view."""
+        self.pool.clear()
+        self._pending.clear()
+
+    def _on_ready(self, image_path, image):
+        self._pending.discard(image_path)
+        self.ready.emit(image_path, image)
+
+    def _on_failed(self, image_path, error):
+        self._pending.discard(image_path)
+        self.failed.emit(image_path, error)
@@ -0,0 +1,95 @@
+"""
+In-process restyle pipelines.
+
+Every module in this package that defines STYLE_NAME is a pipeline plugin
+for the art style of that name. A pipeline module provides:
+
+    STYLE_NAME                 art style name from art_styles.json
+    run(image_path, prompt, api_key, output_path, cache=None, preprocessor=None)
+                               full restyle of one image, uploading through the
+                               preprocess.UploadPreprocessor if given; returns
+                               output_path
+    LOCAL_STEPS                (optional) [(filter name, options)] from
+                               local_filters that run() applies after a
+                               non-upscaled DeepAI restyle; lets the batch engine
+                               split the work into its network and CPU stages
+
+Modules are imported once, on first use, and then called as functions.
+CPU-heavy work should go through run_cpu() so it uses the shared process
+pool, and local filter steps through run_steps(), which also splits a
+single image across idle workers in shared memory (see parallel) and
+switches to tiled, out-of-core processing (see tiled) for images too large
+to filter whole. registry maps every art style (plugin or not) to a pipeline.
+"""
+import os
+import pkgutil
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+_pipelines = None
+_process_pool = None
+_lock = threading.Lock()
+
+
+def load_pipelines():
+    """Import every pipeline module once and return {style name: module}."""
+    global _pipelines
+    with _lock:
+        if _pipelines is None:
+            pipelines = {}
+            for module_info in pkgutil.iter_modules(__path__):
+                module = importlib.import_module(f"{__name__}.{module_info.name}")
+                style_name = getattr(module, 'STYLE_NAME', None)
+                if style_name:
+                    pipelines[style_name] = module
+            _pipelines = pipelines
+        return _pipelines
+
+
+def get_pipeline(style_name):
+    """Return the pipeline module for an art style, or None for plain DeepAI styles."""
+    return load_pipelines().get(style_name)
+
+
+def get_process_pool():
+    """Shared process pool for CPU-heavy local steps, started on first use."""
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _process_pool
+
+
+def run_cpu(function, *args):
+    """Run a picklable module-level function in the shared process pool and wait for it."""
+    with metrics.span('local_filter', function=function.__name__):
+        return get_process_pool().submit(function, *args).result()
+
+
+def run_steps(input_path, output_path, steps):
+    """
+    Run local_filters steps on an image and wait for them: in one pool task,
+    split into bands across idle workers (parallel), or tile by tile out of
+    core for very large images (tiled). Returns output_path.
+    """
+    from restyle_pipelines import local_filters, parallel, tiled
+    with parallel.active_call():
+        if tiled.should_tile(input_path):
+            with metrics.span('local_filter', function='apply_steps_tiled'):
+                return tiled.apply_steps_tiled(input_path, output_path, steps)
+        workers = parallel.choose_workers(input_path)
+        if workers > 1:
+            with metrics.span('local_filter', function='apply_steps_parallel'):
+                return parallel.apply_steps_parallel(input_path, output_path, steps, workers)
+        return run_cpu(local_filters.apply_steps, input_path, output_path, steps)
+
+
+def shutdown():
+    """Stop the shared process pool (it is restarted lazily if needed again)."""
+    global _process_pool
+    with _lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
@@ -1,36 +1,61 @@
 import sys
 import os
-import requests
-from PIL import Image, ImageFilter
+import shutil
+import logging
+import pathlib
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Make the top-level modules importable when run as a script
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import result_cache
+import deepai_client
+import restyle_engine
+import restyle_pipelines
+import workspace
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STYLE_NAME = "Hand Drawn"
+LOCAL_STEPS = [('hand_drawn', {})]
 
 # Function to call the DeepAI Image Editor API
-def call_deepai_image_editor_api(image_path, text_path, api_key):
+def call_deepai_image_editor_api(image_path, text_path, api_key, cache=None):
     """
     Sends the image and description text to the DeepAI image-editor API.
+
+    With a cache, the result is stored in it and a file:// URL of the cache
+    entry is returned, so a repeated image and prompt never touch the network.
     """
-    url = "https://api.deepai.org/api/image-editor"
+    url = f"{deepai_client.DEEPAI_BASE_URL}/image-editor"
     
     try:
         with open(image_path, 'rb') as img_file, open(text_path, 'rb') as text_file:
-            response = requests.post(
-                url,
-                files={
-                    'image': img_file,
-                    'text': text_file,
-                },
-                headers={'api-key': api_key}
-            )
-        result = response.json()
-        
-        # Check if the request was successful and return the output URL
-        if 'output_url' in result:
-            print(f"DeepAI processed image URL: {result['output_url']}")
-            return result['output_url']
-        else:
-            print(f"DeepAI API error: {result}")
-            return None
+            image_data = img_file.read()
+            text_data = text_file.read()
+
+        if cache is not None:
+            key = result_cache.make_key(image_data, text_data.decode('utf-8'), url)
+            cached_path = cache.lookup(key)
+            if cached_path:
+                logger.info("DeepAI result served from cache (hit ratio %.0f%%)", cache.hit_ratio() * 100)
+                return pathlib.Path(cached_path).resolve().as_uri()
+
+        client = deepai_client.get_client(api_key)
+        output_url = client.restyle(image_data, text_data.decode('utf-8'))
+        logger.debug("DeepAI processed image URL: %s", output_url)
+
+        if cache is not None:
+            with cache.writer(key) as cache_file:
+                client.download(output_url, cache_file)
+            return pathlib.Path(cache.path_for(key)).resolve().as_uri()
+        return output_url
     except Exception as e:
-        print(f"Error calling DeepAI API: {e}")
+        logger.error("Error calling DeepAI API: %s", e)
         return None
 
 # Function to download the image from a URL
@@ -39,96 +64,310 @@ def download_image(image_url, save_path):
     Downloads the image from the given URL and saves it to the specified path.
     """
     try:
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            with open(save_path, 'wb') as file:
-                file.write(response.content)
-            print(f"Image downloaded and saved to: {save_path}")
+        # Cached results are already on disk
+        if image_url.startswith('file://'):
+            shutil.copyfile(url2pathname(urlparse(image_url).path), save_path)
+            logger.debug("Image copied from cache to: %s", save_path)
             return save_path
-        else:
-            print(f"Failed to download image. Status code: {response.status_code}")
-            return None
+
+        # Stream the response to disk instead of holding it in memory
+        with open(save_path, 'wb') as file:
+            deepai_client.get_client(None).download(image_url, file)
+        logger.debug("Image downloaded and saved to: %s", save_path)
+        return save_path
     except Exception as e:
-        print(f"Error downloading image: {e}")
+        logger.error("Error downloading image: %s", e)
         return None
 
-# Function to apply hand-drawn effect using Pillow
-from PIL import Image, ImageFilter, ImageOps, ImageEnhance
-import numpy as np
+# Parameters shared by the Pillow and NumPy versions of the effect
+NOISE_SIGMA = 15
+NOISE_ALPHA = 0.2
+DISTORTION = 0.1
+BLEND_ALPHA = 0.5
+
+# Rows of output processed at a time by the NumPy engine
+DEFAULT_BAND_ROWS = 128
+
+
+def hand_drawn_pillow(original_img, noise=None):
+    """
+    Reference Pillow implementation of the hand-drawn effect.
+
+    Each step allocates a full-size intermediate image. noise is an optional
+    'L' image to use instead of freshly generated noise (for comparisons).
+    """
+    # Convert the image to grayscale for the hand-drawn effect
+    gray_img = ImageOps.grayscale(original_img)
+
+    # Apply a contour filter to simulate hand-drawn outlines
+    hand_drawn_img = gray_img.filter(ImageFilter.CONTOUR)
+
+    # Add noise to the image to simulate imperfections
+    if noise is None:
+        noise = Image.effect_noise(hand_drawn_img.size, NOISE_SIGMA)
+    noise = ImageOps.grayscale(noise)
+    noise_img = Image.blend(hand_drawn_img, noise, alpha=NOISE_ALPHA)
+
+    # Apply a slight distortion to simulate hand-drawn variability
+    distorted_img = noise_img.transform(
+        noise_img.size,
+        Image.AFFINE,
+        (1, DISTORTION, 0, DISTORTION, 1, 0),
+        resample=Image.BILINEAR
+    )
+
+    # Apply a detail enhancement filter to add more texture
+    textured_img = distorted_img.filter(ImageFilter.DETAIL)
+
+    # Convert the hand-drawn image back to RGB
+    textured_img = textured_img.convert("RGB")
+
+    # Blend the hand-drawn effect with the original image
+    return Image.blend(original_img, textured_img, alpha=BLEND_ALPHA)
+
+
+def _contour_noise_band(rgb, plane, r0, r1, noise, rng, gray, scratch):
+    """
+    Grayscale, CONTOUR and noise blend for rows [r0, r1), written into plane.
+
+    gray and scratch are preallocated (rows + 2, width) uint32 buffers.
+    """
+    height, width = rgb.shape[:2]
+    g0, g1 = max(0, r0 - 1), min(height, r1 + 1)
+    g, tmp = gray[:g1 - g0], scratch[:g1 - g0]
+
+    # Pillow's "L" conversion: ITU-R 601-2 luma in 16.16 fixed point
+    np.multiply(rgb[g0:g1, :, 0], np.uint32(19595), out=g)
+    np.multiply(rgb[g0:g1, :, 1], np.uint32(38470), out=tmp)
+    g += tmp
+    np.multiply(rgb[g0:g1, :, 2], np.uint32(7471), out=tmp)
+    g += tmp
+    g += 0x8000
+    g >>= 16
+    g = g.astype(np.int16)
+
+    # CONTOUR kernel: 9 * centre - 3x3 box sum + 255. Edge pixels keep their gray value.
+    top = r0 - g0
+    band = g[top:top + (r1 - r0)].copy()
+    if width > 2:
+        inner = slice(max(r0, 1) - g0, min(r1, height - 1) - g0)
+        rows = slice(inner.start - 1, inner.stop + 1)
+        row_sums = g[rows, :-2] + g[rows, 1:-1] + g[rows, 2:]
+        box = row_sums[:-2] + row_sums[1:-1] + row_sums[2:]
+        contour = 9 * g[inner, 1:-1] - box + 255
+        np.clip(contour, 0, 255, out=contour)
+        band[inner.start - top:inner.stop - top, 1:-1] = contour
+
+    # Gaussian noise around 128, truncated like Image.effect_noise
+    if noise is not None:
+        noise_band = noise[r0:r1].astype(np.int16)
+    else:
+        gaussian = rng.standard_normal(band.shape, dtype=np.float32)
+        gaussian *= NOISE_SIGMA
+        gaussian += 128
+        np.clip(gaussian, 0, 255, out=gaussian)
+        noise_band = gaussian.astype(np.int16)
+
+    # Image.blend with alpha 0.2: c + (n - c) / 5 == (4c + n) / 5
+    band *= 4
+    band += noise_band
+    band //= 5
+    plane[r0:r1, :width] = band
 
-from PIL import Image, ImageFilter, ImageOps, ImageEnhance
 
-def apply_hand_drawn_effect(image_path):
+def _distort_rows(plane, a0, a1, width, height):
+    """
+    Bilinear AFFINE (1, d, 0, d, 1, 0) sample of plane for output rows [a0, a1).
+
+    For this transform the source x offset and its fraction depend only on
+    the row, and the source y offset and its fraction only on the column, so
+    all coordinates come from two small vectors. plane has one replicated
+    padding row and column so the +1 neighbours never need clamping.
+    """
+    stride = width + 1
+    rows = np.arange(a0, a1)
+    cols = np.arange(width)
+
+    # Pillow maps output pixel centres to input coordinates and samples at -0.5
+    xs = DISTORTION * (rows + 0.5)
+    ys = DISTORTION * (cols + 0.5)
+    x_shift, y_shift = np.floor(xs), np.floor(ys)
+    dx = (xs - x_shift).astype(np.float32)[:, None]
+    dy = (ys - y_shift).astype(np.float32)[None, :]
+
+    index = (rows * stride + x_shift.astype(np.intp))[:, None] + (cols + y_shift.astype(np.intp) * stride)[None, :]
+    # Only out-of-range samples (zeroed below) can exceed the last valid top-left neighbour
+    np.minimum(index, (height - 1) * stride + width - 1, out=index)
+
+    flat = plane.reshape(-1)
+    values = flat.take(index).astype(np.float32)
+    weight = flat[1:].take(index) - values
+    weight *= dx
+    values += weight
+    bottom = flat[stride:].take(index).astype(np.float32)
+    weight = flat[stride + 1:].take(index) - bottom
+    weight *= dx
+    bottom += weight
+    bottom -= values
+    bottom *= dy
+    values += bottom
+    distorted = values.astype(np.int16)
+
+    # Samples whose source lies outside the image are filled with black
+    with np.errstate(divide='ignore'):
+        limit = np.minimum(width - 0.5 - DISTORTION * (rows + 0.5), (height - rows - 0.5) / DISTORTION - 0.5)
+    valid_columns = np.clip(np.ceil(limit), 0, width).astype(np.intp)
+    for row, count in enumerate(valid_columns):
+        if count < width:
+            distorted[row, count:] = 0
+    return distorted
+
+
+def _detail_blend_band(plane, rgb, out, r0, r1):
+    """AFFINE distortion, DETAIL filter and the final blend for rows [r0, r1)."""
+    height, width = rgb.shape[:2]
+    d0, d1 = max(0, r0 - 1), min(height, r1 + 1)
+    distorted = _distort_rows(plane, d0, d1, width, height)
+
+    # DETAIL kernel: (10 * centre - 4 neighbours) / 6. Edge pixels are copied through.
+    top = r0 - d0
+    textured = distorted[top:top + (r1 - r0)].copy()
+    if width > 2:
+        inner = slice(max(r0, 1) - d0, min(r1, height - 1) - d0)
+        detail = 10 * distorted[inner, 1:-1]
+        detail -= distorted[inner.start - 1:inner.stop - 1, 1:-1]
+        detail -= distorted[inner.start + 1:inner.stop + 1, 1:-1]
+        detail -= distorted[inner, :-2]
+        detail -= distorted[inner, 2:]
+        detail //= 6
+        np.clip(detail, 0, 255, out=detail)
+        textured[inner.start - top:inner.stop - top, 1:-1] = detail
+
+    # Image.blend with alpha 0.5: o + (t - o) / 2 == (o + t) / 2 in every channel
+    blended = rgb[r0:r1].astype(np.uint16)
+    blended += textured.astype(np.uint16)[:, :, None]
+    blended >>= 1
+    out[r0:r1] = blended
+
+
+def hand_drawn_numpy(rgb, noise=None, band_rows=DEFAULT_BAND_ROWS, seed=None, out=None):
+    """
+    Vectorized NumPy implementation of the hand-drawn effect.
+
+    rgb is an (H, W, 3) uint8 array. The eight Pillow passes are fused into
+    two band-wise integer passes: grayscale + CONTOUR + noise into one uint8
+    plane, then AFFINE + DETAIL + blend straight into the output. Only that
+    one extra full-size single-channel plane is allocated; everything else is
+    per-band scratch. out may be the input array itself to blend in place.
+    """
+    height, width = rgb.shape[:2]
+    rng = np.random.default_rng(seed)
+
+    # One replicated padding row and column for the bilinear neighbours
+    plane = np.empty((height + 1, width + 1), dtype=np.uint8)
+    gray = np.empty((band_rows + 2, width), dtype=np.uint32)
+    scratch = np.empty_like(gray)
+    for r0 in range(0, height, band_rows):
+        _contour_noise_band(rgb, plane, r0, min(height, r0 + band_rows), noise, rng, gray, scratch)
+    plane[:height, width] = plane[:height, width - 1]
+    plane[height] = plane[height - 1]
+
+    if out is None:
+        out = np.empty_like(rgb)
+    # The distortion reads plane rows up to DISTORTION * width away, so the
+    # texture pass can only start once the whole plane exists.
+    for r0 in range(0, height, band_rows):
+        _detail_blend_band(plane, rgb, out, r0, min(height, r0 + band_rows))
+    return out
+
+
+def apply_hand_drawn_effect(image_path, engine='numpy', output_image_path=None):
     """
     Applies a hand-drawn effect to the image while preserving original colors.
+
+    engine is 'numpy' (fused, band-wise) or 'pillow' (the original chain of passes).
+    Without output_image_path the result is saved next to the input as *_hand_drawn.
+    Images too large to hold in memory are processed out of core by tiled.
     """
     try:
-        # Open the original image using Pillow
-        original_img = Image.open(image_path)
-        
-        # Convert the image to grayscale for the hand-drawn effect
-        gray_img = ImageOps.grayscale(original_img)
-        
-        # Apply a contour filter to simulate hand-drawn outlines
-        hand_drawn_img = gray_img.filter(ImageFilter.CONTOUR)
-        
-        # Add noise to the image to simulate imperfections
-        noise = Image.effect_noise(hand_drawn_img.size, 15)
-        noise = ImageOps.grayscale(noise)
-        noise_img = Image.blend(hand_drawn_img, noise, alpha=0.2)
-        
-        # Apply a slight distortion to simulate hand-drawn variability
-        distorted_img = noise_img.transform(
-            noise_img.size, 
-            Image.AFFINE, 
-            (1, 0.1, 0, 0.1, 1, 0), 
-            resample=Image.BILINEAR
-        )
-        
-        # Apply a detail enhancement filter to add more texture
-        textured_img = distorted_img.filter(ImageFilter.DETAIL)
-        
-        # Convert the hand-drawn image back to RGB
-        textured_img = textured_img.convert("RGB")
-        
-        # Blend the hand-drawn effect with the original image
-        blended_img = Image.blend(original_img, textured_img, alpha=0.5)
-        
         # Create the output file path
-        base, ext = os.path.splitext(image_path)
-        output_image_path = f"{base}_hand_drawn{ext}"
-        
+        if output_image_path is None:
+            base, ext = os.path.splitext(image_path)
+            output_image_path = f"{base}_hand_drawn{ext}"
+
+        from restyle_pipelines import tiled
+        if tiled.should_tile(image_path):
+            tiled.apply_steps_tiled(image_path, output_image_path, LOCAL_STEPS)
+            logger.debug("Hand-drawn effect applied (tiled). Image saved to: %s", output_image_path)
+            return output_image_path
+
+        # Open the original image using Pillow
+        with metrics.span('read'):
+            original_img = Image.open(image_path).convert("RGB")
+
+        with metrics.span('filter', filter='hand_drawn', engine=engine):
+            if engine == 'pillow':
+                blended_img = hand_drawn_pillow(original_img)
+            else:
+                rgb = np.asarray(original_img).copy()
+                original_img.close()
+                blended_img = Image.fromarray(hand_drawn_numpy(rgb, out=rgb))
+
         # Save the transformed image
-        blended_img.save(output_image_path)
-        print(f"Hand-drawn effect applied. Image saved to: {output_image_path}")
+        with metrics.span('save') as span:
+            blended_img.save(output_image_path)
+            span.add_bytes(os.path.getsize(output_image_path))
+        logger.debug("Hand-drawn effect applied. Image saved to: %s", output_image_path)
         return output_image_path
     except Exception as e:
-        print(f"Error applying hand-drawn effect: {e}")
+        logger.error("Error applying hand-drawn effect: %s", e)
         return None
 
 
+def postprocess(input_path, output_path):
+    """Pipeline hook: the local CPU step applied to the downloaded DeepAI result."""
+    if apply_hand_drawn_effect(input_path, output_image_path=output_path) is None:
+        raise RuntimeError(f"Hand-drawn effect failed for {input_path}")
+    return output_path
+
+
+def run(image_path, prompt, api_key, output_path, cache=None, preprocessor=None):
+    """
+    Pipeline entry point: restyle with DeepAI (uploading through preprocessor,
+    if given), then apply the hand-drawn effect in the shared process pool.
+    Returns output_path.
+    """
+    with restyle_engine.open_upload(image_path, preprocessor) as image_data:
+        restyle_engine.restyle_to_file(image_data, prompt, output_path, api_key, cache)
+    return restyle_pipelines.run_steps(output_path, output_path, LOCAL_STEPS)
+
 
 # Main function to execute the complete process
-def main(image_path, text_path, api_key):
+def main(image_path, text_path, api_key, cache=None):
     # Step 1: Call the DeepAI API with the image and description file
-    processed_image_url = call_deepai_image_editor_api(image_path, text_path, api_key)
+    processed_image_url = call_deepai_image_editor_api(image_path, text_path, api_key, cache)
 
     if processed_image_url:
-        # Step 2: Download the processed image from the DeepAI API
-        downloaded_image_path = os.path.join(os.getcwd(), 'processed_image.jpg')
-        downloaded_image_path = download_image(processed_image_url, downloaded_image_path)
+        # Step 2: Download the processed image into a private workspace
+        with workspace.JobWorkspace(prefix='hand-drawn-') as job_workspace:
+            downloaded_image_path = download_image(processed_image_url, job_workspace.path('processed_image.jpg'))
 
-        if downloaded_image_path:
-            # Step 3: Apply the hand-drawn effect using Pillow
-            final_image_path = apply_hand_drawn_effect(downloaded_image_path)
-            if final_image_path:
-                print(f"Final image with hand-drawn effect saved at: {final_image_path}")
+            if downloaded_image_path:
+                # Step 3: Apply the hand-drawn effect, saving the result next to the source image
+                base, ext = os.path.splitext(image_path)
+                final_image_path = apply_hand_drawn_effect(downloaded_image_path,
+                                                           output_image_path=f"{base}_hand_drawn{ext}")
+                if final_image_path:
+                    logger.info("Final image with hand-drawn effect saved at: %s", final_image_path)
+                return final_image_path
+    return None
 
 if __name__ == "__main__":
+    metrics.configure_logging('INFO')
     if len(sys.argv) != 3:
         print("Usage: python hand_drawn.py <image_path> <text_path>")
     else:
         image_path = sys.argv[1]
         text_path = sys.argv[2]
-        api_key = 'your_api_key_here'  # Replace with your DeepAI API key
-        main(image_path, text_path, api_key)
+        api_key = restyle_engine.load_deepai_key()
+        main(image_path, text_path, api_key, result_cache.ResultCache())
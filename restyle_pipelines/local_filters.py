@@ -0,0 +1,155 @@
+"""
+Offline restyle filters built on Pillow and NumPy.
+
+Every filter takes an (H, W, 3) uint8 RGB array plus keyword options and
+returns an array of the same shape. apply_steps() is the picklable entry
+point used with restyle_pipelines.run_cpu(); images too large to filter in
+memory are handed to tiled.apply_steps_tiled() instead.
+"""
+import os
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+import metrics
+
+
+def _luma(rgb):
+    """ITU-R 601-2 luma as float32."""
+    return rgb[..., 0] * np.float32(0.299) + rgb[..., 1] * np.float32(0.587) + rgb[..., 2] * np.float32(0.114)
+
+
+def _box_mean(values, radius):
+    """Mean over a (2r+1)^2 window using an integral image (edges are replicated)."""
+    size = 2 * radius + 1
+    padded = np.pad(values, radius, mode='edge').astype(np.float64)
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(padded, axis=0), axis=1, out=integral[1:, 1:])
+    total = (integral[size:, size:] - integral[:-size, size:]
+             - integral[size:, :-size] + integral[:-size, :-size])
+    return (total / (size * size)).astype(np.float32)
+
+
+def sketch(rgb, blur_radius=8, strength=1.0):
+    """Pencil sketch: colour-dodge the grayscale image with its blurred negative."""
+    gray = ImageOps.grayscale(Image.fromarray(rgb))
+    blurred = np.asarray(ImageOps.invert(gray).filter(ImageFilter.GaussianBlur(blur_radius)), dtype=np.float32)
+    base = np.asarray(gray, dtype=np.float32)
+    dodged = np.minimum(255.0, base * 255.0 / np.maximum(1.0, 255.0 - blurred))
+    if strength != 1.0:
+        dodged = 255.0 - (255.0 - dodged) * strength
+    out = np.clip(dodged, 0, 255).astype(np.uint8)
+    return np.repeat(out[:, :, None], 3, axis=2)
+
+
+def posterize(rgb, bits=3, smooth=True):
+    """Reduce every channel to 2**bits levels, optionally smoothing first to avoid speckle."""
+    image = Image.fromarray(rgb)
+    if smooth:
+        image = image.filter(ImageFilter.SMOOTH_MORE)
+    return np.asarray(ImageOps.posterize(image, bits))
+
+
+def oil_paint(rgb, radius=4):
+    """
+    Kuwahara filter: each pixel takes the mean colour of whichever of its four
+    overlapping quadrants has the lowest luminance variance, which flattens
+    texture into brush-like patches while keeping edges sharp.
+    """
+    height, width = rgb.shape[:2]
+    # Each quadrant is a (2q+1)^2 box centred q pixels diagonally away from the pixel
+    q = max(1, radius // 2)
+    luma = _luma(rgb)
+    mean = _box_mean(luma, q)
+    variance = np.pad(_box_mean(luma * luma, q) - mean * mean, q, mode='edge')
+    channel_means = [np.pad(_box_mean(rgb[..., channel].astype(np.float32), q), q, mode='edge')
+                     for channel in range(3)]
+
+    best_variance = np.full((height, width), np.inf, dtype=np.float32)
+    out = np.zeros((height, width, 3), dtype=np.float32)
+    for dy in (-q, q):
+        for dx in (-q, q):
+            window = (slice(q + dy, q + dy + height), slice(q + dx, q + dx + width))
+            quadrant_variance = variance[window]
+            better = quadrant_variance < best_variance
+            best_variance[better] = quadrant_variance[better]
+            for channel in range(3):
+                out[..., channel][better] = channel_means[channel][window][better]
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def halftone(rgb, cell=8, monochrome=False):
+    """
+    Dot-screen halftone: each cell x cell block becomes an ink dot whose area
+    matches the block's darkness, per channel or on luminance.
+    """
+    height, width = rgb.shape[:2]
+    channels = _luma(rgb)[:, :, None] if monochrome else rgb.astype(np.float32)
+
+    # Average every cell (pad to whole cells by replicating the edges)
+    rows, cols = -(-height // cell), -(-width // cell)
+    padded = np.pad(channels, ((0, rows * cell - height), (0, cols * cell - width), (0, 0)), mode='edge')
+    cell_means = padded.reshape(rows, cell, cols, cell, -1).mean(axis=(1, 3))
+
+    # Dot radius so that the dot area equals the ink coverage of the cell
+    coverage = 1.0 - cell_means / 255.0
+    radius = np.sqrt(coverage * cell * cell / np.pi)
+
+    # Distance of every pixel to its cell centre
+    offsets = np.arange(cell, dtype=np.float32) + 0.5 - cell / 2
+    distance = np.sqrt(offsets[:, None] ** 2 + offsets[None, :] ** 2)
+    ink = distance[None, :, None, :, None] < radius[:, None, :, None, :]
+    out = np.where(ink, 0, 255).astype(np.uint8).reshape(rows * cell, cols * cell, -1)[:height, :width]
+    if monochrome:
+        out = np.repeat(out, 3, axis=2)
+    return np.ascontiguousarray(out)
+
+
+def upscale(rgb, scale=2, sharpen=True):
+    """
+    Local stand-in for waifu2x: Lanczos resize by scale, then a light unsharp
+    mask to restore the edge contrast the resampling softens.
+    """
+    height, width = rgb.shape[:2]
+    image = Image.fromarray(rgb).resize((round(width * scale), round(height * scale)), Image.LANCZOS)
+    if sharpen:
+        image = image.filter(ImageFilter.UnsharpMask(radius=2, percent=60, threshold=2))
+    return np.asarray(image)
+
+
+def hand_drawn(rgb, seed=None):
+    """The Hand Drawn pipeline's local effect (fused NumPy engine)."""
+    from restyle_pipelines.hand_drawn import hand_drawn_numpy
+    return hand_drawn_numpy(rgb, seed=seed, out=rgb.copy())
+
+
+FILTERS = {
+    'sketch': sketch,
+    'posterize': posterize,
+    'oil_paint': oil_paint,
+    'halftone': halftone,
+    'upscale': upscale,
+    'hand_drawn': hand_drawn,
+}
+
+
+def apply_steps(input_path, output_path, steps):
+    """
+    Load an image once, run it through a list of (filter name, options)
+    steps and save the result. Returns output_path.
+    """
+    unknown = [name for name, _ in steps if name not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown local filter(s): {', '.join(unknown)}")
+    from restyle_pipelines import tiled
+    if tiled.should_tile(input_path):
+        return tiled.apply_steps_tiled(input_path, output_path, steps)
+
+    with metrics.span('read') as span, Image.open(input_path) as image:
+        rgb = np.asarray(image.convert("RGB"))
+        span.add_bytes(rgb.nbytes)
+    for name, options in steps:
+        with metrics.span('filter', filter=name):
+            rgb = FILTERS[name](rgb, **(options or {}))
+    with metrics.span('save') as span:
+        Image.fromarray(rgb).save(output_path)
+        span.add_bytes(os.path.getsize(output_path))
+    return output_path
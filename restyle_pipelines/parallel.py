@@ -0,0 +1,181 @@
+"""
+Multi-core local filtering with pixel buffers in shared memory.
+
+restyle_pipelines.run_steps() uses the shared process pool in two ways:
+
+- Many images: one apply_steps() task per image, so every worker filters
+  its own image and only paths cross process boundaries.
+- One image while workers are idle: apply_steps_parallel() decodes it into
+  a multiprocessing.shared_memory block, splits every pass into row bands
+  (with a halo for neighbourhood filters, see tiled.HALOS), and lets each
+  worker filter its band in place. Workers attach to the blocks by name, so
+  pixels are never pickled or copied between processes.
+
+choose_workers() decides between the two from how many run_steps() calls
+are in flight: an image gets an equal share of the pool's workers, so a
+lone image uses all of them and a busy batch runs one image per worker.
+The band passes are tiled's, with shared memory instead of memory-mapped
+files as their buffers.
+"""
+import os
+import sys
+import threading
+import contextlib
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from PIL import Image
+from restyle_pipelines import tiled
+
+PARALLEL_MIN_PIXELS = 2 * 1024 ** 2  # Smaller images filter faster in one task than split up
+MIN_BAND_ROWS = 64
+ATTACHED_SEGMENTS = 4                  # Shared memory blocks a worker keeps mapped between tasks
+
+_active = 0
+_active_lock = threading.Lock()
+_segments = OrderedDict()  # Name -> SharedMemory attached (or created) by this process
+_owned = set()             # Names of the blocks this process created
+_segments_lock = threading.Lock()
+
+
+def attach(name, shape):
+    """
+    The uint8 array of a shared memory block, mapping it on first use.
+
+    Workers keep the last few blocks mapped, because the bands of one pass
+    all come from the same two or three blocks.
+    """
+    with _segments_lock:
+        segment = _segments.get(name)
+        if segment is None:
+            segment = _segments[name] = _attach_untracked(name)
+            # Blocks left by earlier images; their tasks have finished, so no views remain
+            stale = [key for key in _segments if key not in _owned and key != name]
+            for key in stale[:max(0, len(stale) + 1 - ATTACHED_SEGMENTS)]:
+                _close(_segments.pop(key))
+        _segments.move_to_end(name)
+    return np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+
+
+def _attach_untracked(name):
+    """
+    Open a block this process does not own without registering it with the
+    resource tracker: the creating process unlinks it, and a late register
+    from a worker would make the tracker report it as leaked and try to
+    unlink it again at exit.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Earlier versions always register. Unregistering afterwards is no answer: workers share the
+    # parent's tracker, so that would drop the parent's own registration. Skip the call instead
+    register = resource_tracker.register
+
+    def register_unless_shared_memory(resource, resource_type):
+        if resource_type != 'shared_memory':
+            register(resource, resource_type)
+
+    resource_tracker.register = register_unless_shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _close(segment):
+    try:
+        segment.close()
+    except BufferError:
+        pass  # An array still views it; the mapping goes away with that array
+
+
+def _forget_segments():
+    # Pool workers forked while an image is in flight must not keep the parent's blocks mapped
+    global _active
+    for segment in _segments.values():
+        _close(segment)
+    _segments.clear()
+    _owned.clear()
+    _active = 0
+
+
+os.register_at_fork(after_in_child=_forget_segments)
+
+
+class SharedBuffers:
+    """Pass buffers for tiled.run_passes() in shared memory, unlinked by close()."""
+
+    def __init__(self):
+        self.names = []
+
+    def allocate(self, name, shape):
+        # Under the lock, so it is registered while no _attach_untracked() has patched the tracker
+        with _segments_lock:
+            segment = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+            _segments[segment.name] = segment
+            _owned.add(segment.name)
+        self.names.append(segment.name)
+        return ('shm', segment.name, tuple(shape))
+
+    def release(self, source):
+        if source[0] != 'shm' or source[1] not in self.names:
+            return
+        self.names.remove(source[1])
+        with _segments_lock:
+            segment = _segments.pop(source[1])
+            _owned.discard(source[1])
+        _close(segment)
+        segment.unlink()
+
+    def close(self):
+        for name in list(self.names):
+            self.release(('shm', name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def choose_workers(input_path):
+    """
+    Workers to split an image across: its share of the pool given the
+    run_steps() calls in flight, or 1 for images too small to be worth splitting.
+    """
+    try:
+        width, height = tiled.image_size(input_path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return 1
+    if width * height < PARALLEL_MIN_PIXELS:
+        return 1
+    with _active_lock:
+        return max(1, (os.cpu_count() or 1) // max(1, _active))
+
+
+@contextlib.contextmanager
+def active_call():
+    """Count a run_steps() call as in flight for choose_workers()."""
+    global _active
+    with _active_lock:
+        _active += 1
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active -= 1
+
+
+def apply_steps_parallel(input_path, output_path, steps, workers):
+    """
+    local_filters.apply_steps() split into row bands across workers processes,
+    with the image in shared memory. Returns output_path.
+    """
+    with SharedBuffers() as buffers:
+        source = tiled.stage_input(input_path, buffers)
+        height = tiled._open_source(source).shape[0]
+        # One band per worker, but not so thin that the halos dominate the work
+        halo = max((tiled.tile_geometry(argument)[0] for kind, argument in tiled.plan_passes(steps)
+                    if kind == 'tiles'), default=0)
+        band_rows = max(MIN_BAND_ROWS, 4 * halo, -(-height // workers))
+        result = tiled.run_passes(source, steps, buffers, band_rows, band_rows=band_rows, workers=workers)
+        return tiled.write_output(result, output_path)
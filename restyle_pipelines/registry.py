@@ -0,0 +1,229 @@
+"""
+Maps art styles to restyle pipelines.
+
+An entry in art_styles.json may carry an optional "pipeline" spec; without
+one the style is restyled remotely by DeepAI using its description as the
+prompt. Specs:
+
+    {"type": "remote", "upscale": true}
+    {"type": "remote", "upscale": "local"}      (Lanczos upscale instead of waifu2x)
+    {"type": "local", "filter": "sketch", "options": {"blur_radius": 8}}
+    {"type": "local", "steps": [{"filter": "posterize"}, {"filter": "halftone"}]}
+    {"type": "chain", "steps": [{"type": "remote", "upscale": false},
+                                {"type": "local", "filter": "hand_drawn"}]}
+
+Any spec may add "fallback" (another spec, usually local) and
+"fallback_after" (seconds): if the primary pipeline fails or has not
+finished in time, the fallback produces the image instead.
+
+Styles with a plugin module in this package (see restyle_pipelines) use it.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import json_handler
+import restyle_engine
+import restyle_pipelines
+from restyle_pipelines import local_filters
+
+LOCAL_UPSCALE_STEPS = [('upscale', {'scale': 2})]
+
+logger = logging.getLogger(__name__)
+
+
+class RemotePipeline:
+    """
+    DeepAI image-editor with the style prompt, followed by waifu2x when
+    upscale is True or by a local upscale when it is 'local'. An
+    UploadPreprocessor shrinks the image before it is uploaded.
+    """
+
+    def __init__(self, upscale=True, preprocessor=None):
+        self.upscale = upscale
+        self.preprocessor = preprocessor
+
+    def split(self):
+        if self.upscale == 'local':
+            return RemotePipeline(upscale=False, preprocessor=self.preprocessor), list(LOCAL_UPSCALE_STEPS)
+        return self, []
+
+    def run(self, image_path, prompt, api_key, output_path, cache=None):
+        with restyle_engine.open_upload(image_path, self.preprocessor) as image_data:
+            if self.upscale is not True:
+                restyle_engine.restyle_to_file(image_data, prompt, output_path, api_key, cache)
+                if self.upscale == 'local':
+                    restyle_pipelines.run_steps(output_path, output_path, LOCAL_UPSCALE_STEPS)
+                return output_path
+            restyled_data = restyle_engine.restyle_to_bytes(image_data, prompt, api_key, cache)
+        return restyle_engine.upscale_to_file(restyled_data, output_path, api_key, cache)
+
+
+class LocalPipeline:
+    """Offline (filter name, options) steps run in the shared process pool."""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def split(self):
+        return None, self.steps
+
+    def run(self, image_path, prompt, api_key, output_path, cache=None):
+        return restyle_pipelines.run_steps(image_path, output_path, self.steps)
+
+
+class ChainPipeline:
+    """Pipelines run one after another, each restyling the previous result."""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def split(self):
+        """(remote, local steps) when the chain is an optional remote stage followed by local ones."""
+        remote, steps = None, []
+        for index, stage in enumerate(self.stages):
+            stage_split = stage.split()
+            if stage_split is None:
+                return None
+            stage_remote, stage_steps = stage_split
+            if stage_remote is not None:
+                if index != 0:
+                    return None  # A remote stage after local work cannot be split into engine stages
+                remote = stage_remote
+            steps.extend(stage_steps)
+        return remote, steps
+
+    def run(self, image_path, prompt, api_key, output_path, cache=None):
+        # Intermediate results get their own files so no stage reads and writes the same one
+        base, ext = os.path.splitext(output_path)
+        current = image_path
+        for index, stage in enumerate(self.stages):
+            is_last = index == len(self.stages) - 1
+            target = output_path if is_last else f"{base}.step{index}{ext}"
+            result = stage.run(current, prompt, api_key, target, cache)
+            if current != image_path:
+                _remove_quietly(current)
+            current = result
+        return current
+
+
+class FallbackPipeline:
+    """
+    Use fallback when primary fails or takes longer than timeout seconds.
+    A fallback from another art style runs with that style's fallback_prompt
+    instead of the primary's.
+    """
+
+    # Shared threads for primaries that may outlive their caller's patience
+    _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="restyle-fallback")
+
+    def __init__(self, primary, fallback, timeout=None, fallback_prompt=None):
+        self.primary = primary
+        self.fallback = fallback
+        self.timeout = timeout
+        self.fallback_prompt = fallback_prompt
+
+    def split(self):
+        return None  # The choice is made per image, so it runs as one unit
+
+    def run(self, image_path, prompt, api_key, output_path, cache=None):
+        # The primary writes to its own file so a late finish cannot clobber the fallback's result
+        primary_path = f"{output_path}.primary{os.path.splitext(output_path)[1]}"
+        future = self._executor.submit(self.primary.run, image_path, prompt, api_key, primary_path, cache)
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            logger.warning("Primary pipeline slower than %ss for %s; using fallback", self.timeout, image_path)
+            # A late remote result still lands in the result cache for next time
+            future.add_done_callback(lambda _: _remove_quietly(primary_path))
+        except Exception as e:
+            logger.warning("Primary pipeline failed for %s (%s); using fallback", image_path, e)
+            _remove_quietly(primary_path)
+        else:
+            os.replace(primary_path, output_path)
+            return output_path
+        if self.fallback_prompt is not None:
+            prompt = self.fallback_prompt
+        return self.fallback.run(image_path, prompt, api_key, output_path, cache)
+
+
+class ModulePipeline:
+    """A plugin module from restyle_pipelines (see the package docstring)."""
+
+    def __init__(self, module, preprocessor=None):
+        self.module = module
+        self.preprocessor = preprocessor
+
+    def split(self):
+        steps = getattr(self.module, 'LOCAL_STEPS', None)
+        if steps is None:
+            return None
+        return RemotePipeline(upscale=False, preprocessor=self.preprocessor), list(steps)
+
+    def run(self, image_path, prompt, api_key, output_path, cache=None):
+        return self.module.run(image_path, prompt, api_key, output_path, cache, preprocessor=self.preprocessor)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _local_steps(spec):
+    if 'steps' in spec:
+        return [(step['filter'], step.get('options', {})) for step in spec['steps']]
+    return [(spec['filter'], spec.get('options', {}))]
+
+
+def build_pipeline(spec, preprocessor=None):
+    """
+    Build a pipeline from a spec dict (None means the default remote pipeline).
+    Remote stages upload through preprocessor, if one is given.
+    """
+    if spec is None:
+        return RemotePipeline(preprocessor=preprocessor)
+
+    kind = spec.get('type', 'remote')
+    if kind == 'remote':
+        pipeline = RemotePipeline(upscale=spec.get('upscale', True), preprocessor=preprocessor)
+    elif kind == 'local':
+        steps = _local_steps(spec)
+        unknown = [name for name, _ in steps if name not in local_filters.FILTERS]
+        if unknown:
+            raise ValueError(f"Unknown local filter(s): {', '.join(unknown)}")
+        pipeline = LocalPipeline(steps)
+    elif kind == 'chain':
+        pipeline = ChainPipeline([build_pipeline(step, preprocessor) for step in spec['steps']])
+    else:
+        raise ValueError(f"Unknown pipeline type: {kind}")
+
+    if spec.get('fallback'):
+        fallback = build_pipeline(spec['fallback'], preprocessor)
+        pipeline = FallbackPipeline(pipeline, fallback, spec.get('fallback_after'))
+    return pipeline
+
+
+def pipeline_for_style(style, preprocessor=None):
+    """Pipeline for an art style dict from art_styles.json."""
+    plugin = restyle_pipelines.get_pipeline(style.get('name'))
+    if plugin is not None:
+        return ModulePipeline(plugin, preprocessor)
+    return build_pipeline(style.get('pipeline'), preprocessor)
+
+
+def get_style_pipeline(style_name, filename='art_styles.json', preprocessor=None):
+    """Pipeline for the named art style, or the default remote pipeline if the style is unknown."""
+    style = json_handler.get_art_style(style_name, filename)
+    if style is not None:
+        return pipeline_for_style(style, preprocessor)
+    plugin = restyle_pipelines.get_pipeline(style_name)
+    if plugin is not None:
+        return ModulePipeline(plugin, preprocessor)
+    return RemotePipeline(preprocessor=preprocessor)
+
+
+def is_offline(pipeline):
+    """True if the pipeline never needs the network."""
+    split = pipeline.split()
+    return split is not None and split[0] is None
@@ -0,0 +1,392 @@
+"""
+Tiled, out-of-core execution of local filter steps for very large images.
+
+Panoramas and scans do not fit in memory once a filter makes a few
+full-size float copies of them, so images above TILED_MIN_PIXELS are
+processed like this instead:
+
+1. The input is memory-mapped: .npy files and uncompressed TIFFs (with
+   tifffile installed) directly, anything else by decoding it once into a
+   raw .npy in a JobWorkspace (strip by strip where the format allows it;
+   see stage_input()).
+2. Consecutive tileable filters run as one pass over tile_size x tile_size
+   tiles. Each tile is read with a halo of context pixels big enough for
+   the filters' neighbourhoods (HALOS), filtered, cropped back and written
+   into a memory-mapped output, so tiles stitch without seams.
+3. hand_drawn is not local (its distortion reads pixels up to a tenth of
+   the image size away), so it runs as two banded passes of the fused
+   NumPy engine over memory-mapped planes instead.
+4. The result is written out from the mapped buffer: Pillow's encoders read
+   it through Image.frombuffer() without a copy, .npy outputs are streamed.
+
+Tiles and bands are tasks in the shared process pool (or run one by one
+when already inside a pool worker), so memory in use is about the tile size
+times the number of workers; the rest of the image stays in the page cache.
+"""
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+from PIL import Image
+import metrics
+import workspace
+import restyle_pipelines
+from restyle_pipelines import local_filters
+
+DEFAULT_TILE_SIZE = 1024
+TILED_MIN_PIXELS = 64 * 1024 ** 2   # About 67 MP; smaller images are filtered whole
+MAX_PIXELS = 4 * 1000 ** 3          # Largest image tiled mode opens
+STRIP_ROWS = 256                     # Rows decoded per copy when staging an input
+
+# Context pixels each filter needs on every side of a tile, from its options
+HALOS = {
+    'sketch': lambda options: 3 * options.get('blur_radius', 8) + 2,
+    'posterize': lambda options: 2 if options.get('smooth', True) else 0,
+    'oil_paint': lambda options: 2 * max(1, options.get('radius', 4) // 2) + 1,
+    'halftone': lambda options: 0,
+    'upscale': lambda options: 4,
+}
+# Filters that change the image size, by this factor
+SCALES = {
+    'upscale': lambda options: options.get('scale', 2),
+}
+# Filters that need the whole image and get a banded pass of their own
+BANDED = ('hand_drawn',)
+
+_pixels_lock = threading.Lock()
+
+
+def _allow_large_images():
+    # Tiled mode exists for the user's own gigapixel files, so lift Pillow's
+    # decompression-bomb limit (it errors at twice MAX_IMAGE_PIXELS) up to MAX_PIXELS
+    with _pixels_lock:
+        if Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < MAX_PIXELS // 2:
+            Image.MAX_IMAGE_PIXELS = MAX_PIXELS // 2
+
+
+def image_size(path):
+    """(width, height) of an image or .npy array, read from its header only."""
+    if path.lower().endswith('.npy'):
+        height, width = np.load(path, mmap_mode='r').shape[:2]
+        return width, height
+    _allow_large_images()
+    with Image.open(path) as image:
+        return image.size
+
+
+def should_tile(path):
+    """True if an image is large enough that its local steps should run tiled."""
+    try:
+        width, height = image_size(path)
+    except Image.DecompressionBombError:
+        return True
+    return width * height > TILED_MIN_PIXELS
+
+
+def _in_pool_worker():
+    return multiprocessing.parent_process() is not None
+
+
+def _run_tasks(function, tasks, workers=None):
+    """
+    Run function(*task) for every task: in the shared process pool with at
+    most 2 x workers tasks queued at a time, or inline inside a pool worker.
+    """
+    if _in_pool_worker() or workers == 1:
+        for task in tasks:
+            function(*task)
+        return
+    pool = restyle_pipelines.get_process_pool()
+    limit = 2 * (workers or os.cpu_count() or 1)
+    pending = set()
+    for task in tasks:
+        if len(pending) >= limit:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        pending.add(pool.submit(function, *task))
+    for future in wait(pending)[0]:
+        future.result()
+
+
+def _open_source(source, mode='r'):
+    """
+    The (H, W, C) array of a source: ('npy' | 'tiff', path) memory-mapped,
+    or ('shm', name, shape) in shared memory.
+    """
+    kind = source[0]
+    if kind == 'shm':
+        from restyle_pipelines import parallel
+        return parallel.attach(*source[1:])
+    if kind == 'tiff':
+        import tifffile
+        return tifffile.memmap(source[1], mode=mode)
+    return np.load(source[1], mmap_mode=mode)
+
+
+class MemmapBuffers:
+    """Pass buffers as .npy files in a JobWorkspace, memory-mapped by every task."""
+
+    def __init__(self, job_workspace):
+        self.workspace = job_workspace
+
+    def allocate(self, name, shape):
+        path = self.workspace.path(f"{name}.npy")
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        return ('npy', path)
+
+    def release(self, source):
+        """Free a buffer from allocate() early; sources it did not allocate are left alone."""
+        if source[0] == 'npy' and source[1].startswith(self.workspace.directory):
+            os.remove(source[1])
+
+
+def _is_rgb_array(array):
+    return array.dtype == np.uint8 and array.ndim == 3 and array.shape[2] in (3, 4)
+
+
+# Bytes per pixel of the uncompressed layouts _raw_bands() reads, when a tile does not give its stride
+_RAW_PIXEL_BYTES = {'L': 1, 'RGB': 3, 'BGR': 3, 'RGBX': 4, 'RGBA': 4, 'BGRX': 4, 'BGRA': 4}
+
+
+def _raw_bands(image):
+    """
+    Yield (y, band image) for an image stored as uncompressed rows (BMP,
+    PPM, raw TIFF strips), reading STRIP_ROWS rows from the file at a time.
+    Returns None instead for any other layout.
+    """
+    width, height = image.size
+    layouts = []
+    for codec, extents, offset, args in image.tile:
+        args = (args,) if isinstance(args, str) else tuple(args)
+        rawmode, stride, orientation = args[0], args[1] if len(args) > 1 else 0, args[2] if len(args) > 2 else 1
+        if image.mode not in ('L', 'RGB', 'RGBA') or codec != 'raw' or extents[0] != 0 or extents[2] != width:
+            return None
+        if not stride:
+            if rawmode not in _RAW_PIXEL_BYTES:
+                return None
+            stride = width * _RAW_PIXEL_BYTES[rawmode]
+        layouts.append((extents[1], extents[3], offset, rawmode, stride, orientation))
+
+    def bands():
+        for top, bottom, offset, rawmode, stride, orientation in sorted(layouts):
+            for y in range(top, bottom, STRIP_ROWS):
+                rows = min(bottom, y + STRIP_ROWS) - y
+                # Bottom-up rows (orientation -1, as in BMP) are stored last band first
+                first_row = y - top if orientation > 0 else bottom - y - rows
+                image.fp.seek(offset + first_row * stride)
+                data = image.fp.read(rows * stride)
+                yield y, Image.frombuffer(image.mode, (width, rows), data, 'raw', rawmode, stride, orientation)
+    return bands()
+
+
+def _decode_tiff(input_path, buffers):
+    """Decode a compressed RGB TIFF with tifffile straight into a buffer, strip by strip; None if it cannot."""
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    with tifffile.TiffFile(input_path) as tiff:
+        page = tiff.pages[0]
+        if page.dtype != np.uint8 or len(page.shape) != 3 or page.shape[2] != 3:
+            return None
+        with metrics.span('read', tiled=True) as span:
+            source = buffers.allocate('input', page.shape)
+            staged = _open_source(source, mode='r+')
+            page.asarray(out=staged)
+            span.add_bytes(staged.nbytes)
+            del staged
+    return source
+
+
+def stage_input(input_path, buffers):
+    """
+    Return a source for an image: mapped in place if possible, else decoded
+    into a buffer strip by strip. Uncompressed rows (BMP, PPM, raw TIFF) are
+    read STRIP_ROWS at a time and compressed TIFFs are decoded by tifffile
+    into the buffer. Pillow cannot decode part of a JPEG, PNG or WebP (or of
+    a compressed TIFF without tifffile), so those are decoded whole once,
+    which briefly needs the full image in memory on top of the buffer.
+    """
+    if input_path.lower().endswith('.npy') and _is_rgb_array(np.load(input_path, mmap_mode='r')):
+        return ('npy', input_path)
+    if input_path.lower().endswith(('.tif', '.tiff')):
+        try:
+            import tifffile
+            if _is_rgb_array(tifffile.memmap(input_path, mode='r')):
+                return ('tiff', input_path)
+        except (ImportError, ValueError):
+            pass  # Not installed, or compressed / not contiguous: decode it below
+        source = _decode_tiff(input_path, buffers)
+        if source is not None:
+            return source
+
+    _allow_large_images()
+    with metrics.span('read', tiled=True) as span, Image.open(input_path) as image:
+        width, height = image.size
+        source = buffers.allocate('input', (height, width, 3))
+        staged = _open_source(source, mode='r+')
+        bands = _raw_bands(image)
+        if bands is None:
+            # The first crop decodes the whole image
+            bands = ((y, image.crop((0, y, width, min(height, y + STRIP_ROWS)))) for y in range(0, height, STRIP_ROWS))
+        for y, band in bands:
+            staged[y:y + band.height] = np.asarray(band if band.mode == 'RGB' else band.convert('RGB'))
+        span.add_bytes(staged.nbytes)
+        del staged
+    return source
+
+
+def plan_passes(steps):
+    """Group steps into [('tiles', [steps...]) | ('banded', (name, options))] passes."""
+    passes = []
+    for name, options in steps:
+        if name not in local_filters.FILTERS:
+            raise ValueError(f"Unknown local filter: {name}")
+        if name in BANDED:
+            passes.append(('banded', (name, options or {})))
+        elif passes and passes[-1][0] == 'tiles':
+            passes[-1][1].append((name, options or {}))
+        else:
+            passes.append(('tiles', [(name, options or {})]))
+    return passes
+
+
+def tile_geometry(steps):
+    """(halo, alignment, scale) of a tiled pass, in input pixels."""
+    halo, scale, align = 0.0, 1.0, 1
+    for name, options in steps:
+        if name not in HALOS:
+            raise ValueError(f"Filter {name} cannot run tiled")
+        # A halo needed after upscaling covers fewer input pixels
+        halo += HALOS[name](options) / scale
+        if name == 'halftone':
+            # Halftone cells must not straddle tiles, and windows must start on a cell
+            align = math.lcm(align, options.get('cell', 8))
+        scale *= SCALES.get(name, lambda _: 1)(options)
+    halo = -(-math.ceil(halo) // align) * align
+    return halo, align, scale
+
+
+def _filter_tile(source, target, steps, box, window, scale):
+    """Filter one tile window and write its box (without the halo) into the target."""
+    x0, y0, x1, y1 = box
+    wx0, wy0, wx1, wy1 = window
+    rgb = np.ascontiguousarray(_open_source(source)[wy0:wy1, wx0:wx1, :3])
+    for name, options in steps:
+        rgb = local_filters.FILTERS[name](rgb, **options)
+
+    out = _open_source(target, mode='r+')
+    ox0, oy0, ox1, oy1 = (round(value * scale) for value in box)
+    ox1, oy1 = min(ox1, out.shape[1]), min(oy1, out.shape[0])
+    cx, cy = round((x0 - wx0) * scale), round((y0 - wy0) * scale)
+    tile = rgb[cy:cy + oy1 - oy0, cx:cx + ox1 - ox0]
+    out[oy0:oy0 + tile.shape[0], ox0:ox0 + tile.shape[1], :3] = tile
+    out[oy0:oy0 + tile.shape[0], ox0:ox0 + tile.shape[1], 3] = 255
+
+
+def _tiled_pass(source, target, steps, tile_rows, tile_cols, workers):
+    """One pass of tileable steps over tile_rows x tile_cols tiles (aligned to tile_geometry())."""
+    height, width = _open_source(source).shape[:2]
+    halo, _, scale = tile_geometry(steps)
+    tasks = []
+    for y0 in range(0, height, tile_rows):
+        for x0 in range(0, width, tile_cols):
+            box = (x0, y0, min(width, x0 + tile_cols), min(height, y0 + tile_rows))
+            window = (max(0, x0 - halo), max(0, y0 - halo), min(width, box[2] + halo), min(height, box[3] + halo))
+            tasks.append((source, target, steps, box, window, scale))
+    with metrics.span('filter', filter='+'.join(name for name, _ in steps), tiled=True):
+        _run_tasks(_filter_tile, tasks, workers)
+
+
+def _contour_noise_rows(source, plane, r0, r1, seed):
+    from restyle_pipelines import hand_drawn
+    rgb = _open_source(source)[..., :3]
+    height, width = rgb.shape[:2]
+    plane = _open_source(plane, mode='r+')
+    gray = np.empty((r1 - r0 + 2, width), dtype=np.uint32)
+    hand_drawn._contour_noise_band(rgb, plane, r0, r1, None, np.random.default_rng(seed), gray, np.empty_like(gray))
+    # Replicated padding column, and padding row after the last band
+    plane[r0:r1, width] = plane[r0:r1, width - 1]
+    if r1 == height:
+        plane[height] = plane[height - 1]
+
+
+def _detail_blend_rows(source, plane, target, r0, r1):
+    from restyle_pipelines import hand_drawn
+    rgb = _open_source(source)[..., :3]
+    out = _open_source(target, mode='r+')
+    hand_drawn._detail_blend_band(_open_source(plane), rgb, out[..., :3], r0, r1)
+    out[r0:r1, :, 3] = 255
+
+
+def _hand_drawn_pass(source, target, plane, options, band_rows, workers):
+    """The fused hand-drawn engine, band by band over a shared (H + 1, W + 1) plane."""
+    height = _open_source(source).shape[0]
+    bands = [(r0, min(height, r0 + band_rows)) for r0 in range(0, height, band_rows)]
+    seeds = np.random.SeedSequence(options.get('seed')).spawn(len(bands))
+    with metrics.span('filter', filter='hand_drawn', tiled=True):
+        _run_tasks(_contour_noise_rows, [(source, plane, r0, r1, seed)
+                                         for (r0, r1), seed in zip(bands, seeds)], workers)
+        # The second pass samples the plane up to DISTORTION x width rows away, so it waits for all of it
+        _run_tasks(_detail_blend_rows, [(source, plane, target, r0, r1) for r0, r1 in bands], workers)
+
+
+def run_passes(source, steps, buffers, tile_rows, tile_cols=None, band_rows=None, workers=None):
+    """
+    Run steps over a staged source, pass by pass, into buffers from buffers.allocate().
+    Tiles are tile_rows x tile_cols (whole rows without tile_cols); returns the
+    (H, W, 4) result source.
+    """
+    for index, (kind, argument) in enumerate(plan_passes(steps)):
+        height, width = _open_source(source).shape[:2]
+        if kind == 'banded':
+            target = buffers.allocate(f"pass{index}", (height, width, 4))
+            plane = buffers.allocate(f"pass{index}_plane", (height + 1, width + 1))
+            # Bands of about one tile's worth of pixels keep per-task scratch memory bounded
+            rows = band_rows or max(8, tile_rows * (tile_cols or width) // width)
+            _hand_drawn_pass(source, target, plane, argument[1], rows, workers)
+            buffers.release(plane)
+        else:
+            halo, align, scale = tile_geometry(argument)
+            target = buffers.allocate(f"pass{index}", (round(height * scale), round(width * scale), 4))
+            rows = max(align, tile_rows // align * align)
+            cols = max(align, tile_cols // align * align) if tile_cols else width
+            _tiled_pass(source, target, argument, rows, cols, workers)
+        buffers.release(source)  # Drop the previous intermediate as soon as it has been read
+        source = target
+    return source
+
+
+def write_output(source, output_path):
+    """Encode an (H, W, 4) result to output_path without an in-memory copy."""
+    array = _open_source(source)
+    height, width = array.shape[:2]
+    base, ext = os.path.splitext(output_path)
+    temporary_path = f"{base}.tiled-tmp{ext}"
+    with metrics.span('save', tiled=True) as span:
+        if ext.lower() == '.npy':
+            np.save(temporary_path, array[..., :3])
+        else:
+            # JPEG has no alpha, so it reads the padding byte as X; the alpha everywhere else is opaque
+            mode = 'RGBX' if ext.lower() in ('.jpg', '.jpeg') else 'RGBA'
+            image = Image.frombuffer(mode, (width, height), array, 'raw', mode, 0, 1)
+            image.save(temporary_path, format=Image.registered_extensions().get(ext.lower()))
+            del image
+        del array
+        os.replace(temporary_path, output_path)
+        span.add_bytes(os.path.getsize(output_path))
+    return output_path
+
+
+def apply_steps_tiled(input_path, output_path, steps, tile_size=DEFAULT_TILE_SIZE, workers=None):
+    """
+    local_filters.apply_steps() for images too large to hold in memory.
+    Intermediate buffers live in a JobWorkspace; returns output_path.
+    """
+    with workspace.JobWorkspace(prefix='tiled-', root=os.path.dirname(os.path.abspath(output_path))) as job_workspace:
+        buffers = MemmapBuffers(job_workspace)
+        source = stage_input(input_path, buffers)
+        return write_output(run_passes(source, steps, buffers, tile_size, tile_size, workers=workers), output_path)
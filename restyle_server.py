@@ -0,0 +1,475 @@
+"""
+Headless HTTP service exposing restyle, describe and art style editing as a local REST API.
+
+    python restyle_server.py --port 8080 --workers 4 --queue 16
+
+Endpoints (JSON in and out unless noted):
+
+    GET    /health                   {"status": "ok", "running": n, "queued": n, "capacity": n}
+    GET    /metrics                  Prometheus text format
+    GET    /styles                   every art style
+    GET    /styles/{name}            one art style
+    POST   /styles                   {"name": ..., "description": ...}; 409 if the name exists
+    PUT    /styles/{name}            {"description": ...}
+    DELETE /styles/{name}
+    POST   /restyle?style={name}     image bytes in, the restyled JPEG streamed back
+           [&upscale=0]              (skip the waifu2x step of plain DeepAI styles)
+    POST   /describe                 image bytes in, {"description": ...}
+
+    curl --data-binary @photo.jpg -H 'Content-Type: image/jpeg' \\
+         'http://127.0.0.1:8080/restyle?style=Hand%20Drawn' -o restyled.jpg
+
+Requests are handled on an asyncio event loop. Restyles and descriptions
+run on a bounded thread pool through the same code as the desktop window:
+restyle_engine.restyle_file() with the style's pipeline, the shared result
+cache and the shared description cache. At most --workers of them run at
+a time and --queue more wait; past that a request is answered 503 with
+Retry-After before its upload is read. Uploads are streamed into a
+JobWorkspace and results streamed back from it, so neither is held in
+memory whole; their file reads and writes run on threads, off the event
+loop. Styles are read and written through json_handler.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import mimetypes
+from http import HTTPStatus
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import json_handler
+import restyle_engine
+import deepai_client
+import result_cache
+import description_cache
+import preprocess
+import workspace
+import metrics
+import restyle_pipelines
+from restyle_pipelines import registry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+MAX_JSON_BYTES = 1024 ** 2
+DEFAULT_MAX_UPLOAD_MB = 64
+RETRY_AFTER_SECONDS = 2
+
+
+class HTTPError(Exception):
+    """Answer the request with this status and a JSON {"error": message} body."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request:
+    """A parsed request head; the body is read from the connection on demand."""
+
+    def __init__(self, method, target, version, headers, reader, writer):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = unquote(parts.path)
+        self.query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        connection = headers.get('connection', '').lower()
+        self.keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        self.responded = False  # Set once a response head is written; a second response would corrupt the stream
+        self._continued = False
+        try:
+            self.unread = int(headers.get('content-length') or 0)
+        except ValueError:
+            self.unread = -1
+        if self.unread < 0:
+            raise HTTPError(400, "Invalid Content-Length")
+
+    async def read_chunks(self, limit):
+        """Yield the body in chunks, refusing bodies over limit bytes."""
+        if 'transfer-encoding' in self.headers:
+            self.keep_alive = False
+            raise HTTPError(411, "Send the body with a Content-Length")
+        if self.unread > limit:
+            raise HTTPError(413, f"Body larger than {limit} bytes")
+        if not self._continued and self.headers.get('expect', '').lower() == '100-continue':
+            # The client waits for this before sending the body, so overloaded requests never upload
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            self._continued = True
+        while self.unread:
+            chunk = await self.reader.read(min(CHUNK_SIZE, self.unread))
+            if not chunk:
+                raise ConnectionResetError("Client closed the connection mid-body")
+            self.unread -= len(chunk)
+            yield chunk
+
+    async def read_json(self):
+        body = b''.join([chunk async for chunk in self.read_chunks(MAX_JSON_BYTES)])
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return data
+
+
+async def read_request(reader, writer):
+    """The next Request on a connection, or None once the client has closed it."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HTTPError(400, "Incomplete request head")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "Request head too large")
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    return Request(method.upper(), target, version, headers, reader, writer)
+
+
+def _head(status, headers, keep_alive):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    headers = {**headers, 'Connection': 'keep-alive' if keep_alive else 'close'}
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send(request, status, body=b'', content_type='application/json', headers=None):
+    headers = {'Content-Type': content_type, 'Content-Length': str(len(body)), **(headers or {})}
+    request.responded = True
+    request.writer.write(_head(status, headers, request.keep_alive) + body)
+    await request.writer.drain()
+
+
+async def send_json(request, status, data, headers=None):
+    await send(request, status, json.dumps(data).encode('utf-8'), headers=headers)
+
+
+async def send_file(request, path, content_type):
+    """Stream a file as the response body, a chunk at a time, reading it off the event loop."""
+    file = await asyncio.to_thread(open, path, 'rb')
+    try:
+        size = await asyncio.to_thread(os.fstat, file.fileno())
+        headers = {'Content-Type': content_type, 'Content-Length': str(size.st_size)}
+        request.responded = True
+        request.writer.write(_head(200, headers, request.keep_alive))
+        while True:
+            chunk = await asyncio.to_thread(file.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            request.writer.write(chunk)
+            await request.writer.drain()
+    finally:
+        await asyncio.to_thread(file.close)
+    return size.st_size
+
+
+class RestyleService:
+    """The routes, and the bounded pool the restyles and descriptions run on."""
+
+    def __init__(self, api_key, styles_file='art_styles.json', workers=4, queue_size=16,
+                 max_upload=DEFAULT_MAX_UPLOAD_MB * 1024 ** 2, cache=None, preprocessor=None):
+        self.api_key = api_key
+        self.styles_file = styles_file
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.max_upload = max_upload
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.description_cache = description_cache.get_shared_description_cache()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restyle-server')
+        self.in_flight = 0  # Admitted requests, running or queued; only touched on the event loop
+        self.routes = [
+            ('GET', ('health',), self.health),
+            ('GET', ('metrics',), self.prometheus),
+            ('GET', ('styles',), self.list_styles),
+            ('POST', ('styles',), self.add_style),
+            ('GET', ('styles', None), self.get_style),
+            ('PUT', ('styles', None), self.update_style),
+            ('DELETE', ('styles', None), self.remove_style),
+            ('POST', ('restyle',), self.restyle),
+            ('POST', ('describe',), self.describe),
+        ]
+
+    def route(self, request):
+        """(handler, path arguments, route label) for a request."""
+        parts = tuple(part for part in request.path.split('/') if part)
+        allowed = []
+        for method, pattern, handler in self.routes:
+            if len(pattern) != len(parts) or any(p is not None and p != part for p, part in zip(pattern, parts)):
+                continue
+            if method == request.method:
+                arguments = [part for p, part in zip(pattern, parts) if p is None]
+                return handler, arguments, '/' + '/'.join(p or '{name}' for p in pattern)
+            allowed.append(method)
+        if allowed:
+            raise HTTPError(405, f"Use {', '.join(allowed)}", {'Allow': ', '.join(allowed)})
+        raise HTTPError(404, f"No such endpoint: {request.path}")
+
+    @contextmanager
+    def admit(self):
+        """Hold a worker or queue slot for a request, or refuse it with 503 when all are taken."""
+        if self.in_flight >= self.capacity:
+            metrics.increment('server_rejected_total')
+            raise HTTPError(503, "Server busy, retry later", {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def receive_image(self, request, job_workspace):
+        """Stream the request body into the workspace as the 'input' artifact, writing it off the event loop."""
+        content_type = request.headers.get('content-type', '').split(';')[0].strip()
+        extension = mimetypes.guess_extension(content_type) if content_type.startswith('image/') else None
+        path = job_workspace.artifact('input', f"input{extension or '.jpg'}")
+        with metrics.span('read', source='http') as span:
+            file = await asyncio.to_thread(open, path, 'wb')
+            try:
+                async for chunk in request.read_chunks(self.max_upload):
+                    await asyncio.to_thread(file.write, chunk)
+                    span.add_bytes(len(chunk))
+            finally:
+                await asyncio.to_thread(file.close)
+        if not span.bytes:
+            raise HTTPError(400, "Send the image as the request body")
+        return path
+
+    # Connection handling
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, writer)
+                except HTTPError as e:
+                    writer.write(_head(e.status, {'Content-Length': '0'}, False))
+                    break
+                if request is None:
+                    break
+                await self.handle(request)
+                # A body left unread (e.g. after a 503) would be parsed as the next request
+                if not request.keep_alive or request.unread:
+                    break
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, request):
+        label = 'unknown'
+        with metrics.span('http_request', method=request.method) as span:
+            try:
+                handler, arguments, label = self.route(request)
+                await handler(request, *arguments)
+                status = 200
+            except HTTPError as e:
+                status = e.status
+                if request.unread:
+                    request.keep_alive = False
+                await self.send_error(request, e.status, e.message, e.headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                request.keep_alive = False
+                raise
+            except Exception as e:
+                logger.exception("%s %s failed", request.method, request.path)
+                status = 500
+                request.keep_alive = False
+                await self.send_error(request, 500, str(e))
+            span.set_label('route', label)
+            span.set_label('status', status)
+
+    async def send_error(self, request, status, message, headers=None):
+        """Answer with a JSON error, or, once a response head is out, just close the connection."""
+        if request.responded:
+            request.keep_alive = False  # The client sees the body cut short
+            return
+        await send_json(request, status, {'error': message}, headers)
+
+    # Routes
+
+    async def health(self, request):
+        await send_json(request, 200, {'status': 'ok', 'running': min(self.in_flight, self.workers),
+                                       'queued': max(0, self.in_flight - self.workers), 'capacity': self.capacity})
+
+    async def prometheus(self, request):
+        await send(request, 200, metrics.registry.to_prometheus().encode('utf-8'),
+                   'text/plain; version=0.0.4; charset=utf-8')
+
+    async def list_styles(self, request):
+        await send_json(request, 200, await asyncio.to_thread(json_handler.load_art_styles, self.styles_file))
+
+    async def get_style(self, request, name):
+        style = await asyncio.to_thread(json_handler.get_art_style, name, self.styles_file)
+        if style is None:
+            raise HTTPError(404, f"No art style named {name!r}")
+        await send_json(request, 200, style)
+
+    async def add_style(self, request):
+        data = await request.read_json()
+        name, description = data.get('name'), data.get('description')
+        if not isinstance(name, str) or not name.strip() or not isinstance(description, str):
+            raise HTTPError(400, "Give a non-empty \"name\" and a \"description\" string")
+        if await asyncio.to_thread(json_handler.get_art_style, name, self.styles_file) is not None:
+            raise HTTPError(409, f"Art style {name!r} already exists")
+        await asyncio.to_thread(json_handler.add_art_style, name, description, self.styles_file)
+        await send_json(request, 201, {'name': name, 'description': description},
+                        {'Location': f"/styles/{quote(name)}"})
+
+    async def update_style(self, request, name):
+        description = (await request.read_json()).get('description')
+        if not isinstance(description, str):
+            raise HTTPError(400, "Give a \"description\" string")
+        if not await asyncio.to_thread(json_handler.update_art_style, name, description, self.styles_file):
+            raise HTTPError(404, f"No art style named {name!r}")
+        await send_json(request, 200, await asyncio.to_thread(json_handler.get_art_style, name, self.styles_file))
+
+    async def remove_style(self, request, name):
+        if await asyncio.to_thread(json_handler.get_art_style, name, self.styles_file) is None:
+            raise HTTPError(404, f"No art style named {name!r}")
+        await asyncio.to_thread(json_handler.remove_art_style, name, self.styles_file)
+        await send(request, 204)
+
+    async def restyle(self, request):
+        style = request.query.get('style')
+        if not style:
+            raise HTTPError(400, "Name the art style with ?style=")
+        prompt = await asyncio.to_thread(restyle_engine.get_art_style_prompt, style, self.styles_file)
+        if prompt is None:
+            raise HTTPError(404, f"No art style named {style!r}")
+        upscale = request.query.get('upscale', '1').lower() not in ('0', 'false', 'no')
+
+        job_workspace = await asyncio.to_thread(workspace.JobWorkspace, prefix='server-restyle-')
+        try:
+            with self.admit():
+                input_path = await self.receive_image(request, job_workspace)
+                output_path = job_workspace.artifact('output', 'restyled.jpg')
+                await self.run(self._restyle, input_path, style, prompt, output_path, upscale)
+            with metrics.span('save', destination='http') as span:
+                span.add_bytes(await send_file(request, output_path, 'image/jpeg'))
+        finally:
+            await asyncio.to_thread(job_workspace.close)
+
+    def _restyle(self, input_path, style, prompt, output_path, upscale):
+        _check_image(input_path)
+        pipeline = registry.get_style_pipeline(style, self.styles_file, self.preprocessor)
+        if isinstance(pipeline, registry.RemotePipeline) and not upscale:
+            pipeline = registry.RemotePipeline(upscale=False, preprocessor=self.preprocessor)
+        if not self.api_key and not registry.is_offline(pipeline):
+            raise HTTPError(503, "No DeepAI API key is configured on the server")
+        return restyle_engine.restyle_file(input_path, prompt, self.api_key, output_path,
+                                           upscale=upscale, cache=self.cache, pipeline=pipeline)
+
+    async def describe(self, request):
+        job_workspace = await asyncio.to_thread(workspace.JobWorkspace, prefix='server-describe-')
+        try:
+            with self.admit():
+                input_path = await self.receive_image(request, job_workspace)
+                description = await self.run(self._describe, input_path)
+        finally:
+            await asyncio.to_thread(job_workspace.close)
+        await send_json(request, 200, {'description': description})
+
+    def _describe(self, input_path):
+        _check_image(input_path)
+        try:
+            import description_pool
+        except ImportError as e:
+            raise HTTPError(501, f"Descriptions are unavailable on this server: {e}")
+        return self.description_cache.get_or_describe(input_path, description_pool.get_shared_pool().describe)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        for sock in server.sockets:
+            host, port = sock.getsockname()[:2]
+            print(f"Restyle service listening on http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _check_image(path):
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        raise HTTPError(400, "The body is not a readable image")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve restyle, describe and art style editing over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help="Restyles and descriptions run at once")
+    parser.add_argument('--queue', type=int, default=16, help="Further requests that may wait before 503s")
+    parser.add_argument('--max-upload-mb', type=int, default=DEFAULT_MAX_UPLOAD_MB)
+    parser.add_argument('--styles-file', default='art_styles.json', help="Path to the art styles JSON file")
+    parser.add_argument('--key-file', default='storage.txt', help="File containing the 'deepai-key:' line")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the API, even for repeated inputs")
+    parser.add_argument('--no-preprocess', action='store_true',
+                        help="Upload the original files without resizing or re-encoding them")
+    parser.add_argument('--log-level', default='WARNING', type=str.upper,
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), help="Level of diagnostic log messages")
+    parser.add_argument('--metrics-jsonl', default=None, help="Append a JSON line per timed stage to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    metrics.configure_logging(args.log_level)
+    # Before the process pool starts, so its workers write to the same file
+    if args.metrics_jsonl:
+        metrics.write_jsonl(args.metrics_jsonl)
+
+    # Offline styles still work without a key; remote ones are answered 503
+    api_key = restyle_engine.load_deepai_key(args.key_file)
+    if api_key:
+        deepai_client.get_client(api_key, pool_size=max(16, 2 * args.workers))
+    else:
+        logger.warning("No DeepAI API key available; only offline styles can be restyled")
+
+    service = RestyleService(
+        api_key,
+        styles_file=args.styles_file,
+        workers=args.workers,
+        queue_size=args.queue,
+        max_upload=args.max_upload_mb * 1024 ** 2,
+        cache=None if args.no_cache else result_cache.get_shared_cache(),
+        preprocessor=None if args.no_preprocess else preprocess.get_shared_preprocessor(),
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        restyle_pipelines.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+import metrics
+
+DEFAULT_CACHE_DIR = '.restyle_cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3       # 2 GB
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60     # 30 days
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(image_data, prompt, endpoint, model='default'):
+    """
+    Content-addressed cache key for one API call.
+
+    The image is hashed by content, so renamed or copied files still hit.
+    """
+    digest = hashlib.sha256()
+    for part in (endpoint, model, prompt or '', hash_bytes(image_data)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of API results keyed by make_key().
+
+    Entries live in two levels of sharded directories (ab/cd/abcd...) so no
+    single directory grows huge. Reads refresh an entry's mtime, which is
+    what the LRU eviction orders by; entries older than max_age are dropped
+    regardless of size.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def lookup(self, key):
+        """Return the path of the cached entry for key, or None on a miss."""
+        path = self.path_for(key)
+        try:
+            if self.max_age and time.time() - os.path.getmtime(path) > self.max_age:
+                self._remove(path)
+                raise FileNotFoundError(path)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            metrics.increment('cache_misses_total', cache=os.path.basename(self.root))
+            return None
+        with self._lock:
+            self.hits += 1
+        metrics.increment('cache_hits_total', cache=os.path.basename(self.root))
+        return path
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None  # Evicted between the lookup and the read
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Open a new entry for streaming writes. It only becomes visible, atomically,
+        when the block exits cleanly, so readers never see partial entries.
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                yield file
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+        self._maybe_evict()
+
+    def put(self, key, data):
+        """Store bytes under key."""
+        with self.writer(key) as file:
+            file.write(data)
+
+    def _maybe_evict(self):
+        # Scanning the whole cache is expensive, so only do it every so often
+        with self._lock:
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= 64
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def get_or_compute(self, key, compute):
+        """Return cached bytes for key, calling compute() and storing its result on a miss."""
+        data = self.get(key)
+        if data is None:
+            data = compute()
+            self.put(key, data)
+        return data
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        now = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Leftover temp files are only removed once they are clearly abandoned
+                    if now - stat.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                if self.max_age and now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hit_ratio()}
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Return the process-wide cache in DEFAULT_CACHE_DIR, created on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache()
+        return _shared_cache
@@ -0,0 +1,129 @@
+"""
+Measure how long the app takes to show its first window, and what it imports on the way.
+
+    python startup_profile.py [--runs 5] [--top 25] [-- command ...]
+    python main.py --measure-startup
+
+The command (by default this interpreter running main.py) is started with
+--exit-after-show: it creates the file named by $RESTYLE_STARTUP_READY as
+soon as the main window is on screen (a file, because windowed frozen
+builds have no stdout), then imports the modules the windows load lazily
+and exits. The time to that line is the time to first window, interpreter
+start-up included. One extra run under -X importtime gives the import cost
+of every module, split into what startup imports and what is deferred until
+a window is opened.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+READY_ENV = 'RESTYLE_STARTUP_READY'
+DEFERRED_MARKER = 'startup: deferred imports'
+# What the main menu's buttons import when clicked
+DEFERRED_MODULES = ('photo_restyler', 'gallery_window', 'art_form_editor')
+
+
+def report_ready():
+    """Called by the app once its first window is shown (under --exit-after-show)."""
+    path = os.environ.get(READY_ENV)
+    if path:
+        open(path, 'w').close()
+
+
+def import_deferred():
+    """Import the lazily loaded window modules, after a marker that separates them in -X importtime output."""
+    if sys.stderr is not None:  # None in windowed frozen builds
+        print(DEFERRED_MARKER, file=sys.stderr, flush=True)
+    for module in DEFERRED_MODULES:
+        __import__(module)
+
+
+def time_to_window(command, env=None):
+    """Seconds from starting command until it reports its first window, and its stderr."""
+    with tempfile.TemporaryDirectory(prefix='startup-') as directory:
+        ready_path = os.path.join(directory, 'ready')
+        env = {**(env or os.environ), READY_ENV: ready_path}
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+        # stderr is drained on a thread so a chatty app cannot block on a full pipe
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        reader.start()
+        elapsed = None
+        while elapsed is None and process.poll() is None:
+            if os.path.exists(ready_path):
+                elapsed = time.perf_counter() - started
+            else:
+                time.sleep(0.001)
+        if elapsed is None and os.path.exists(ready_path):
+            elapsed = time.perf_counter() - started  # Exited right after reporting
+        process.wait()
+        reader.join()
+    stderr = ''.join(stderr)
+    if process.returncode != 0 or elapsed is None:
+        raise RuntimeError(f"{command[0]} exited with {process.returncode} before showing a window:\n{stderr[-2000:]}")
+    return elapsed, stderr
+
+
+def parse_importtime(stderr):
+    """[(phase, module, self seconds, cumulative seconds)] from -X importtime output."""
+    imports, phase = [], 'startup'
+    for line in stderr.splitlines():
+        if line.strip() == DEFERRED_MARKER:
+            phase = 'deferred'
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that imported them
+        imports.append((phase, name[1:].rstrip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return imports
+
+
+def print_imports(imports, phase, top):
+    rows = [row for row in imports if row[0] == phase]
+    # Top-level imports (no indentation in the tree) add up to the phase's total
+    total = sum(cumulative for _, name, _, cumulative in rows if not name.startswith(' '))
+    print(f"\n{phase} imports: {len(rows)} modules, {total * 1000:.0f} ms")
+    print(f"  {'self ms':>8} {'total ms':>9}  module")
+    for _, name, self_seconds, cumulative in sorted(rows, key=lambda row: -row[3])[:top]:
+        print(f"  {self_seconds * 1000:8.1f} {cumulative * 1000:9.1f}  {name.strip()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time to first window and per-module import cost.")
+    parser.add_argument('--runs', type=int, default=5, help="Timed launches (the median is reported)")
+    parser.add_argument('--top', type=int, default=25, help="Most expensive imports to list per phase")
+    parser.add_argument('command', nargs='*',
+                        help="App command to measure (default: main.py with this interpreter); "
+                             "it must accept --exit-after-show")
+    args = parser.parse_args(argv)
+    if args.command:
+        command = args.command
+    elif getattr(sys, 'frozen', False):
+        command = [sys.executable]  # main.exe --measure-startup times itself
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'main.py')]
+    command = command + ['--exit-after-show']
+
+    timings = sorted(time_to_window(command)[0] for _ in range(args.runs))
+    print(f"time to first window: median {timings[len(timings) // 2] * 1000:.0f} ms, "
+          f"min {timings[0] * 1000:.0f} ms, max {timings[-1] * 1000:.0f} ms over {args.runs} runs")
+
+    # Import times only exist for a Python interpreter; frozen builds only get the timing above
+    if not getattr(sys, 'frozen', False) and os.path.basename(command[0]).startswith('python'):
+        _, stderr = time_to_window(command, env={**os.environ, 'PYTHONPROFILEIMPORTTIME': '1'})
+        imports = parse_importtime(stderr)
+        print_imports(imports, 'startup', args.top)
+        print_imports(imports, 'deferred', args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Art style storage behind json_handler.
+
+Two backends with the same interface:
+
+    JsonStyleStore    the classic art_styles.json list. Parsed lazily on
+                      first use into a name index, re-read only when the
+                      file's mtime or size changes, written atomically.
+                      Every edit rewrites the whole file.
+    SqliteStyleStore  one row per style in an SQLite database, so an edit
+                      writes only the style that changed.
+
+get_store() hands out one shared store per file, and it is always SQLite:
+a .json style file is imported on first use into the database next to it
+(art_styles.json into art_styles.db), where styles are then read and
+edited. Edits made to the JSON file later are merged in (see
+SqliteStyleStore); edits made through the store stay in the database.
+JsonStyleStore is only used when the database cannot be opened, e.g. in a
+read-only directory.
+"""
+import os
+import json
+import logging
+import sqlite3
+import tempfile
+import threading
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+logger = logging.getLogger(__name__)
+
+
+def file_stamp(filename):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class JsonStyleStore:
+    """Art styles in a JSON list of {"name": ..., "description": ...} dicts."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._styles = None   # name -> style dict, in file order
+        self._stamp = None    # (mtime_ns, size) of the file when it was read
+        self._lock = threading.RLock()
+
+    def _file_stamp(self):
+        return file_stamp(self.filename)
+
+    def _load(self):
+        """Return the name index, re-reading the file only if it changed on disk."""
+        stamp = self._file_stamp()
+        if self._styles is not None and stamp == self._stamp:
+            return self._styles
+
+        styles = {}
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            logger.warning("The JSON file %s was not found.", self.filename)
+            data = []
+        except json.JSONDecodeError:
+            logger.error("Error decoding the JSON file %s.", self.filename)
+            data = []
+        if not isinstance(data, list):
+            logger.error("Unexpected data format in %s: %r", self.filename, data)
+            data = []
+        for style in data:
+            # The first entry wins if a name appears twice, as it did for the old linear scans
+            if isinstance(style, dict) and 'name' in style:
+                styles.setdefault(style['name'], style)
+
+        self._styles, self._stamp = styles, stamp
+        return styles
+
+    def _save(self, styles):
+        """Write the whole list to a temporary file and atomically swap it in."""
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(list(styles.values()), file, indent=4)
+            os.replace(temp_path, self.filename)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._styles, self._stamp = styles, self._file_stamp()
+
+    def names(self):
+        with self._lock:
+            return list(self._load())
+
+    def all(self):
+        with self._lock:
+            return [dict(style) for style in self._load().values()]
+
+    def get(self, name):
+        """The style dict for name, or None."""
+        with self._lock:
+            style = self._load().get(name)
+            return dict(style) if style is not None else None
+
+    def put(self, style):
+        """Add a style, or replace the one with the same name in place."""
+        with self._lock:
+            styles = dict(self._load())
+            styles[style['name']] = dict(style)
+            self._save(styles)
+
+    def update(self, name, **fields):
+        """Change fields of an existing style; returns False if there is no such style."""
+        with self._lock:
+            styles = dict(self._load())
+            if name not in styles:
+                return False
+            styles[name] = {**styles[name], **fields}
+            self._save(styles)
+            return True
+
+    def remove(self, name):
+        with self._lock:
+            styles = dict(self._load())
+            if styles.pop(name, None) is not None:
+                self._save(styles)
+
+
+class SqliteStyleStore:
+    """
+    Art styles as rows of an SQLite table keyed by name.
+
+    The whole style dict is kept as JSON next to its name, so styles keep
+    any extra fields (such as "pipeline"). Rows keep their insertion order.
+
+    With import_from (a JSON style file) the store follows that file: the
+    styles it held when last imported are kept in the database, and when
+    its mtime or size changes, the styles it added or changed since then
+    are written over the stored ones and the styles it dropped are removed
+    (unless edited through the store in the meantime). Styles the file did
+    not touch keep any edits made through the store.
+    """
+
+    def __init__(self, filename, import_from=None):
+        self.filename = filename
+        self.import_from = import_from
+        self._import_stamp = None  # (mtime_ns, size) of import_from when last checked
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS styles (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, data TEXT NOT NULL)"
+        )
+        # The styles of import_from as of its last import, and the file stamp they were read at
+        self._connection.execute("CREATE TABLE IF NOT EXISTS imported (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._sync()
+
+    def close(self):
+        self._connection.close()
+
+    def _sync(self):
+        """Merge the changes made to import_from since it was last imported."""
+        if not self.import_from:
+            return
+        stamp = file_stamp(self.import_from)
+        if stamp is None or stamp == self._import_stamp:
+            return
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = 'import_stamp'").fetchone()
+            if row is None or row[0] != json.dumps(stamp):
+                self._merge({style['name']: json.dumps(style) for style in JsonStyleStore(self.import_from).all()})
+                self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('import_stamp', ?)",
+                                         (json.dumps(stamp),))
+        self._import_stamp = stamp
+
+    def _merge(self, current):
+        # Called with the lock held, inside a transaction
+        previous = dict(self._connection.execute("SELECT name, data FROM imported"))
+        if not previous:
+            # First import (or a database seeded before imports were recorded): only add what is missing
+            self._connection.executemany("INSERT OR IGNORE INTO styles (name, data) VALUES (?, ?)", current.items())
+        else:
+            self._connection.executemany(
+                "INSERT INTO styles (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                [(name, data) for name, data in current.items() if previous.get(name) != data],
+            )
+            self._connection.executemany("DELETE FROM styles WHERE name = ? AND data = ?",
+                                         [(name, data) for name, data in previous.items() if name not in current])
+        self._connection.execute("DELETE FROM imported")
+        self._connection.executemany("INSERT INTO imported (name, data) VALUES (?, ?)", current.items())
+
+    def _query(self, sql, parameters=()):
+        self._sync()
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _write(self, sql, parameters=()):
+        self._sync()
+        # The connection as a context manager commits, or rolls back on an error
+        with self._lock, self._connection:
+            self._connection.execute(sql, parameters)
+
+    def names(self):
+        return [name for name, in self._query("SELECT name FROM styles ORDER BY id")]
+
+    def all(self):
+        return [json.loads(data) for data, in self._query("SELECT data FROM styles ORDER BY id")]
+
+    def get(self, name):
+        rows = self._query("SELECT data FROM styles WHERE name = ?", (name,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def put(self, style):
+        self._write(
+            "INSERT INTO styles (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+            (style['name'], json.dumps(style)),
+        )
+
+    def update(self, name, **fields):
+        self._sync()
+        with self._lock, self._connection:
+            rows = self._connection.execute("SELECT data FROM styles WHERE name = ?", (name,)).fetchall()
+            if not rows:
+                return False
+            style = {**json.loads(rows[0][0]), **fields}
+            self._connection.execute("UPDATE styles SET data = ? WHERE name = ?", (json.dumps(style), name))
+            return True
+
+    def remove(self, name):
+        self._write("DELETE FROM styles WHERE name = ?", (name,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(filename='art_styles.json'):
+    """
+    Return the shared store for a style file: an SQLite database that
+    follows the JSON file next to it, if any (see the module docstring).
+    """
+    path = os.path.abspath(filename)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            if path.lower().endswith(SQLITE_EXTENSIONS):
+                database, json_path = path, os.path.splitext(path)[0] + '.json'
+            else:
+                database, json_path = os.path.splitext(path)[0] + '.db', path
+            try:
+                store = SqliteStyleStore(database, import_from=json_path)
+            except sqlite3.Error as e:
+                logger.warning("Cannot open the style database %s (%s); editing %s directly.", database, e, path)
+                store = JsonStyleStore(path)
+            _stores[path] = store
+        return store
@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+
+# The modules live at the repository root and the stand-ins in benchmarks/, as the scripts there expect
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture
+def fake_deepai(monkeypatch):
+    """A FakeDeepAIServer that the shared client for its api_key talks to."""
+    import deepai_client
+    from fake_deepai import FakeDeepAIServer
+    server = FakeDeepAIServer().start()
+    monkeypatch.setattr(deepai_client, '_clients', {})
+    server.api_key = 'test-key'
+    deepai_client.get_client(server.api_key, base_url=server.base_url, backoff_base=0.01, backoff_max=0.05)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_images(tmp_path):
+    """Write distinct noisy images at paths relative to tmp_path and return their full paths."""
+    import numpy as np
+    from PIL import Image
+
+    def make(*names, size=(96, 64), seed=0):
+        rng = np.random.default_rng(seed)
+        paths = []
+        for name in names:
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Coarse blocks, so resized copies still hash alike but different images do not
+            blocks = (rng.random((size[1] // 8, size[0] // 8, 3)) * 255).astype(np.uint8)
+            Image.fromarray(np.kron(blocks, np.ones((8, 8, 1), dtype=np.uint8))).save(path)
+            paths.append(str(path))
+        return paths
+    return make
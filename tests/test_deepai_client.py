@@ -0,0 +1,168 @@
+import time
+import types
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import deepai_client
+from deepai_client import DeepAIClient, DeepAIError, MultipartBody, TokenBucket, backoff_delay
+from fake_deepai import FakeDeepAIServer
+
+
+@pytest.fixture
+def server():
+    server = FakeDeepAIServer().start()
+    yield server
+    server.stop()
+
+
+def make_client(server, **options):
+    options = {'backoff_base': 0.01, 'backoff_max': 0.05, **options}
+    client = DeepAIClient('test-key', base_url=server.base_url, **options)
+    # Record every backoff the client chooses
+    client.delays = []
+    choose = client._backoff
+
+    def backoff(attempt, retry_after=None):
+        delay = choose(attempt, retry_after)
+        client.delays.append((attempt, retry_after, delay))
+        return delay
+    client._backoff = backoff
+    return client
+
+
+def test_restyle_and_fetch_round_trip(server):
+    client = make_client(server)
+    url = client.restyle(b'image bytes', "a prompt")
+    assert client.fetch(url) == b'image bytes'
+    assert client.retries == 0
+
+
+def test_retries_5xx_with_growing_backoff(server):
+    server.statuses.extend([503, 502, 500])
+    client = make_client(server)
+    url = client.upscale(b'pixels')
+    assert client.fetch(url) == b'pixels'
+    assert server.calls['waifu2x'] == 4
+    assert client.retries == 3
+    assert [attempt for attempt, _, _ in client.delays] == [0, 1, 2]
+    for attempt, _, delay in client.delays:
+        assert 0 <= delay <= min(client.backoff_max, client.backoff_base * 2 ** attempt)
+
+
+def test_gives_up_after_max_retries(server):
+    server.error_rate = 1.0
+    client = make_client(server, max_retries=2)
+    with pytest.raises(DeepAIError, match="failed after 3 attempts: HTTP 503"):
+        client.restyle(b'image', "prompt")
+    assert server.calls['image-editor'] == 3
+
+
+def test_client_errors_are_not_retried(server):
+    server.statuses.append(400)
+    client = make_client(server)
+    with pytest.raises(DeepAIError, match="status 400"):
+        client.restyle(b'image', "prompt")
+    assert server.calls['image-editor'] == 1
+    assert client.retries == 0
+
+
+def test_429_waits_for_retry_after(server):
+    server.statuses.append(429)
+    server.retry_after = 0.3
+    client = make_client(server)
+    start = time.perf_counter()
+    client.restyle(b'image', "prompt")
+    assert time.perf_counter() - start >= 0.3
+    assert server.calls['image-editor'] == 2
+    assert client.delays == [(0, '0.3', pytest.approx(0.3))]
+
+
+def test_backoff_delay_never_undercuts_retry_after():
+    assert backoff_delay(0, 0.01, 1.0, retry_after='2') == 2.0
+    assert backoff_delay(10, 0.5, 1.0) <= 1.0
+    # The HTTP-date form falls back to the jittered delay
+    assert backoff_delay(0, 0.01, 1.0, retry_after='Wed, 21 Oct 2015 07:28:00 GMT') <= 0.01
+
+
+def test_token_bucket_allows_a_burst_then_paces_at_the_rate():
+    bucket = TokenBucket(rate=20, capacity=5)
+    start = time.perf_counter()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.perf_counter() - start < 0.05
+    for _ in range(6):
+        bucket.acquire()
+    # Six more tokens at 20 per second take about 0.3s
+    assert 0.25 <= time.perf_counter() - start < 0.6
+
+
+def test_token_bucket_is_shared_between_threads():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 tokens with a burst of one: 19 have to wait 1/50s each
+    assert time.perf_counter() - start >= 19 / 50 * 0.9
+
+
+def test_rate_limit_paces_api_calls(server):
+    client = make_client(server, rate_limit=10, burst=1)
+    start = time.perf_counter()
+    for _ in range(4):
+        client.restyle(b'image', "prompt")
+    assert time.perf_counter() - start >= 0.3 * 0.9
+
+
+def test_multipart_body_matches_requests(monkeypatch):
+    image, prompt = bytes(range(256)) * 300, "Pencil sketch, soft shading".encode('utf-8')
+    prepared = requests.Request('POST', 'http://deepai.invalid/api/image-editor', files=[
+        ('image', ('image', image, 'application/octet-stream')),
+        ('text', ('prompt.txt', prompt, 'application/octet-stream')),
+    ]).prepare()
+    boundary = prepared.headers['Content-Type'].split('boundary=')[1]
+    monkeypatch.setattr(deepai_client.uuid, 'uuid4', lambda: types.SimpleNamespace(hex=boundary))
+
+    body = MultipartBody([('image', 'image', memoryview(image)), ('text', 'prompt.txt', prompt)])
+    assert body.content_type == prepared.headers['Content-Type']
+    assert len(body) == len(prepared.body)
+    streamed = b''.join(iter(lambda: body.read(1000), b''))
+    assert streamed == prepared.body
+    # A retry rewinds and sends the same bytes again
+    body.seek(0)
+    assert b''.join(body) == prepared.body
+    assert body.sent_at is not None
+    body.close()
+
+
+class _HtmlHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'<html><body>Maintenance</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_non_json_success_raises_deepai_error():
+    html_server = ThreadingHTTPServer(('127.0.0.1', 0), _HtmlHandler)
+    thread = threading.Thread(target=html_server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = html_server.server_address[:2]
+        client = DeepAIClient('test-key', base_url=f"http://{host}:{port}/api")
+        with pytest.raises(DeepAIError, match=r"status 200, not JSON.*Maintenance"):
+            client.restyle(b'image', "prompt")
+    finally:
+        html_server.shutdown()
+        html_server.server_close()
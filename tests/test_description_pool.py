@@ -0,0 +1,105 @@
+import time
+import pytest
+from PIL import Image
+
+pytest.importorskip('playwright.async_api')
+
+import description_pool
+from description_pool_bench import STAND_IN_PAGE, stand_in_url
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (64, 48), 'teal').save(path)
+    return str(path)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(url=None, **options):
+        options = {'timeout': 5000, **options}
+        pool = description_pool.DescriptionBrowserPool(url=url or stand_in_url(20, 20), **options)
+        pools.append(pool)
+        return pool
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def start(pool):
+    try:
+        pool.start()
+    except Exception as e:
+        if "Executable doesn't exist" in str(e):
+            pytest.skip("Chromium is not installed (playwright install chromium)")
+        raise
+
+
+def test_describes_on_the_stand_in_page(make_pool, photo):
+    pool = make_pool(size=1)
+    start(pool)
+    steps = []
+    assert pool.describe(photo, on_step=lambda percent, text: steps.append(percent)) == \
+        "A stand-in description of photo.jpg."
+    assert steps == [20, 60, 80, 90]
+
+
+def test_waits_for_the_page_instead_of_a_fixed_sleep(make_pool, photo):
+    pool = make_pool(url=stand_in_url(200, 300), size=1)
+    start(pool)
+    began = time.perf_counter()
+    pool.describe(photo)
+    # The page takes 0.5s; the old code slept 2s before even uploading
+    assert 0.5 <= time.perf_counter() - began < 2.0
+
+
+def test_pages_are_recycled_after_max_uses(make_pool, photo):
+    pool = make_pool(size=1, max_uses=2)
+    start(pool)
+    for _ in range(5):
+        assert pool.describe(photo) == "A stand-in description of photo.jpg."
+
+
+def test_describe_all_spreads_images_over_the_pages(make_pool, tmp_path):
+    paths = []
+    for index in range(4):
+        path = tmp_path / f"image{index}.png"
+        Image.new('RGB', (16, 16), (index * 60, 0, 0)).save(path)
+        paths.append(str(path))
+    finished = []
+    pool = make_pool(size=2)
+    start(pool)
+    results = pool.describe_all(paths, on_result=lambda path, result: finished.append(path))
+    assert results == {path: f"A stand-in description of image{index}.png." for index, path in enumerate(paths)}
+    assert sorted(finished) == sorted(paths)
+
+
+def test_a_description_that_never_comes_times_out(make_pool, photo):
+    pool = make_pool(url=f"{STAND_IN_PAGE.resolve().as_uri()}?upload_ms=10&fail=1", size=1, timeout=1000)
+    start(pool)
+    with pytest.raises(Exception, match="Timeout"):
+        pool.describe(photo)
+
+
+def test_a_crashed_page_is_replaced(make_pool, photo):
+    pool = make_pool(size=2)
+    start(pool)
+
+    async def close_pages():
+        for slot in list(pool._pages._queue):
+            await slot.page.close()
+    pool._call(close_pages())
+    assert pool.describe_all([photo, photo]) == {photo: "A stand-in description of photo.jpg."}
+    assert pool.describe(photo) == "A stand-in description of photo.jpg."
+
+
+def test_start_can_be_retried_after_a_failure(make_pool, photo, tmp_path):
+    pool = make_pool(url=(tmp_path / 'missing.html').as_uri(), size=1)
+    with pytest.raises(Exception):
+        start(pool)
+    pool.url = stand_in_url(20, 20)
+    start(pool)
+    assert pool.describe(photo) == "A stand-in description of photo.jpg."
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from PIL import Image
+from restyle_pipelines import hand_drawn
+
+
+def textured_photo(height, width, seed=0):
+    """Gradients plus noise, so CONTOUR and DETAIL have edges to work on."""
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[..., 0] = x
+    rgb[..., 1] = y
+    rgb[..., 2] = (x + y) % 256
+    rgb += rng.integers(0, 32, size=(height, width, 3), dtype=np.uint8)
+    return rgb
+
+
+def shared_noise(height, width, seed=1):
+    noise = 128 + hand_drawn.NOISE_SIGMA * np.random.default_rng(seed).standard_normal((height, width))
+    return np.clip(noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('size', [(1, 1), (7, 5), (333, 517), (600, 401)])
+def test_numpy_engine_matches_pillow(size):
+    height, width = size
+    rgb, noise = textured_photo(height, width), shared_noise(height, width)
+    reference = np.asarray(hand_drawn.hand_drawn_pillow(Image.fromarray(rgb), Image.fromarray(noise)), dtype=np.int16)
+    result = hand_drawn.hand_drawn_numpy(rgb, noise=noise)
+    assert result.shape == rgb.shape and result.dtype == np.uint8
+    difference = np.abs(reference - result)
+    # Rounding differs slightly between Pillow's fixed-point filters and the integer passes
+    assert difference.max() <= 2
+    assert difference.mean() < 0.5
+
+
+def test_band_size_does_not_change_the_result():
+    rgb, noise = textured_photo(250, 180), shared_noise(250, 180)
+    whole = hand_drawn.hand_drawn_numpy(rgb, noise=noise, band_rows=1000)
+    for band_rows in (1, 7, 64):
+        assert np.array_equal(hand_drawn.hand_drawn_numpy(rgb, noise=noise, band_rows=band_rows), whole)
+
+
+def test_blending_in_place_matches_a_new_output():
+    rgb, noise = textured_photo(120, 90), shared_noise(120, 90)
+    expected = hand_drawn.hand_drawn_numpy(rgb, noise=noise)
+    in_place = rgb.copy()
+    assert hand_drawn.hand_drawn_numpy(in_place, noise=noise, out=in_place) is in_place
+    assert np.array_equal(in_place, expected)
+
+
+def test_seeded_noise_is_reproducible():
+    rgb = textured_photo(64, 64)
+    assert np.array_equal(hand_drawn.hand_drawn_numpy(rgb, seed=3), hand_drawn.hand_drawn_numpy(rgb, seed=3))
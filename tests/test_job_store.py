@@ -0,0 +1,65 @@
+import pytest
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), max_attempts=2)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def output(tmp_path):
+    path = tmp_path / 'a_restyled.jpg'
+    path.write_bytes(b'result')
+    return str(path)
+
+
+def test_progress_is_kept_between_attempts(store):
+    record = store.start('/photos/a.jpg', 'Sketch')
+    store.advance(record.id, 'restyled', restyle_key='k1', restyled_url='http://x/1.jpg')
+    store.fail(record.id, "upscale: HTTP 503")
+    record = store.start('/photos/a.jpg', 'Sketch')
+    assert (record.state, record.progress, record.attempts) == ('restyled', 'restyled', 1)
+    assert (record.restyle_key, record.restyled_url) == ('k1', 'http://x/1.jpg')
+
+
+def test_only_failures_use_up_attempts(store):
+    for _ in range(3):
+        # A run that dies mid-image never calls fail()
+        assert store.start('/photos/a.jpg', 'Sketch').attempts == 0
+    record = store.start('/photos/a.jpg', 'Sketch')
+    store.fail(record.id, "boom")
+    store.fail(store.start('/photos/a.jpg', 'Sketch').id, "boom")
+    assert store.start('/photos/a.jpg', 'Sketch') is None
+    assert store.counts('Sketch') == {'failed': 1}
+    assert store.retry_failed('Sketch') == 1
+    assert store.start('/photos/a.jpg', 'Sketch').attempts == 0
+
+
+def test_done_rows_are_skipped_while_their_result_exists(store, output):
+    record = store.start('/photos/a.jpg', 'Sketch', output, prompt_hash='p1')
+    store.advance(record.id, 'done', output_path=output)
+    assert store.start('/photos/a.jpg', 'Sketch', output, prompt_hash='p1') is None
+    # Styles are separate rows
+    assert store.start('/photos/a.jpg', 'Oil', output, prompt_hash='p1').state == 'pending'
+
+
+def test_done_rows_start_over_when_the_result_is_gone_or_wanted_elsewhere(store, output, tmp_path):
+    record = store.start('/photos/a.jpg', 'Sketch', output, prompt_hash='p1')
+    store.advance(record.id, 'done', output_path=output)
+    record = store.start('/photos/a.jpg', 'Sketch', str(tmp_path / 'other.jpg'), prompt_hash='p1')
+    assert (record.state, record.output_path) == ('pending', None)
+
+    store.advance(record.id, 'done', output_path=output)
+    (tmp_path / 'a_restyled.jpg').unlink()
+    assert store.start('/photos/a.jpg', 'Sketch', output, prompt_hash='p1').state == 'pending'
+
+
+def test_a_changed_prompt_starts_over(store):
+    record = store.start('/photos/a.jpg', 'Sketch', prompt_hash='p1')
+    store.advance(record.id, 'restyled', restyle_key='k1', restyled_url='http://x/1.jpg')
+    store.fail(record.id, "boom")
+    record = store.start('/photos/a.jpg', 'Sketch', prompt_hash='p2')
+    assert (record.progress, record.attempts, record.restyle_key, record.prompt_hash) == ('pending', 0, None, 'p2')
@@ -0,0 +1,65 @@
+import os
+import pytest
+from PIL import Image
+import job_store
+import phash_index
+from restyle_engine import RestyleEngine
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = phash_index.PHashIndex(str(tmp_path / 'phash.db'))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def photos(make_images, tmp_path):
+    """Two different images plus a half-size copy of the first."""
+    first, second = make_images('a.jpg', 'b.jpg', size=(192, 128))
+    copy = str(tmp_path / 'a_small.jpg')
+    Image.open(first).resize((96, 64)).save(copy)
+    return first, copy, second
+
+
+def test_resized_copies_are_grouped(index, photos):
+    first, copy, second = photos
+    assert index.refresh(photos) == 3
+    assert index.refresh(photos) == 0  # Unchanged files are not hashed again
+    assert index.groups(photos) == {os.path.abspath(first): [os.path.abspath(copy)], os.path.abspath(second): []}
+
+
+def test_find_result_never_returns_the_images_own_result(index, photos, tmp_path):
+    first, copy, second = photos
+    index.refresh(photos)
+    output = tmp_path / 'a_restyled.jpg'
+    output.write_bytes(b'result')
+    index.record_result(first, 'style', str(output))
+    assert index.find_result(first, 'style') is None
+    assert index.find_result(copy, 'style') == (os.path.abspath(first), str(output))
+    assert index.find_result(copy, 'style', exclude=[first]) is None
+    assert index.find_result(copy, 'other style') is None
+    output.unlink()
+    assert index.find_result(copy, 'style') is None
+
+
+def test_near_duplicates_share_one_restyle(fake_deepai, photos, tmp_path):
+    def run():
+        store = job_store.JobStore(str(tmp_path / 'jobs.db'))
+        dedup = phash_index.PHashIndex(str(tmp_path / 'phash.db'))
+        engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), job_store=store,
+                               style='S', dedup=dedup)
+        report = engine.run(list(photos))
+        return report, sum(1 for job in engine.completed if job.reused_from)
+
+    report, reused = run()
+    assert (report['completed'], reused) == (3, 1)
+    assert fake_deepai.calls['image-editor'] == 2
+    # A rerun of the finished batch skips every image instead of reusing its own result
+    report, reused = run()
+    assert (report['completed'], report['skipped'], reused) == (0, 3, 0)
+    # A deleted result is restyled again, and only that one
+    os.remove(tmp_path / 'out' / 'b_restyled.jpg')
+    report, reused = run()
+    assert (report['completed'], report['skipped']) == (1, 2)
+    assert fake_deepai.calls['image-editor'] == 3
@@ -0,0 +1,106 @@
+import os
+import pytest
+import deepai_client
+import job_store
+import result_cache
+from restyle_engine import OutputCollision, RestyleEngine, output_names
+
+
+def test_output_names_are_relative_to_the_common_folder(tmp_path):
+    paths = [str(tmp_path / 'trip' / 'beach.jpg'), str(tmp_path / 'home' / 'beach.jpg'), str(tmp_path / 'cat.png')]
+    assert output_names(paths) == {
+        paths[0]: os.path.join('trip', 'beach'),
+        paths[1]: os.path.join('home', 'beach'),
+        paths[2]: 'cat',
+    }
+
+
+def test_output_names_keep_the_extension_when_only_it_differs(tmp_path):
+    paths = [str(tmp_path / 'beach.png'), str(tmp_path / 'beach.jpg'), str(tmp_path / 'sea.jpg')]
+    assert output_names(paths) == {paths[0]: 'beach_png', paths[1]: 'beach_jpg', paths[2]: 'sea'}
+
+
+def test_output_names_refuse_collisions(tmp_path):
+    with pytest.raises(OutputCollision, match="listed more than once"):
+        output_names([str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg'), str(tmp_path / 'a.jpg')])
+    with pytest.raises(OutputCollision, match="would both be written as beach_png"):
+        output_names([str(tmp_path / 'beach.png'), str(tmp_path / 'beach.jpg'), str(tmp_path / 'beach_png.bmp')])
+
+
+def test_output_collision_is_a_value_error():
+    assert issubclass(OutputCollision, ValueError)
+
+
+def test_same_named_images_get_their_own_results(fake_deepai, make_images, tmp_path):
+    paths = make_images('trip/beach.jpg', 'home/beach.jpg', 'beach.png')
+    output_dir = str(tmp_path / 'out')
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=output_dir, workers={'restyle': 2})
+    report = engine.run(paths)
+    assert report['completed'] == 3 and report['failed'] == 0
+    outputs = [os.path.join(output_dir, name) for name in
+               (os.path.join('trip', 'beach_restyled.jpg'), os.path.join('home', 'beach_restyled.jpg'),
+                'beach_restyled.jpg')]
+    assert all(os.path.exists(path) for path in outputs)
+    assert len({open(path, 'rb').read() for path in outputs}) == 3
+
+
+def test_run_stops_before_calling_deepai_on_a_collision(fake_deepai, make_images, tmp_path):
+    paths = make_images('a.jpg')
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'))
+    with pytest.raises(OutputCollision):
+        engine.run(paths + paths)
+    assert fake_deepai.calls['image-editor'] == 0
+
+
+def test_run_without_upscaling(fake_deepai, make_images, tmp_path):
+    paths = make_images('a.jpg', 'b.jpg')
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), upscale=False)
+    assert engine.run(paths)['completed'] == 2
+    assert fake_deepai.calls == {'image-editor': 2, 'waifu2x': 0}
+
+
+def test_a_rerun_resumes_after_the_last_finished_step(fake_deepai, make_images, tmp_path):
+    (path,) = make_images('a.jpg')
+    store = job_store.JobStore(str(tmp_path / 'jobs.db'))
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), job_store=store, style='S')
+    # As if a run had died after a paid restyle call
+    record = store.start(os.path.abspath(path), 'S', prompt_hash=engine.prompt_hash)
+    with open(path, 'rb') as file:
+        url = deepai_client.get_client(fake_deepai.api_key).restyle(file.read(), "prompt")
+    store.advance(record.id, 'restyled', restyle_key='k', restyled_url=url)
+
+    assert engine.run([path])['completed'] == 1
+    assert fake_deepai.calls == {'image-editor': 1, 'waifu2x': 1}
+    assert store.get(os.path.abspath(path), 'S').state == 'done'
+    # Finished images are skipped on the next run
+    report = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), job_store=store,
+                           style='S').run([path])
+    assert (report['completed'], report['skipped']) == (0, 1)
+
+
+def test_a_step_saved_after_an_evicted_cache_hit_is_redone(fake_deepai, make_images, tmp_path):
+    paths = make_images('a.jpg', 'b.jpg')
+    store = job_store.JobStore(str(tmp_path / 'jobs.db'))
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), job_store=store,
+                           style='S', cache=cache)
+    # Steps checkpointed after cache hits carry no URL; these keys are not in the cache any more
+    for path, state in zip(paths, ('restyled', 'upscaled')):
+        record = store.start(os.path.abspath(path), 'S', prompt_hash=engine.prompt_hash)
+        store.advance(record.id, 'restyled', restyle_key='evicted', restyled_url=None)
+        if state == 'upscaled':
+            store.advance(record.id, 'upscaled', upscale_key='evicted too', result_url=None)
+
+    report = engine.run(paths)
+    assert (report['completed'], report['failed']) == (2, 0)
+    assert fake_deepai.calls == {'image-editor': 2, 'waifu2x': 2}
+
+
+def test_descriptions_are_written_next_to_the_results(fake_deepai, make_images, tmp_path):
+    paths = make_images('a.jpg', 'b.jpg')
+    store = job_store.JobStore(str(tmp_path / 'jobs.db'))
+    engine = RestyleEngine(fake_deepai.api_key, "prompt", output_dir=str(tmp_path / 'out'), job_store=store,
+                           style='S', describer=lambda path: f"About {os.path.basename(path)}")
+    assert engine.run(paths)['completed'] == 2
+    assert (tmp_path / 'out' / 'a_restyled.txt').read_text(encoding='utf-8') == "About a.jpg"
+    assert store.get(os.path.abspath(paths[1]), 'S').description == "About b.jpg"
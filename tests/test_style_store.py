@@ -0,0 +1,91 @@
+import os
+import json
+import sqlite3
+import itertools
+import pytest
+import style_store
+from style_store import JsonStyleStore, SqliteStyleStore
+
+
+_seconds = itertools.count(1)
+
+
+def write_styles(path, styles):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(styles, file)
+    # Make sure every write gets a new stamp, however coarse the file system's clock
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + next(_seconds) * 1_000_000_000))
+
+
+@pytest.fixture
+def json_path(tmp_path):
+    path = str(tmp_path / 'art_styles.json')
+    write_styles(path, [{"name": "Sketch", "description": "pencil"}, {"name": "Oil", "description": "oil paint"}])
+    return path
+
+
+@pytest.mark.parametrize('backend', [JsonStyleStore, SqliteStyleStore])
+def test_lookups_and_edits(backend, tmp_path):
+    filename = str(tmp_path / ('styles.json' if backend is JsonStyleStore else 'styles.db'))
+    store = backend(filename)
+    store.put({"name": "Sketch", "description": "pencil", "pipeline": "local"})
+    store.put({"name": "Oil", "description": "oil"})
+    assert store.update('Oil', description="oil paint")
+    assert not store.update('Missing', description="x")
+    store.remove('Sketch')
+    store.put({"name": "Sketch", "description": "charcoal"})
+    assert store.names() == ['Oil', 'Sketch']
+    assert store.get('Oil') == {"name": "Oil", "description": "oil paint"}
+    assert store.get('Missing') is None
+
+
+def test_json_is_imported_into_the_database_next_to_it(json_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(style_store, '_stores', {})
+    store = style_store.get_store(json_path)
+    assert isinstance(store, SqliteStyleStore)
+    assert store.filename == str(tmp_path / 'art_styles.db')
+    assert store.names() == ['Sketch', 'Oil']
+    assert style_store.get_store(json_path) is store
+
+
+def test_later_json_edits_are_merged_with_edits_made_in_the_app(json_path, tmp_path):
+    store = SqliteStyleStore(str(tmp_path / 'art_styles.db'), import_from=json_path)
+    store.update('Sketch', description="pencil, edited in the app")
+    store.put({"name": "Mine", "description": "added in the app"})
+
+    write_styles(json_path, [{"name": "Sketch", "description": "pencil"}, {"name": "Oil", "description": "oil, v2"},
+                             {"name": "Watercolor", "description": "new in the JSON"}])
+    assert store.all() == [
+        {"name": "Sketch", "description": "pencil, edited in the app"},
+        {"name": "Oil", "description": "oil, v2"},
+        {"name": "Mine", "description": "added in the app"},
+        {"name": "Watercolor", "description": "new in the JSON"},
+    ]
+    # Styles dropped from the JSON go too, unless they were edited in the app
+    write_styles(json_path, [{"name": "Watercolor", "description": "new in the JSON"}])
+    assert store.names() == ['Sketch', 'Mine', 'Watercolor']
+
+
+def test_styles_deleted_in_the_app_stay_deleted(json_path, tmp_path):
+    database = str(tmp_path / 'art_styles.db')
+    store = SqliteStyleStore(database, import_from=json_path)
+    store.remove('Sketch')
+    store.remove('Oil')
+    store.close()
+    assert SqliteStyleStore(database, import_from=json_path).names() == []
+
+
+def test_a_database_seeded_before_merging_gets_the_missing_styles(json_path, tmp_path):
+    database = str(tmp_path / 'art_styles.db')
+    connection = sqlite3.connect(database)
+    connection.execute("CREATE TABLE styles (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, data TEXT NOT NULL)")
+    connection.execute("INSERT INTO styles (name, data) VALUES (?, ?)",
+                       ('Sketch', json.dumps({"name": "Sketch", "description": "edited earlier"})))
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+    connection.close()
+    assert SqliteStyleStore(database, import_from=json_path).all() == [
+        {"name": "Sketch", "description": "edited earlier"},
+        {"name": "Oil", "description": "oil paint"},
+    ]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from PIL import Image
+import workspace
+from restyle_pipelines import local_filters, tiled
+
+
+def photo(height=301, width=211, seed=0):
+    rng = np.random.default_rng(seed)
+    rgb = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+    rgb[:, : width // 2] //= 2  # An edge for the filters to find
+    return rgb
+
+
+@pytest.fixture
+def buffers():
+    with workspace.JobWorkspace(prefix='tiled-test-') as job_workspace:
+        yield tiled.MemmapBuffers(job_workspace)
+
+
+@pytest.mark.parametrize('name, mode, options, strip_decoded', [
+    ('rgb.bmp', 'RGB', {}, True),
+    ('rgba.bmp', 'RGBA', {}, True),
+    ('gray.bmp', 'L', {}, True),
+    ('rgb.ppm', 'RGB', {}, True),
+    ('strips.tif', 'RGB', {'tiffinfo': {278: 37}}, True),  # 37 rows per strip
+    ('rgb.png', 'RGB', {}, False),
+    ('rgb.jpg', 'RGB', {'quality': 95}, False),
+])
+def test_staged_input_matches_a_full_decode(buffers, tmp_path, monkeypatch, name, mode, options, strip_decoded):
+    monkeypatch.setattr(tiled, 'STRIP_ROWS', 64)
+    path = str(tmp_path / name)
+    rgb = photo()
+    Image.fromarray(rgb).convert(mode).save(path, **options)
+    with Image.open(path) as image:
+        assert (tiled._raw_bands(image) is not None) == strip_decoded
+        expected = np.asarray(image.convert('RGB'))
+    source = tiled.stage_input(path, buffers)
+    assert np.array_equal(tiled._open_source(source), expected)
+
+
+def test_npy_inputs_are_mapped_in_place(buffers, tmp_path):
+    path = str(tmp_path / 'big.npy')
+    np.save(path, photo())
+    assert tiled.stage_input(path, buffers) == ('npy', path)
+
+
+@pytest.mark.parametrize('steps, tolerance', [
+    ([('posterize', {}), ('oil_paint', {'radius': 4})], 0),
+    ([('sketch', {'blur_radius': 3}), ('halftone', {'cell': 8})], 0),
+    # Pillow's unsharp mask rounds a few pixels differently at the window edges
+    ([('upscale', {'scale': 2})], 1),
+])
+def test_tiles_stitch_into_the_whole_image_result(tmp_path, steps, tolerance):
+    path = str(tmp_path / 'input.png')
+    Image.fromarray(photo()).save(path)
+    whole, tiles = str(tmp_path / 'whole.png'), str(tmp_path / 'tiles.png')
+    local_filters.apply_steps(path, whole, steps)
+    tiled.apply_steps_tiled(path, tiles, steps, tile_size=64, workers=1)
+    difference = np.abs(np.asarray(Image.open(tiles).convert('RGB'), dtype=np.int16) -
+                        np.asarray(Image.open(whole).convert('RGB')))
+    assert difference.max() <= tolerance
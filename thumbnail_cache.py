@@ -0,0 +1,111 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+import result_cache
+
+DEFAULT_CACHE_DIR = '.thumbnail_cache'
+DEFAULT_SIZE = 256
+DEFAULT_MEMORY_ITEMS = 1024
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 MB of thumbnails on disk
+THUMBNAIL_QUALITY = 85
+
+
+def make_thumbnail(image_path, size=DEFAULT_SIZE):
+    """
+    JPEG bytes of a thumbnail that fits in size x size.
+
+    JPEGs are decoded in draft mode, which lets libjpeg scale by 1/2-1/8
+    while decoding, so a 40 MP photo is never decoded at full resolution.
+    """
+    with Image.open(image_path) as image:
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.BILINEAR, reducing_gap=2.0)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Two-level thumbnail cache keyed by absolute path, mtime, file size and
+    thumbnail size, so an edited file gets a new thumbnail automatically.
+
+    Recently used thumbnails stay in memory (an LRU of up to memory_items
+    JPEG blobs); all of them are kept on disk in a ResultCache, which does
+    its own LRU eviction once it exceeds max_bytes. Thread-safe, so it can be
+    filled from background threads.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, size=DEFAULT_SIZE, memory_items=DEFAULT_MEMORY_ITEMS,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.size = size
+        self.memory_items = memory_items
+        self.disk = result_cache.ResultCache(root, max_bytes, max_age=None)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(self, image_path):
+        stat = os.stat(image_path)
+        identity = f"{os.path.abspath(image_path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{self.size}"
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get_memory(self, image_path):
+        """The thumbnail if it is in memory, else None; never touches the disk beyond a stat."""
+        try:
+            key = self.key_for(image_path)
+        except OSError:
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def get(self, image_path):
+        """The cached thumbnail (memory, then disk), or None."""
+        key = self.key_for(image_path)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        data = self.disk.get(key)
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def get_or_create(self, image_path):
+        """The thumbnail JPEG bytes, generated and stored on a miss."""
+        data = self.get(image_path)
+        if data is None:
+            data = make_thumbnail(image_path, self.size)
+            key = self.key_for(image_path)
+            self.disk.put(key, data)
+            self._remember(key, data)
+        return data
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Return the process-wide thumbnail cache in DEFAULT_CACHE_DIR, created on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ThumbnailCache()
+        return _shared_cache
@@ -0,0 +1,75 @@
+import os
+import shutil
+import weakref
+import tempfile
+
+# RAM-backed tmpfs on Linux, so scratch files never touch the disk
+TMPFS_ROOT = '/dev/shm'
+
+
+def default_root():
+    """Directory new workspaces are created in: $RESTYLE_WORKSPACE_ROOT, tmpfs if available, else the temp dir."""
+    root = os.environ.get('RESTYLE_WORKSPACE_ROOT')
+    if root:
+        return root
+    if os.path.isdir(TMPFS_ROOT) and os.access(TMPFS_ROOT, os.W_OK):
+        return TMPFS_ROOT
+    return tempfile.gettempdir()
+
+
+class JobWorkspace:
+    """
+    A private scratch directory for one job.
+
+    Every job gets its own directory, so concurrent restyles never share a
+    file name. Artifacts the job produces are recorded by name and returned
+    to the caller with the workspace; close() (or leaving the with block)
+    deletes the directory and everything in it. Workspaces that are never
+    closed are removed when they are garbage collected or at exit.
+    """
+
+    def __init__(self, prefix='restyle-', root=None):
+        root = root or default_root()
+        os.makedirs(root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix=prefix, dir=root)
+        self.artifacts = {}
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"JobWorkspace({self.directory!r}, artifacts={sorted(self.artifacts)})"
+
+    def path(self, name):
+        """Path of a file in the workspace (not recorded as an artifact)."""
+        return os.path.join(self.directory, name)
+
+    def artifact(self, name, filename=None):
+        """Record an artifact and return its path; filename defaults to the name."""
+        path = self.path(filename or name)
+        self.artifacts[name] = path
+        return path
+
+    def write_text(self, name, text, filename=None):
+        """Write text to a new artifact and return its path."""
+        path = self.artifact(name, filename)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def export(self, name, destination):
+        """Copy an artifact out of the workspace so it outlives it; returns the destination."""
+        shutil.copyfile(self.artifacts[name], destination)
+        return destination
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """Delete the workspace directory and everything in it."""
+        self._finalizer()